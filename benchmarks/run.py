@@ -0,0 +1,257 @@
+'''
+	This script is an offline load test and benchmark for the api. For each dataset scale it
+	generates synthetic data (see synthetic.py), serves the site catalog from a local stub server
+	(see stub_server.py) and measures throughput, p50/p95/p99 latency and worker RSS for each
+	endpoint and sample backend.
+
+	Each scale and backend is run in a new process, so one backend's caches and memory are not
+	counted against the next. rss_mb is the process's RSS after a case and rss_delta_mb how much
+	it grew from before the app was imported.
+
+	By default requests are made in-process through Flask's test client, so results measure the
+	app itself and are repeatable. With --host the same request mix is sent to a running server
+	instead. That server should be started with NTN_SAMPLES_FILE and NTN_SITES_URL pointing at
+	the data printed by this script.
+
+	Usage:
+		python -m benchmarks.run [--scales 1 10 100] [--backends memory mmap sqlite] [--requests 200]
+'''
+import argparse
+import json
+import multiprocessing
+import os
+from random import Random
+import shutil
+import tempfile
+import time
+
+import arrow
+import requests
+
+from benchmarks import synthetic
+from benchmarks.stub_server import StubServer
+
+
+def rss_mb():
+    '''
+        Helper function that returns the resident set size of this process in MB.
+    '''
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def timestamp(year, month=1):
+    return arrow.get(year, month, 1).timestamp
+
+
+def request_mix(scale, rng):
+    '''
+        Returns a dictionary of case name -> function(rng) returning the url of one request.
+    '''
+    ids = synthetic.site_ids(scale)
+    first = synthetic.first_year
+    last = synthetic.first_year + synthetic.base_years - 1
+
+    def one_year(rng):
+        year = rng.randint(first, last)
+        return dict(start_date=timestamp(year), end_date=timestamp(year, 12))
+
+    def location(rng):
+        return '({:.4f},{:.4f})'.format(rng.uniform(25, 65), rng.uniform(-150, -65))
+
+    def samples(rng, **params):
+        # sites are selected by site_id unless another selection is given.
+        if not any(key in params for key in ('site_ids', 'state', 'location')):
+            params.setdefault('site_id', rng.choice(ids))
+        for key, value in one_year(rng).items():
+            params.setdefault(key, value)
+        return '/v1.0/ntn/samples/get/by_id/?' + '&'.join('{}={}'.format(key, value) for key, value in params.items())
+
+    return {
+        'samples_json': lambda rng: samples(rng),
+        'samples_json_all_years': lambda rng: samples(rng, start_date=timestamp(first), end_date=timestamp(last, 12)),
+        'samples_ndjson': lambda rng: samples(rng, format='ndjson'),
+        'samples_csv': lambda rng: samples(rng, format='csv'),
+        'samples_20_sites': lambda rng: samples(rng, site_ids=','.join(rng.sample(ids, min(20, len(ids))))),
+        'samples_page': lambda rng: samples(rng, limit=50),
+        'samples_by_state': lambda rng: samples(rng, state=rng.choice(synthetic.states)),
+        'samples_by_location': lambda rng: samples(rng, location=location(rng), radius=400),
+        'aggregate_annual': lambda rng: '/v1.0/ntn/samples/aggregate/?site_id={}&start_date={}&end_date={}&period=annual'.format(
+            rng.choice(ids), timestamp(first), timestamp(last, 12)),
+        'statistics': lambda rng: '/v1.0/ntn/samples/statistics/?site_id={}&analyte={}&start_date={}&end_date={}'.format(
+            rng.choice(ids), rng.choice(['SO4', 'NO3', 'ph']), timestamp(first), timestamp(last, 12)),
+        'site_info': lambda rng: '/v1.0/ntn/site/info/?site_id={}'.format(rng.choice(ids)),
+        'site_by_radius': lambda rng: '/v1.0/ntn/site/info/by_radius/?location={}&radius=200'.format(location(rng)),
+        'site_nearest': lambda rng: '/v1.0/ntn/site/nearest/?location={}&k=5'.format(location(rng)),
+        'site_search': lambda rng: '/v1.0/ntn/site/search/?state={}&status=A'.format(rng.choice(synthetic.states)),
+        'site_search_bbox': lambda rng: '/v1.0/ntn/site/search/?bbox=({:.4f},{:.4f},{:.4f},{:.4f})'.format(
+            *(lambda lat, lon: (lat, lon, lat + 10, lon + 20))(rng.uniform(25, 55), rng.uniform(-150, -85))),
+    }
+
+
+class InProcessClient:
+    '''
+        Sends requests to index.app through Flask's test client, configured to use the generated
+        data.
+    '''
+
+    def __init__(self, samples_path, sites_url, cache_dir, backend, cold):
+        import index
+        from common import sample_db, site_catalog
+
+        self.index = index
+        self.cold = cold
+        index.ntn_samples_file = samples_path
+        index.ntn_sites_url = sites_url
+        index.app.config['SAMPLE_BACKEND'] = backend
+        site_catalog.cache_dir = cache_dir
+
+        if backend == 'sqlite':
+            index.ntn_samples_db = os.path.join(os.path.dirname(samples_path), 'ntn_samples.db')
+            sample_db.ingest(samples_path, index.ntn_samples_db)
+
+        # as a worker does when it starts.
+        index.load_samples()
+        self.client = index.app.test_client()
+
+    def get(self, url):
+        if self.cold:
+            self.index.response_cache.clear()
+
+        response = self.client.get(url)
+        response.get_data()
+
+        return response.status_code
+
+
+class HTTPClient:
+    '''
+        Sends requests to a running server.
+    '''
+
+    def __init__(self, host):
+        self.host = host.rstrip('/')
+        self.session = requests.Session()
+
+    def get(self, url):
+        response = self.session.get(self.host + url)
+
+        return response.status_code
+
+
+def run_case(client, make_url, count, rng, base_rss=0):
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+
+    for _ in range(count):
+        url = make_url(rng)
+        request_started = time.perf_counter()
+        if client.get(url) != 200:
+            errors += 1
+        latencies.append((time.perf_counter() - request_started) * 1000)
+
+    elapsed = time.perf_counter() - started
+
+    return dict(
+        requests=count,
+        errors=errors,
+        throughput=round(count / elapsed, 1),
+        p50_ms=round(percentile(latencies, 0.50), 2),
+        p95_ms=round(percentile(latencies, 0.95), 2),
+        p99_ms=round(percentile(latencies, 0.99), 2),
+        rss_mb=round(rss_mb(), 1),
+        rss_delta_mb=round(rss_mb() - base_rss, 1),
+    )
+
+
+def run_backend(scale, rows, samples_path, sites_url, directory, backend, host, count, cases, cold, seed):
+    '''
+        Run every case for one scale and backend, in the calling process.
+
+        Returns:
+            Type: list of dictionaries (one result per case)
+    '''
+    base_rss = rss_mb()
+    if host:
+        client = HTTPClient(host)
+    else:
+        client = InProcessClient(samples_path, sites_url, os.path.join(directory, 'site_cache'), backend, cold)
+
+    # the first request loads the dataset and site catalog.
+    started = time.perf_counter()
+    client.get('/v1.0/ntn/site/info/?site_id={}'.format(synthetic.site_ids(scale)[0]))
+    client.get(request_mix(scale, Random(seed))['samples_json'](Random(seed)))
+    load_ms = round((time.perf_counter() - started) * 1000, 1)
+
+    results = []
+    for case, make_url in request_mix(scale, Random(seed)).items():
+        if cases and case not in cases:
+            continue
+        result = run_case(client, make_url, count, Random(seed), base_rss)
+        result.update(scale=scale, rows=rows, backend=backend or host, case=case, load_ms=load_ms)
+        results.append(result)
+        print('  {backend:<8} {case:<24} {throughput:>9} req/s  p50 {p50_ms:>8} ms  p95 {p95_ms:>8} ms  '
+              'p99 {p99_ms:>8} ms  rss {rss_mb:>7} MB (+{rss_delta_mb:>6})  errors {errors}'.format(**result), flush=True)
+
+    return results
+
+
+def benchmark(scales, backends, count, cases=None, host=None, cold=True, seed=2300):
+    '''
+        Run every case for every scale and backend, each scale and backend in a new process.
+
+        Returns:
+            Type: list of dictionaries (one result per scale, backend and case)
+    '''
+    results = []
+    context = multiprocessing.get_context('spawn')
+
+    for scale in scales:
+        directory = tempfile.mkdtemp(prefix='ntn_bench_{}x_'.format(scale))
+        samples_path, sites_path, rows = synthetic.generate(directory, scale, seed)
+        with open(sites_path, 'rb') as sites_file:
+            stub = StubServer(sites_file.read()).start()
+
+        print('scale {}x: {} samples, {} sites in {}. Sites served at {}'.format(
+            scale, rows, len(synthetic.site_ids(scale)), directory, stub.url))
+
+        try:
+            for backend in ([None] if host else backends):
+                with context.Pool(1) as pool:
+                    results += pool.apply(run_backend, (scale, rows, samples_path, stub.url, directory, backend, host,
+                                                        count, cases, cold, seed))
+        finally:
+            stub.stop()
+            shutil.rmtree(directory, ignore_errors=True)
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the api against synthetic NTN data.')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--backends', nargs='+', default=['memory', 'mmap', 'sqlite'])
+    parser.add_argument('--cases', nargs='+', help='only run these cases')
+    parser.add_argument('--requests', type=int, default=200, help='requests per case')
+    parser.add_argument('--host', help='benchmark a running server instead of the in-process app')
+    parser.add_argument('--warm-cache', action='store_true', help='keep the response cache between requests')
+    parser.add_argument('--output', help='write results to this file as json')
+    parser.add_argument('--seed', type=int, default=2300)
+    args = parser.parse_args()
+
+    results = benchmark(args.scales, args.backends, args.requests, args.cases, args.host, not args.warm_cache, args.seed)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as output:
+            json.dump(results, output, indent=2)
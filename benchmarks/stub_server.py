@@ -0,0 +1,84 @@
+'''
+	This script contains a local stand-in for nadp.slh.wisc.edu, so the api can be exercised without
+	network access. It serves a body (such as a site catalog csv) at any path, answering
+	conditional GETs with a 304 the way the real upstream's ETags allow.
+
+	Usage:
+		python -m benchmarks.stub_server <file> [--port 8300]
+'''
+import argparse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import hashlib
+import threading
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    '''
+        Serves server.body with an ETag, or a 503 while server.fail is set.
+    '''
+
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        body = self.server.body
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+
+        if self.server.fail:
+            self.send_response(503)
+            self.end_headers()
+        elif self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+        else:
+            self.send_response(200)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Type', self.server.content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(HTTPServer):
+    '''
+        An HTTPServer serving body from a background thread.
+
+        Input variables:
+            'body':
+                Type: bytes or string,
+    '''
+
+    def __init__(self, body, port=0, content_type='text/csv'):
+        super().__init__(('127.0.0.1', port), StubHandler)
+        self.set_body(body)
+        self.content_type = content_type
+        self.fail = False
+        self.requests = []
+        self.url = 'http://127.0.0.1:{}/data/sites/CSV/?net=NTN'.format(self.server_port)
+
+    def set_body(self, body):
+        self.body = body.encode('utf8') if isinstance(body, str) else body
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a file as a stand-in for nadp.slh.wisc.edu.')
+    parser.add_argument('file')
+    parser.add_argument('--port', type=int, default=8300)
+    args = parser.parse_args()
+
+    with open(args.file, 'rb') as body_file:
+        server = StubServer(body_file.read(), port=args.port)
+    print('Serving {} at {}'.format(args.file, server.url))
+    server.serve_forever()
@@ -0,0 +1,129 @@
+'''
+	This script generates synthetic NTN data for benchmarks: a site catalog csv in the format served
+	by http://nadp.slh.wisc.edu/data/sites/CSV/?net=NTN and a weekly NTN-All-w.csv. Output is
+	deterministic for a given scale and seed.
+
+	Usage:
+		python -m benchmarks.synthetic <output directory> [--scale 10]
+'''
+import argparse
+import csv
+import os
+from random import Random
+
+import arrow
+
+samples_header = ['siteID', 'labno', 'dateon', 'dateoff', 'yrmonth', 'ppt', 'subppt', 'svol',
+                  'flagCa', 'flagMg', 'flagK', 'flagNa', 'flagNH4', 'flagNO3', 'flagCl', 'flagSO4',
+                  'flagBr', 'valcode', 'invalcode', 'ph', 'Conduc', 'Ca', 'Mg', 'K', 'Na', 'NH4',
+                  'NO3', 'Cl', 'SO4', 'Br', 'modifiedOn']
+sites_header = ['siteid', 'network', 'siteName', 'county', 'state', 'latitude', 'longitude', 'elevation',
+                'startdate', 'stopdate', 'status']
+states = ['AK', 'AL', 'AZ', 'CA', 'CO', 'FL', 'IL', 'MN', 'NY', 'TX', 'WA', 'WI', 'WY', 'AB', 'ON']
+
+# At scale 1 there are base_sites sites with base_years of weekly samples each. Scaling multiplies
+# the number of sites, so the size of a single site's history stays realistic.
+base_sites = 25
+base_years = 10
+first_year = 2006
+
+
+digits = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+
+def site_ids(scale):
+    '''
+        Returns base_sites * scale unique 4 character site ids: a state code followed by two base
+        36 digits.
+    '''
+    ids = []
+
+    for i in range(base_sites * scale):
+        number = i // len(states)
+        ids.append(states[i % len(states)] + digits[number // 36] + digits[number % 36])
+
+    return ids
+
+
+def write_sites(path, scale, seed=2300):
+    '''
+        Write a site catalog csv with base_sites * scale sites scattered over North America.
+    '''
+    rng = Random(seed)
+
+    with open(path, 'w', encoding='utf8', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(sites_header)
+        for i, site_id in enumerate(site_ids(scale)):
+            status = 'I' if i % 10 == 9 else 'A'
+            writer.writerow([site_id, 'NTN', 'Site {}'.format(site_id), 'County', site_id[:2],
+                             '{:.4f}'.format(rng.uniform(25, 65)), '{:.4f}'.format(rng.uniform(-150, -65)),
+                             rng.randint(0, 3000), '{}-01-01 05:00'.format(first_year),
+                             '{}-01-01 05:00'.format(first_year + base_years) if status == 'I' else '', status])
+
+
+def write_samples(path, scale, seed=2300):
+    '''
+        Write an NTN-All-w.csv with base_years of weekly samples for every site, interleaved by
+        week the way the published file is ordered. Roughly one sample in ten carries the -9
+        sentinel or an invalcode.
+
+        Returns:
+            Type: integer (number of rows written)
+    '''
+    rng = Random(seed)
+    ids = site_ids(scale)
+    start = arrow.get('{}-01-03T08:00:00'.format(first_year))
+    count = 0
+
+    with open(path, 'w', encoding='utf8', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(samples_header)
+
+        for week in range(base_years * 52):
+            dateon = start.shift(weeks=week)
+            dateoff = dateon.shift(days=7)
+            for i, site_id in enumerate(ids):
+                missing = rng.random() < 0.05
+                ppt = rng.choice(['0.000', '-7.000']) if rng.random() < 0.05 else '{:.3f}'.format(rng.uniform(0, 50))
+                values = ['-9.000' if missing else '{:.3f}'.format(rng.uniform(0, 3)) for _ in range(8)]
+
+                writer.writerow([
+                    site_id, '{}{:04d}{:02d}'.format(site_id[:2], week, i % 100), dateon.format('YYYY-MM-DD HH:mm'),
+                    dateoff.format('YYYY-MM-DD HH:mm'), dateoff.format('YYYYMM'), ppt, ppt,
+                    '{:.3f}'.format(rng.uniform(0, 3000)), ' ', ' ', ' ', ' ', rng.choice([' ', '<']), ' ', ' ', ' ', '0',
+                    'w ', 'c           ' if rng.random() < 0.05 else '            ',
+                    '-9.000' if missing else '{:.2f}'.format(rng.uniform(4, 7)),
+                    '-9.000' if missing else '{:.1f}'.format(rng.uniform(1, 60)),
+                ] + values + ['-9' if missing else '{:.3f}'.format(rng.uniform(0, 0.1)), ''])
+                count += 1
+
+    return count
+
+
+def generate(directory, scale, seed=2300):
+    '''
+        Write sites.csv and NTN-All-w.csv for a scale into directory.
+
+        Returns:
+            Type: tuple(samples path, sites path, number of samples)
+    '''
+    os.makedirs(directory, exist_ok=True)
+    samples_path = os.path.join(directory, 'NTN-All-w.csv')
+    sites_path = os.path.join(directory, 'sites.csv')
+
+    write_sites(sites_path, scale, seed)
+    count = write_samples(samples_path, scale, seed)
+
+    return samples_path, sites_path, count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate synthetic NTN data.')
+    parser.add_argument('directory')
+    parser.add_argument('--scale', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=2300)
+    args = parser.parse_args()
+
+    samples_path, sites_path, count = generate(args.directory, args.scale, args.seed)
+    print('Wrote {} samples to {} and {} sites to {}.'.format(count, samples_path, base_sites * args.scale, sites_path))
@@ -0,0 +1,221 @@
+'''
+	This script contains compact, typed column encodings for the NTN weekly samples. A csv column is
+	stored in the smallest encoding that gives back every value exactly as it appears in the file:
+
+		- IntColumn: fixed width digits (yrmonth), as int32.
+		- NumericColumn: decimals (ppt, concentrations), as float32 (float64 if float32 cannot hold
+		  them) plus the number of decimal places of each value, so "-9" and "-9.000" both render as
+		  written. Blank values are stored as NaN, and negative values (-9 and -7 are the NTN
+		  missing value sentinels) are reported as missing by missing().
+		- CodedColumn: low cardinality text (site ids, flags, dates), as small integer codes into a
+		  sorted list of distinct values.
+		- TextColumn: high cardinality text (labno), as a fixed width utf8 byte array.
+'''
+import bisect
+import re
+
+import numpy
+
+# Columns always returned, whatever fields are asked for: they key and order the samples.
+key_columns = ('siteID', 'labno', 'yrmonth')
+
+numeric_pattern = re.compile(r'-?\d+(\.\d+)?$')
+digits_pattern = re.compile(r'\d+$')
+
+# Most decimal places a NumericColumn stores. Index -1 (a blank value) renders as ''.
+max_decimals = 9
+decimal_formats = ['{{:.{}f}}'.format(places) for places in range(max_decimals + 1)] + ['']
+
+
+def code_dtype(count):
+    '''
+        Helper function that returns the smallest unsigned integer type that can index count values.
+    '''
+    if count <= 1 << 8:
+        return numpy.uint8
+    if count <= 1 << 16:
+        return numpy.uint16
+
+    return numpy.uint32
+
+
+class IntColumn:
+    '''
+        Zero padded integers of one width, such as yrmonth.
+    '''
+
+    def __init__(self, values, width):
+        self.values = values
+        self.width = width
+        self.format = '{{:0{}d}}'.format(width)
+
+    @classmethod
+    def encode(cls, strings):
+        width = len(strings[0]) if strings else 0
+        if not 0 < width <= 9 or any(len(value) != width or not digits_pattern.match(value) for value in strings):
+            return None
+
+        return cls(numpy.array([int(value) for value in strings], dtype=numpy.int32), width)
+
+    def take(self, order):
+        return IntColumn(self.values[order], self.width)
+
+    def render(self, start, end):
+        return [self.format.format(value) for value in self.values[start:end].tolist()]
+
+    def search(self, value, start, end, side='left'):
+        '''
+            Returns the position value would be inserted at in the sorted rows start - end.
+        '''
+        return start + int(numpy.searchsorted(self.values[start:end], int(value), side=side))
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes
+
+
+class NumericColumn:
+    '''
+        Decimal numbers, with the decimal places of each value kept so it renders as written.
+    '''
+
+    def __init__(self, values, decimals):
+        self.values = values
+        self.decimals = decimals
+
+    @classmethod
+    def encode(cls, strings):
+        if any(value and not numeric_pattern.match(value) for value in strings):
+            return None
+
+        places = [len(value.partition('.')[2]) if value else -1 for value in strings]
+        if places and max(places) > max_decimals:
+            return None
+
+        decimals = numpy.array(places, dtype=numpy.int8)
+
+        numbers = [float(value) if value else float('nan') for value in strings]
+
+        for dtype in (numpy.float32, numpy.float64):
+            column = cls(numpy.array(numbers, dtype=dtype), decimals)
+            if column.render(0, len(strings)) == list(strings):
+                return column
+
+        return None
+
+    def take(self, order):
+        return NumericColumn(self.values[order], self.decimals[order])
+
+    def render(self, start, end):
+        return [decimal_formats[places].format(value)
+                for value, places in zip(self.values[start:end].tolist(), self.decimals[start:end].tolist())]
+
+    def floats(self, start, end):
+        '''
+            Returns the values as float64, each equal to float() of its csv text (a float32 value
+            scaled by 10 ** decimals is an exact float64, so rounds back to the written digits), with
+            missing values as NaN.
+        '''
+        scale = 10.0 ** self.decimals[start:end].clip(0)
+        values = numpy.rint(self.values[start:end] * scale) / scale
+        values[self.missing(start, end)] = numpy.nan
+
+        return values
+
+    def missing(self, start, end):
+        '''
+            Returns a boolean array that is True for blank values and negative (sentinel) values.
+        '''
+        values = self.values[start:end]
+
+        return numpy.isnan(values) | (values < 0)
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + self.decimals.nbytes
+
+
+class CodedColumn:
+    '''
+        Text with few distinct values, stored as codes into a sorted list of them, so codes sort in
+        the same order as the text they stand for.
+    '''
+
+    def __init__(self, codes, distinct):
+        self.codes = codes
+        self.distinct = distinct
+
+    @classmethod
+    def encode(cls, strings):
+        distinct = sorted(set(strings))
+        lookup = {value: code for code, value in enumerate(distinct)}
+
+        return cls(numpy.array([lookup[value] for value in strings], dtype=code_dtype(len(distinct))), distinct)
+
+    def take(self, order):
+        return CodedColumn(self.codes[order], self.distinct)
+
+    def render(self, start, end):
+        distinct = self.distinct
+
+        return [distinct[code] for code in self.codes[start:end].tolist()]
+
+    def search(self, value, start, end, side='left'):
+        '''
+            Returns the position value would be inserted at in the sorted rows start - end.
+        '''
+        bisect_distinct = bisect.bisect_left if side == 'left' else bisect.bisect_right
+
+        return start + int(numpy.searchsorted(self.codes[start:end], bisect_distinct(self.distinct, value)))
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + sum(len(value) + 49 for value in self.distinct)
+
+
+class TextColumn:
+    '''
+        Text with mostly distinct values, stored as a fixed width array of utf8 bytes.
+    '''
+
+    def __init__(self, values):
+        self.values = values
+
+    @classmethod
+    def encode(cls, strings):
+        encoded = [value.encode('utf8') for value in strings]
+        # numpy drops trailing NUL bytes, so such values could not be given back.
+        if any(value.endswith(b'\0') for value in encoded):
+            return None
+
+        return cls(numpy.array(encoded, dtype=bytes))
+
+    def take(self, order):
+        return TextColumn(self.values[order])
+
+    def render(self, start, end):
+        return [value.decode('utf8') for value in self.values[start:end].tolist()]
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes
+
+
+def encode(strings):
+    '''
+        Encode a column of csv values in the most compact encoding that renders them back exactly.
+
+        Input variables:
+            'strings':
+                Type: list of strings,
+        Returns:
+            Type: IntColumn, NumericColumn, CodedColumn or TextColumn
+    '''
+    column = IntColumn.encode(strings) or NumericColumn.encode(strings)
+    if column is not None:
+        return column
+
+    if len(set(strings)) <= max(len(strings) // 2, 1 << 8):
+        return CodedColumn.encode(strings)
+
+    return TextColumn.encode(strings) or CodedColumn.encode(strings)
@@ -0,0 +1,133 @@
+'''
+	This script contains response compression negotiated from the request's Accept-Encoding header.
+	Brotli is offered when the brotli package is installed, gzip always. Generated responses are
+	compressed as they are streamed; cached responses keep their compressed bytes (see
+	common/response_cache.py) so each is only compressed once per encoding.
+'''
+import gzip
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this are sent as they are, compressing them saves less than it costs.
+min_size = 1024
+compressible_types = ('application/json', 'application/x-ndjson', 'text/csv', 'text/plain')
+
+gzip_level = 6
+brotli_quality = 5
+
+# Input collected before a streamed response is flushed to the client.
+stream_flush_size = 64 * 1024
+
+
+def available_encodings():
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def negotiate():
+    '''
+        Helper function that returns the best encoding the current request accepts, or None for
+        an uncompressed response.
+
+        Returns:
+            Type: string (br or gzip) or None
+    '''
+    encoding = request.accept_encodings.best_match(available_encodings())
+
+    return encoding if encoding in available_encodings() else None
+
+
+def compress(body, encoding):
+    '''
+        Compress a complete body.
+
+        Input variables:
+            'body':
+                Type: bytes,
+            'encoding':
+                Type: string (br or gzip),
+        Returns:
+            Type: bytes
+    '''
+    if encoding == 'br':
+        return brotli.compress(body, quality=brotli_quality)
+
+    return gzip.compress(body, compresslevel=gzip_level)
+
+
+def compress_stream(chunks, encoding):
+    '''
+        Generator that compresses an iterable of chunks as it is consumed, flushing whenever
+        stream_flush_size bytes of input have been collected so clients receive data while the
+        response is still being generated.
+
+        Input variables:
+            'chunks':
+                Type: iterable of bytes or strings,
+            'encoding':
+                Type: string (br or gzip),
+        Returns:
+            Type: generator of bytes
+    '''
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=brotli_quality)
+        process, flush, finish = compressor.process, compressor.flush, compressor.finish
+    else:
+        # wbits=31 writes a gzip header and trailer around the deflate stream.
+        compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+        process, finish = compressor.compress, compressor.flush
+        flush = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    pending = 0
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf8')
+
+        output = process(chunk)
+        pending += len(chunk)
+        if pending >= stream_flush_size:
+            output += flush()
+            pending = 0
+
+        if output:
+            yield output
+
+    yield finish()
+
+
+def compress_response(response):
+    '''
+        after_request handler that compresses responses the client accepts compressed. Responses
+        that already have a Content-Encoding (such as cached ones) are left alone.
+    '''
+    if response.status_code < 200 or response.status_code in (204, 304) \
+            or response.direct_passthrough or 'Content-Encoding' in response.headers \
+            or response.mimetype not in compressible_types:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate()
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < min_size:
+            return response
+        response.set_data(compress(body, encoding))
+
+    response.headers['Content-Encoding'] = encoding
+
+    return response
+
+
+def init_app(app):
+    app.after_request(compress_response)
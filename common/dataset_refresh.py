@@ -0,0 +1,306 @@
+'''
+	This script contains a background refresher for NTN-All-w.csv and the site catalog. On a fixed
+	interval it fetches the weekly samples from a url with a conditional GET, validates the download
+	and builds the configured sample backend from it, all off the request path. Validating and
+	building run in a separate process, so they do not hold the worker's GIL while it serves
+	requests, and the worker only loads what was built. The new file and backend are then swapped in
+	at once. Requests already running keep the backend object they started with, so they finish on
+	the old version of the data.
+'''
+import csv
+import email.utils
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+from common import http_client, metrics, sample_db, sample_index, sample_store, site_catalog
+
+log = logging.getLogger('logger')
+
+required_columns = ('siteID', 'yrmonth', 'labno')
+source_suffix = '.source'
+download_suffix = '.download'
+
+refreshes = metrics.registry.register(metrics.Counter(
+    'ntn_dataset_refreshes_total', 'Background dataset refreshes, by dataset and result.', ('dataset', 'result')))
+
+
+def validate_samples(path, fieldnames=None):
+    '''
+        Helper function that checks a downloaded csv looks like NTN-All-w.csv before it replaces
+        the current one.
+
+        Input variables:
+            'path':
+                Type: string,
+            'fieldnames':
+                Type: list of strings (columns of the current file, if any, which the new file must keep),
+        Returns:
+            Type: integer (number of rows)
+        Raises:
+            ValueError if the file is not a usable samples csv.
+    '''
+    count = 0
+
+    with open(path, 'r', encoding='utf8', newline='') as csvfile:
+        reader = csv.reader(csvfile)
+        header = next(reader, None)
+
+        if not header or any(column not in header for column in required_columns):
+            raise ValueError('{} is missing one of the columns {}.'.format(path, ', '.join(required_columns)))
+        if fieldnames and any(column not in header for column in fieldnames):
+            raise ValueError('{} dropped columns found in the current dataset.'.format(path))
+
+        yrmonth_column = header.index('yrmonth')
+        for row in reader:
+            if not row:
+                continue
+            if len(row) != len(header):
+                raise ValueError('Line {} of {} has {} fields, expected {}.'.format(
+                    reader.line_num, path, len(row), len(header)))
+            if len(row[yrmonth_column]) != 6 or not row[yrmonth_column].isdigit():
+                raise ValueError('Line {} of {} has an invalid yrmonth.'.format(reader.line_num, path))
+            count += 1
+
+    if not count:
+        raise ValueError('{} has no samples.'.format(path))
+
+    return count
+
+
+def build_samples(download_path, backend, db_path=None, fieldnames=None):
+    '''
+        Validate a downloaded csv and build what each backend reads from it: the sample index
+        sidecar file, the database for the sqlite backend and the store for the memory backend.
+        Run in a separate process by DatasetRefresher.build.
+
+        Returns:
+            Type: tuple(integer (number of rows), SampleStore or None)
+        Raises:
+            ValueError if the file is not a usable samples csv.
+    '''
+    count = validate_samples(download_path, fieldnames)
+    sample_index.SampleIndex(download_path)
+
+    if backend == 'sqlite':
+        # ingest builds the database aside and renames it into place itself.
+        sample_db.ingest(download_path, db_path)
+    elif backend != 'mmap':
+        # the store is sent back to the worker, which only has to unpickle its arrays.
+        return count, sample_store.SampleStore(download_path)
+
+    return count, None
+
+
+class DatasetRefresher:
+    '''
+        Periodically refreshes the weekly samples (and site catalog) used by the api.
+
+        Input variables:
+            'samples_url':
+                Type: string (where NTN-All-w.csv is downloaded from),
+            'samples_path':
+                Type: string (the csv the sample backends read),
+            'backend':
+                Type: string (memory, mmap or sqlite, see SAMPLE_BACKEND),
+            'db_path':
+                Type: string (the database the sqlite backend reads),
+            'sites_url':
+                Type: string (site catalog refreshed on the same schedule, if given),
+            'interval':
+                Type: float (seconds between checks for a new dataset),
+            'timeout':
+                Type: float or tuple(connect, read) (seconds to wait on the upstream),
+    '''
+
+    def __init__(self, samples_url, samples_path, backend='memory', db_path=None, sites_url=None,
+                 interval=86400, timeout=(http_client.default_timeout[0], 60)):
+        self.samples_url = samples_url
+        self.samples_path = samples_path
+        self.backend = backend
+        self.db_path = db_path
+        self.sites_url = sites_url
+        self.interval = interval
+        self.timeout = timeout
+
+        self.source_path = samples_path + source_suffix
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def source(self):
+        '''
+            Returns what is known about the download the current csv came from (etag,
+            last_modified and when the upstream was last checked).
+        '''
+        try:
+            with open(self.source_path, 'r', encoding='utf8') as source_file:
+                source = json.load(source_file)
+            if source.get('url') == self.samples_url:
+                return source
+        except (OSError, ValueError):
+            pass
+
+        return dict(url=self.samples_url, etag=None, last_modified=None, checked_at=0)
+
+    def save_source(self, source):
+        tmp_path = '{}.{}.tmp'.format(self.source_path, os.getpid())
+        with open(tmp_path, 'w', encoding='utf8') as source_file:
+            json.dump(source, source_file)
+        os.replace(tmp_path, self.source_path)
+
+    def download(self, source):
+        '''
+            Fetch the samples csv to a temporary file next to samples_path.
+
+            Returns:
+                Type: tuple(path of the downloaded file, etag, last_modified) or None if the
+                      upstream has not changed
+        '''
+        headers = {}
+        if os.path.exists(self.samples_path):
+            if source['etag']:
+                headers['If-None-Match'] = source['etag']
+            if source['last_modified']:
+                headers['If-Modified-Since'] = source['last_modified']
+            elif not source['etag']:
+                # the csv shipped with the image: only download something newer than it.
+                headers['If-Modified-Since'] = email.utils.formatdate(os.path.getmtime(self.samples_path),
+                                                                      usegmt=True)
+
+        with http_client.get(self.samples_url, headers=headers, timeout=self.timeout, stream=True) as response:
+            if response.status_code == 304:
+                return None
+            response.raise_for_status()
+
+            download_path = '{}{}.{}'.format(self.samples_path, download_suffix, os.getpid())
+            with open(download_path, 'wb') as download_file:
+                for chunk in response.iter_content(chunk_size=1024 * 1024):
+                    download_file.write(chunk)
+
+        return download_path, response.headers.get('ETag'), response.headers.get('Last-Modified')
+
+    def current_fieldnames(self):
+        if not os.path.exists(self.samples_path):
+            return None
+
+        with open(self.samples_path, 'r', encoding='utf8', newline='') as csvfile:
+            return next(csv.reader(csvfile), None)
+
+    def build(self, download_path):
+        '''
+            Validate and build a download in a new process (see build_samples).
+        '''
+        with multiprocessing.get_context('spawn').Pool(1) as pool:
+            return pool.apply(build_samples, (download_path, self.backend, self.db_path, self.current_fieldnames()))
+
+    def install(self, download_path, store=None):
+        '''
+            Move a built download over samples_path and make the new backend and the sample index
+            current. The index serves csv responses whatever the backend, so its sidecar is built
+            with every backend and only loaded here. Renaming keeps a file's mtime and size, so
+            their versions already match the file they are installed for.
+        '''
+        os.replace(download_path + sample_index.index_suffix, self.samples_path + sample_index.index_suffix)
+        os.replace(download_path, self.samples_path)
+        index = sample_index.SampleIndex(self.samples_path)
+        sample_index.set_index(self.samples_path, index)
+
+        if self.backend == 'sqlite':
+            samples = sample_db.get_database(self.db_path)
+        elif self.backend == 'mmap':
+            samples = index
+        else:
+            samples = store
+            samples.path = self.samples_path
+            sample_store.set_store(self.samples_path, samples)
+
+        return samples
+
+    def refresh_samples(self):
+        '''
+            Check the upstream for a new samples csv and install it if there is one.
+
+            Returns:
+                Type: string (updated, not_modified, invalid or failed)
+        '''
+        source = self.source()
+        download_path = None
+        result = 'failed'
+
+        try:
+            downloaded = self.download(source)
+
+            if downloaded is None:
+                result = 'not_modified'
+            else:
+                download_path, etag, last_modified = downloaded
+                count, store = self.build(download_path)
+                self.install(download_path, store)
+                download_path = None
+                # only remembered once installed, so a rejected download is fetched again next time.
+                source.update(etag=etag, last_modified=last_modified)
+                result = 'updated'
+                log.info('Installed {} ({} samples) from {}'.format(self.samples_path, count, self.samples_url))
+        except ValueError as e:
+            result = 'invalid'
+            log.error(e)
+        except Exception as e:
+            log.error(e)
+        finally:
+            if download_path is not None:
+                for path in (download_path, download_path + sample_index.index_suffix):
+                    if os.path.exists(path):
+                        os.remove(path)
+
+        # a failed check is retried on the next interval rather than immediately.
+        source['checked_at'] = time.time()
+        self.save_source(source)
+        refreshes.inc(dataset='samples', result=result)
+
+        return result
+
+    def refresh_sites(self):
+        catalog = site_catalog.get_catalog(self.sites_url)
+        result = 'updated' if catalog.refresh() else 'failed'
+        refreshes.inc(dataset='sites', result=result)
+
+        return result
+
+    def refresh(self):
+        '''
+            Refresh the samples and, if configured, the site catalog. Only one refresh runs at a time.
+        '''
+        with self._lock:
+            if self.sites_url:
+                self.refresh_sites()
+
+            return self.refresh_samples()
+
+    def run(self):
+        while not self._stop.is_set():
+            due = self.source()['checked_at'] + self.interval - time.time()
+
+            # workers are recycled often (see --max-requests), so a new worker picks up the
+            # schedule of the last check instead of fetching on every start.
+            if due > 0:
+                self._stop.wait(min(due, self.interval))
+                continue
+
+            self.refresh()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, name='dataset-refresh', daemon=True)
+            self._thread.start()
+
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
@@ -7,6 +7,20 @@ error_codes = {
     '01x005': 'Invalid include_inactive. Value must be a boolean value (True or False).',
     '01x006': 'Invalid location. Value must be a tuple of floats values.',
     '01x007': 'Invalid or missing {key}. Value must be a float value greater than {minimum} and less than {maximum}.',
+    '01x008': 'Invalid format. Value must be one of: {formats}.',
+    '01x009': 'Invalid site_ids. Value must be a comma separated list of 1 to {maximum} valid 4 character site ids.',
+    '01x010': 'Invalid state. Value must be a 2 character state or province code.',
+    '01x011': 'Invalid site selection. Only one of site_id, site_ids, state or location may be provided.',
+    '01x012': 'Invalid period. Value must be one of: {periods}.',
+    '01x013': 'Invalid analytes. Value must be a comma separated list of: {analytes}.',
+    '01x014': 'Invalid cursor. Value must be a next_cursor returned by a previous request.',
+    '01x015': 'Invalid format. limit and cursor can only be used with format=json.',
+    '01x016': 'Invalid fields. Value must be a comma separated list of: {fields}.',
+    '01x017': 'Invalid format. fields can only be used with format=json or format=ndjson.',
+    '01x018': 'Invalid bbox. Value must be a tuple of float values (min_latitude, min_longitude, max_latitude, max_longitude).',
+    '01x019': 'Invalid status. Value must be A (active) or I (inactive).',
+    '01x020': 'Invalid analyte. Value must be one of: {analytes}.',
+    '01x021': 'Invalid percentiles. Value must be a comma separated list of numbers between 0 and 100.',
     
     '01x999': 'Unknown error occured.',
 }
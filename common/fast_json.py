@@ -0,0 +1,95 @@
+'''
+	This script contains the JSON encoding used for responses. orjson is used when it is installed,
+	falling back to the standard library's json, and both produce the same compact output. Sample
+	rows and site records that do not change between requests are encoded once and kept as bytes,
+	so a response can be assembled by joining these fragments instead of re-encoding every record.
+'''
+import json
+
+from flask import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj, sort_keys=False):
+    '''
+        Helper function that encodes obj as compact, UTF-8 JSON.
+
+        Input variables:
+            'obj':
+                Type: any JSON serializable object,
+            'sort_keys':
+                Type: Boolean,
+        Returns:
+            Type: bytes
+    '''
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+
+    return json.dumps(obj, sort_keys=sort_keys, separators=(',', ':'), ensure_ascii=False).encode('utf8')
+
+
+def join_object(items):
+    '''
+        Helper function that builds a JSON object from (key, encoded value) pairs, in the order given.
+
+        Input variables:
+            'items':
+                Type: iterable of tuple(string, bytes),
+        Returns:
+            Type: bytes
+    '''
+    return b'{' + b','.join(dumps(key) + b':' + value for key, value in items) + b'}'
+
+
+def response(obj, status=200):
+    '''
+        Build a json response the way Flask's jsonify does (sorted keys and a trailing newline),
+        using the faster encoder. Values may be bytes from join_object or a fragment cache, which
+        are inserted as already encoded JSON.
+    '''
+    encoded = [(key, value if isinstance(value, bytes) else dumps(value, sort_keys=True))
+               for key, value in sorted(obj.items())]
+
+    return Response(join_object(encoded) + b'\n', status, mimetype='application/json')
+
+
+def sample_fragment(row, columns=None):
+    '''
+        Helper function that encodes a sample row as it appears in a by_id response: every column
+        (or only those in columns) but siteID and labno, which are the keys it is nested under.
+    '''
+    if columns is not None:
+        return dumps({key: row[key] for key in columns if key in row}, sort_keys=True)
+
+    return dumps({key: value for key, value in row.items() if key not in ('siteID', 'labno')}, sort_keys=True)
+
+
+_site_fragments = (None, None)
+
+
+def site_fragments(sites):
+    '''
+        Returns {site_id: encoded site record} for a site catalog, encoding it only when a new
+        catalog (a new dictionary) is passed in.
+    '''
+    global _site_fragments
+
+    if _site_fragments[0] is not sites:
+        _site_fragments = (sites, {site_id: dumps(site, sort_keys=True) for site_id, site in sites.items()})
+
+    return _site_fragments[1]
+
+
+def site_fragment(sites, site_id, columns=None):
+    '''
+        Helper function that returns a site record encoded, from the catalog's fragments, or with
+        only the given columns.
+    '''
+    if columns is None:
+        return site_fragments(sites)[site_id]
+
+    return dumps({key: sites[site_id][key] for key in columns if key in sites[site_id]}, sort_keys=True)
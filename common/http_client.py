@@ -0,0 +1,185 @@
+'''
+	This script contains the HTTP client used for every call to the upstream (nadp.slh.wisc.edu).
+	Calls share one pooled session with keep-alive, are bounded by connect and read timeouts, and
+	are retried a limited number of times with backoff. A circuit breaker per host stops calling an
+	upstream that keeps failing, so callers fail fast and serve the last good data they hold
+	instead of tying up the worker until gunicorn's timeout.
+'''
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from common import metrics
+
+# (connect, read) timeouts in seconds. The read timeout is the longest wait between bytes, not a
+# limit on the whole response.
+default_timeout = (3.05, 10)
+
+# Retries happen inside one call, so keep the worst case (3 connects + 2 reads + backoff) well
+# inside gunicorn's 60 second worker timeout.
+retries = Retry(total=2, connect=2, read=1, status=2, backoff_factor=0.25,
+                status_forcelist=(500, 502, 503, 504), raise_on_status=False)
+
+pool_size = 4
+
+upstream_requests = metrics.registry.register(metrics.Counter(
+    'ntn_upstream_requests_total', 'Calls to the upstream, by host and result.', ('host', 'result')))
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    '''
+        Raised instead of calling a host whose circuit breaker is open.
+    '''
+
+
+class CircuitBreaker:
+    '''
+        Counts consecutive failed calls to a host. After failure_threshold failures the circuit
+        opens and calls are refused for reset_timeout seconds, after which a single trial call is
+        let through: success closes the circuit, failure opens it again.
+
+        Input variables:
+            'failure_threshold':
+                Type: integer,
+            'reset_timeout':
+                Type: float (seconds),
+    '''
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+
+        return 'open'
+
+    def allow(self):
+        '''
+            Returns whether a call may be made now.
+        '''
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._trial:
+                self._trial = True
+                return True
+
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+
+_session = None
+_breakers = {}
+_lock = threading.Lock()
+
+
+def get_session():
+    '''
+        Returns the session shared by every upstream call in this process.
+    '''
+    global _session
+
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+
+    return _session
+
+
+def get_breaker(url):
+    '''
+        Returns the circuit breaker for the host a url points at.
+    '''
+    host = urlsplit(url).netloc
+
+    with _lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = _breakers[host] = CircuitBreaker()
+
+    return breaker
+
+
+def get(url, timeout=default_timeout, **kwargs):
+    '''
+        GET a url through the shared session, unless the host's circuit breaker is open. Responses
+        with a 5xx status (after retries) count as failures.
+
+        Input variables:
+            'url':
+                Type: string,
+            'timeout':
+                Type: float or tuple(connect, read) (seconds),
+        Returns:
+            Type: requests.Response
+        Raises:
+            CircuitOpenError if the host's circuit is open, or the requests exception of a failed call.
+    '''
+    host = urlsplit(url).netloc
+    breaker = get_breaker(url)
+
+    if not breaker.allow():
+        upstream_requests.inc(host=host, result='rejected')
+        raise CircuitOpenError('Circuit open for {}, not calling {}.'.format(host, url))
+
+    try:
+        response = get_session().get(url, timeout=timeout, **kwargs)
+    except requests.exceptions.RequestException:
+        breaker.record_failure()
+        upstream_requests.inc(host=host, result='error')
+        raise
+
+    if response.status_code >= 500:
+        breaker.record_failure()
+        upstream_requests.inc(host=host, result='error')
+    else:
+        breaker.record_success()
+        upstream_requests.inc(host=host, result='ok')
+
+    return response
+
+
+def breaker_states():
+    '''
+        Returns {(host,): 1 if the host's circuit is open or half open, else 0}, for /metrics.
+    '''
+    with _lock:
+        breakers = dict(_breakers)
+
+    return {(host,): int(breaker.state != 'closed') for host, breaker in breakers.items()}
+
+
+metrics.registry.register(metrics.Gauge(
+    'ntn_upstream_circuit_open', 'Whether calls to a host are being refused by its circuit breaker.', ('host',),
+    collect=breaker_states))
@@ -1,16 +1,209 @@
 '''
 	This script is to create a logger object and return it to the script that called it.
+
+	Records are written to the log file by a background listener thread: the logging call only puts
+	the record on a bounded queue, so a request never waits on disk I/O (records are dropped, and
+	counted, if the queue is ever full). Each line is a JSON object that carries the request id,
+	method, path and phase timings of the request it was logged from. Repeats of the same message
+	are rate limited, so an upstream outage that fails every request logs a handful of lines and a
+	count of the rest instead of one line per request.
 '''
+import atexit
+import json
 import logging
+import logging.handlers
+import queue
+import threading
+import time
+import uuid
 
-formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s %(lineno)d')
+from flask import g, has_request_context, request
 
-def get_logger(name, log_file, level=logging.INFO):
-    handler = logging.FileHandler(log_file)
-    handler.setFormatter(formatter)
+from common import metrics
+
+# Records held for the listener thread before new ones are dropped.
+queue_size = 10000
+
+# Each distinct message is logged at most rate_limit_burst times per rate_limit_interval seconds.
+rate_limit_interval = 60
+rate_limit_burst = 5
+
+dropped_records = metrics.registry.register(metrics.Counter(
+    'ntn_log_records_dropped_total', 'Log records not written, by reason.', ('reason',)))
+
+
+class StructuredFormatter(logging.Formatter):
+    '''
+        Formats a record as a single line JSON object, including the request fields added by
+        RequestContextFilter and the count of records RateLimitFilter suppressed before it. Any
+        traceback is already part of the message, as QueueHandler.prepare puts it there.
+    '''
+
+    def format(self, record):
+        entry = dict(
+            time=self.formatTime(record),
+            level=record.levelname,
+            logger=record.name,
+            message=record.getMessage(),
+            lineno=record.lineno,
+        )
+        for key in ('request_id', 'method', 'path', 'elapsed_ms', 'timings', 'suppressed'):
+            if getattr(record, key, None) is not None:
+                entry[key] = getattr(record, key)
+
+        return json.dumps(entry, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    '''
+        Adds the current request's id, method, path, time so far and phase timings (see
+        common/metrics.py) to records logged while handling a request. Runs on the thread that
+        logs, as the listener thread has no request context.
+    '''
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get('request_id')
+            record.method = request.method
+            record.path = request.full_path.rstrip('?')
+
+            started = g.get('request_started')
+            if started is not None:
+                record.elapsed_ms = round((time.perf_counter() - started) * 1000, 3)
+            timings = g.get('phase_timings')
+            if timings:
+                record.timings = {name: round(seconds * 1000, 3) for name, seconds in timings.items()}
+
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    '''
+        Lets through at most burst records with the same level and message every interval
+        seconds. The first record let through after some were suppressed carries their count.
+
+        Input variables:
+            'interval':
+                Type: float (seconds),
+            'burst':
+                Type: integer,
+    '''
+
+    def __init__(self, interval=rate_limit_interval, burst=rate_limit_burst):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        # {(level, message): [window start, records let through, records suppressed]}
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.levelno, str(record.msg)[:200])
+        now = time.monotonic()
+
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                if len(self._windows) >= 1000:
+                    self._windows.clear()
+                suppressed = window[2] if window is not None else 0
+                self._windows[key] = [now, 1, 0]
+            elif window[1] < self.burst:
+                window[1] += 1
+                suppressed = 0
+            else:
+                window[2] += 1
+                dropped_records.inc(reason='rate_limited')
+                return False
+
+        if suppressed:
+            record.suppressed = suppressed
+
+        return True
 
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    '''
+        A QueueHandler that drops records when the queue is full instead of raising or waiting.
+    '''
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped_records.inc(reason='queue_full')
+
+
+_listeners = {}
+_lock = threading.Lock()
+
+
+def get_listener(log_file):
+    '''
+        Returns the queue listener writing to a log file, starting it on first use. Every logger
+        writing to the same file shares it.
+    '''
+    with _lock:
+        listener = _listeners.get(log_file)
+        if listener is None:
+            handler = logging.FileHandler(log_file)
+            handler.setFormatter(StructuredFormatter())
+            listener = logging.handlers.QueueListener(queue.Queue(queue_size), handler, respect_handler_level=True)
+            listener.start()
+            _listeners[log_file] = listener
+
+    return listener
+
+
+def get_logger(name, log_file, level=logging.INFO):
+    '''
+        Returns the named logger, writing to log_file through a background listener. Calling it
+        again for the same name and file returns the logger as it is, without adding handlers.
+    '''
     logger = logging.getLogger(name)
     logger.setLevel(level)
-    logger.addHandler(handler)
+
+    listener = get_listener(log_file)
+    if not any(getattr(handler, 'queue', None) is listener.queue for handler in logger.handlers):
+        handler = NonBlockingQueueHandler(listener.queue)
+        handler.addFilter(RateLimitFilter())
+        handler.addFilter(RequestContextFilter())
+        logger.addHandler(handler)
 
     return logger
+
+
+def stop():
+    '''
+        Write out the records still queued and stop the listener threads.
+    '''
+    with _lock:
+        listeners = list(_listeners.values())
+        _listeners.clear()
+
+    for listener in listeners:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+
+atexit.register(stop)
+
+
+def init_app(app):
+    '''
+        Give every request made to app an id, taken from its X-Request-ID header or generated,
+        which log records carry and the response echoes back.
+    '''
+
+    @app.before_request
+    def assign_request_id():
+        g.request_id = request.headers.get('X-Request-ID', '')[:64] or uuid.uuid4().hex
+
+    @app.after_request
+    def echo_request_id(response):
+        request_id = g.get('request_id')
+        if request_id:
+            response.headers['X-Request-ID'] = request_id
+
+        return response
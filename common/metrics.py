@@ -0,0 +1,300 @@
+'''
+	This script contains in-process request metrics exposed in the Prometheus text format. Every
+	request records its total latency, and the time spent in each phase of handling it (argument
+	validation, the site catalog fetch, the sample lookup, distance computation and serialization),
+	per endpoint. Counters for cache hits and misses and dataset reloads are kept alongside.
+	Streamed responses (see timed) record the phases of their body when it has been sent, too late
+	for their Server-Timing header.
+
+	Metrics are per process, so with several gunicorn workers each worker reports its own.
+'''
+import bisect
+import contextlib
+import functools
+import threading
+import time
+
+from flask import g, has_request_context, request
+
+# Upper bounds (seconds) of the latency histogram buckets.
+latency_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(labels):
+    '''
+        Helper function that formats a tuple of (name, value) pairs as a Prometheus label set.
+    '''
+    if not labels:
+        return ''
+
+    escaped = (value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, value in labels)
+
+    return '{' + ','.join('{}="{}"'.format(name, value) for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    '''
+        A monotonically increasing count, optionally split by labels.
+
+        Input variables:
+            'name':
+                Type: string,
+            'description':
+                Type: string,
+            'labelnames':
+                Type: tuple of strings,
+    '''
+
+    def __init__(self, name, description, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self.values.get(tuple(str(labels[name]) for name in self.labelnames), 0)
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.description), '# TYPE {} counter'.format(self.name)]
+
+        for key, value in sorted(self.values.items()):
+            lines.append('{}{} {}'.format(self.name, format_labels(tuple(zip(self.labelnames, key))),
+                                          format_value(value)))
+
+        return lines
+
+
+class Histogram:
+    '''
+        A distribution of observed values in cumulative buckets, optionally split by labels.
+
+        Input variables:
+            'name':
+                Type: string,
+            'description':
+                Type: string,
+            'labelnames':
+                Type: tuple of strings,
+            'buckets':
+                Type: tuple of floats (bucket upper bounds, ascending),
+    '''
+
+    def __init__(self, name, description, labelnames=(), buckets=latency_buckets):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            # per label set: [count in each bucket (non-cumulative) plus +Inf, sum]
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts[0][index] += 1
+            counts[1] += value
+
+    def count(self, **labels):
+        counts = self.values.get(tuple(str(labels[name]) for name in self.labelnames))
+
+        return sum(counts[0]) if counts else 0
+
+    def total(self, **labels):
+        counts = self.values.get(tuple(str(labels[name]) for name in self.labelnames))
+
+        return counts[1] if counts else 0.0
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.description), '# TYPE {} histogram'.format(self.name)]
+
+        for key, (counts, total) in sorted(self.values.items()):
+            labels = tuple(zip(self.labelnames, key))
+            cumulative = 0
+
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(self.name, format_labels(labels + (('le', format_value(bound)),)),
+                                                     cumulative))
+
+            lines.append('{}_sum{} {}'.format(self.name, format_labels(labels), format_value(total)))
+            lines.append('{}_count{} {}'.format(self.name, format_labels(labels), cumulative))
+
+        return lines
+
+
+class Gauge:
+    '''
+        A value read when metrics are rendered, from a function returning {label values: value}.
+    '''
+
+    def __init__(self, name, description, labelnames=(), collect=None, kind='gauge'):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+        self.kind = kind
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.description), '# TYPE {} {}'.format(self.name, self.kind)]
+
+        for key, value in sorted(self.collect().items()):
+            lines.append('{}{} {}'.format(self.name, format_labels(tuple(zip(self.labelnames, key))),
+                                          format_value(value)))
+
+        return lines
+
+
+class Registry:
+    '''
+        The metrics a process exposes, rendered in registration order.
+    '''
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+request_latency = registry.register(Histogram(
+    'ntn_request_duration_seconds', 'Time spent handling a request, by endpoint.', ('endpoint', 'status')))
+phase_latency = registry.register(Histogram(
+    'ntn_request_phase_duration_seconds', 'Time spent in each phase of handling a request, by endpoint.',
+    ('endpoint', 'phase')))
+dataset_reloads = registry.register(Counter(
+    'ntn_dataset_reloads_total', 'Number of times a dataset was (re)loaded, by dataset.', ('dataset',)))
+
+
+def endpoint_name():
+    return (request.endpoint or 'unknown') if has_request_context() else 'none'
+
+
+def record_phase(phase, seconds):
+    '''
+        Record time spent in a phase of the current request. Time recorded outside a request
+        (e.g. while warming caches) is not kept.
+    '''
+    if not has_request_context():
+        return
+
+    phase_latency.observe(seconds, endpoint=endpoint_name(), phase=phase)
+    timings = g.setdefault('phase_timings', {})
+    timings[phase] = timings.get(phase, 0.0) + seconds
+
+
+@contextlib.contextmanager
+def phase(name):
+    '''
+        Context manager that records the time spent in its body as a phase of the current request.
+    '''
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(name, time.perf_counter() - started)
+
+
+# Seconds spent in timed iterables on this thread, so an enclosing one can leave them out.
+_streams = threading.local()
+
+
+def timed(iterable, name):
+    '''
+        Generator that yields the items of iterable and records the time spent producing them as
+        a phase of the current request once it is exhausted or closed. Used for streamed
+        response bodies, which run after the endpoint returns, under stream_with_context. Time
+        spent in a timed iterable nested inside this one is only recorded as the inner phase.
+    '''
+    iterator = iter(iterable)
+    seconds = 0.0
+
+    try:
+        while True:
+            nested = getattr(_streams, 'seconds', 0.0)
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed = time.perf_counter() - started
+                seconds += elapsed - (getattr(_streams, 'seconds', 0.0) - nested)
+                _streams.seconds = nested + elapsed
+            yield item
+    finally:
+        record_phase(name, seconds)
+
+
+def validated(endpoint):
+    '''
+        Decorator for endpoints, applied directly below use_kwargs, that records the time from the
+        start of the request to the arguments being parsed and validated as the validation phase.
+    '''
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        started = g.get('request_started')
+        if started is not None:
+            record_phase('validation', time.perf_counter() - started)
+
+        return endpoint(*args, **kwargs)
+
+    return wrapper
+
+
+def init_app(app):
+    '''
+        Record the latency of every request made to app, and add a Server-Timing header with its
+        phase breakdown.
+    '''
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def stop_timer(response):
+        started = g.get('request_started')
+        if started is None:
+            return response
+
+        request_latency.observe(time.perf_counter() - started, endpoint=endpoint_name(), status=response.status_code)
+
+        timings = g.get('phase_timings')
+        if timings:
+            response.headers['Server-Timing'] = ', '.join(
+                '{};dur={:.3f}'.format(name, seconds * 1000) for name, seconds in timings.items())
+
+        return response
+
+
+def render():
+    return registry.render()
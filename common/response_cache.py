@@ -0,0 +1,194 @@
+'''
+	This script contains an in-process LRU cache for endpoint responses. Responses are keyed on the
+	endpoint's validated arguments and the version of the data they were built from, and are
+	served with an ETag and Cache-Control header so clients and nginx can revalidate them (304).
+	Compressed copies of a response are kept with it, made the first time an encoding is asked for.
+	An endpoint that could not build a complete response (a failed lookup) calls no_store, so it is
+	neither cached here nor by clients and nginx.
+'''
+from collections import OrderedDict
+import functools
+import hashlib
+import threading
+
+from flask import g, make_response, request, Response
+
+from common import compression
+
+
+def freeze(value):
+    '''
+        Helper function that converts validated arguments into a hashable, order-independent key.
+    '''
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+
+    return value
+
+
+class CachedResponse:
+    '''
+        The parts of a response needed to rebuild it, and its body compressed with each encoding
+        asked for so far.
+    '''
+    __slots__ = ('body', 'mimetype', 'etag', 'encodings')
+
+    def __init__(self, body, mimetype):
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.encodings = {}
+
+    def __len__(self):
+        return len(self.body) + sum(len(body) for body in self.encodings.values())
+
+    def compressible(self):
+        return len(self.body) >= compression.min_size and self.mimetype in compression.compressible_types
+
+
+class ResponseCache:
+    '''
+        A thread safe LRU cache bounded by both entry count and total body size.
+
+        Input variables:
+            'max_entries':
+                Type: integer,
+            'max_bytes':
+                Type: integer,
+            'max_age':
+                Type: integer (seconds clients and proxies may reuse a response for),
+    '''
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024, max_age=300):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+
+            return entry
+
+    def put(self, key, entry):
+        # never let one response push everything else out.
+        if len(entry) > self.max_bytes // 4:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+
+            self._entries[key] = entry
+            self.size += len(entry)
+            self._evict()
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+            evicted_key, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def encoded(self, key, entry, encoding):
+        '''
+            Returns an entry's body compressed with encoding, compressing it only the first time.
+        '''
+        body = entry.encodings.get(encoding)
+
+        if body is None:
+            body = compression.compress(entry.body, encoding)
+
+            with self._lock:
+                # the entry may have been evicted while it was being compressed.
+                if self._entries.get(key) is entry and encoding not in entry.encodings:
+                    entry.encodings[encoding] = body
+                    self.size += len(body)
+                    self._evict()
+
+        return body
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def no_store(self):
+        '''
+            Mark the response being built for this request as incomplete, so cached does not keep
+            it and sends it with Cache-Control: no-store.
+        '''
+        g.response_no_store = True
+
+    def respond(self, key, entry):
+        '''
+            Build a response for a cache entry, compressed if the request accepts it, answering with
+            a 304 if the request's If-None-Match matches its ETag. Each encoding has its own ETag.
+        '''
+        encoding = compression.negotiate() if entry.compressible() else None
+
+        if encoding is None:
+            response = Response(entry.body, mimetype=entry.mimetype)
+            response.set_etag(entry.etag)
+        else:
+            response = Response(self.encoded(key, entry, encoding), mimetype=entry.mimetype)
+            response.headers['Content-Encoding'] = encoding
+            response.set_etag('{}-{}'.format(entry.etag, encoding))
+
+        if entry.compressible():
+            response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.max_age = self.max_age
+
+        return response.make_conditional(request)
+
+    def cached(self, version):
+        '''
+            Decorator for endpoints, applied below use_kwargs so that it sees the validated and
+            massaged arguments. Only 200 responses the endpoint did not mark with no_store are
+            cached.
+
+            Input variables:
+                'version':
+                    Type: function(kwargs) returning a hashable version of the data the response
+                          for those arguments is built from. A new version is a new cache key,
+                          so entries for old data are never served and age out of the LRU.
+        '''
+        def decorator(endpoint):
+            @functools.wraps(endpoint)
+            def wrapper(*args, **kwargs):
+                key = (endpoint.__name__, freeze(args), freeze(kwargs), version(kwargs))
+                entry = self.get(key)
+
+                if entry is None:
+                    response = make_response(endpoint(*args, **kwargs))
+                    if g.pop('response_no_store', False):
+                        response.cache_control.no_store = True
+                        return response
+                    if response.status_code != 200 or response.is_streamed:
+                        return response
+
+                    entry = CachedResponse(response.get_data(), response.mimetype)
+                    self.put(key, entry)
+
+                return self.respond(key, entry)
+
+            return wrapper
+
+        return decorator
@@ -0,0 +1,374 @@
+'''
+	This script contains monthly and annual rollups of the NTN weekly samples. For every site,
+	period and analyte it keeps the sample count, the sum and the precipitation-weighted sum of
+	the concentrations, so aggregate queries are a lookup instead of a reduction over weekly rows.
+	Rollups are held as numpy arrays with one entry per site and period, and are built when a
+	dataset is loaded or indexed: the in-memory store builds them as it loads, the mmap index and
+	the SQLite database as they are built, and they keep them alongside the index or samples.
+
+	Samples with a non-blank invalcode are left out, as are negative values (-9 marks a missing
+	value in NTN-All-w.csv). pH is weighted through its hydrogen ion concentration.
+'''
+import math
+
+import numpy
+
+analytes = ['Ca', 'Mg', 'K', 'Na', 'NH4', 'NO3', 'Cl', 'SO4', 'Br', 'ph', 'Conduc']
+# The key of a sample's period is its yrmonth // divisor, written with the format.
+periods = {
+    'monthly': (1, '{:06d}'),
+    'annual': (100, '{:04d}'),
+}
+# Rows parsed at once by RollupBuilder.
+chunk_size = 10000
+
+
+def parse_value(value):
+    '''
+        Helper function that returns a sample value as a float, or None if it is missing.
+    '''
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+
+    return value if value >= 0 else None
+
+
+def parse_values(strings):
+    '''
+        Helper function that returns a column of sample values as floats, with missing values
+        (blank, not a number or negative) as NaN.
+
+        Input variables:
+            'strings':
+                Type: list of strings,
+        Returns:
+            Type: numpy array of floats
+    '''
+    try:
+        values = numpy.array([float(value) if value else numpy.nan for value in strings], dtype=float)
+    except ValueError:
+        values = numpy.array([numpy.nan if value is None else value for value in map(parse_value, strings)], dtype=float)
+
+    values[values < 0] = numpy.nan
+
+    return values
+
+
+def to_averaged(analyte, values):
+    '''
+        Returns an analyte's values in the units they are averaged in. pH is averaged through its
+        hydrogen ion concentration (ueq/L), every other analyte as it is.
+
+        Input variables:
+            'analyte':
+                Type: string,
+            'values':
+                Type: float or numpy array of floats,
+    '''
+    return 10 ** (6 - values) if analyte == 'ph' else values
+
+
+def from_averaged(analyte, means):
+    '''
+        Returns means taken of to_averaged values in the analyte's own units, NaN where there is
+        no pH for a mean.
+    '''
+    if analyte != 'ph':
+        return means
+
+    return 6 - numpy.log10(numpy.where(means > 0, means, numpy.nan))
+
+
+def rounded(value):
+    '''
+        Helper function that rounds a statistic for a response, turning NaN into None.
+    '''
+    value = float(value)
+
+    return None if math.isnan(value) else round(value, 4)
+
+
+def summarize(analyte, count, total, weighted_total, weight):
+    '''
+        Returns the count, mean and precipitation-weighted mean of one analyte from its totals,
+        which hold to_averaged values.
+    '''
+    return dict(
+        count=count,
+        mean=rounded(from_averaged(analyte, total / count)),
+        weighted_mean=rounded(from_averaged(analyte, weighted_total / weight)) if weight else None,
+    )
+
+
+class PeriodRollups:
+    '''
+        The rollups of one period for every site. There is one entry per site and period key,
+        grouped by site (site_ids[i] has the entries site_offsets[i] - site_offsets[i + 1]) and
+        sorted by key. count, total, weighted_total and weight have a column per analyte.
+    '''
+    names = ('site_ids', 'site_offsets', 'keys', 'ppt', 'count', 'total', 'weighted_total', 'weight')
+
+    def __init__(self, period, site_ids, site_offsets, keys, ppt, count, total, weighted_total, weight):
+        self.period = period
+        self.site_ids = site_ids
+        self.site_offsets = site_offsets
+        self.keys = keys
+        self.ppt = ppt
+        self.count = count
+        self.total = total
+        self.weighted_total = weighted_total
+        self.weight = weight
+
+        offsets = site_offsets.tolist()
+        self._sites = {site_id: (offsets[code], offsets[code + 1]) for code, site_id in enumerate(site_ids.tolist())}
+
+    @classmethod
+    def build(cls, period, site_ids, codes, yrmonths, ppt, values):
+        '''
+            Reduce the valid samples to one entry per site and period key.
+
+            Input variables:
+                'site_ids':
+                    Type: list of strings (sorted, indexed by codes),
+                'codes':
+                    Type: numpy array of integers (each sample's site),
+                'yrmonths':
+                    Type: numpy array of integers,
+                'ppt':
+                    Type: numpy array of floats (NaN if missing),
+                'values':
+                    Type: list of numpy arrays of floats, one per analyte (NaN if missing),
+            Returns:
+                Type: PeriodRollups
+        '''
+        entries, inverse = numpy.unique(codes.astype(numpy.int64) * 1000000 + yrmonths // periods[period][0],
+                                        return_inverse=True)
+        inverse = inverse.reshape(-1)
+
+        def totals(weights):
+            return numpy.bincount(inverse, weights=weights, minlength=len(entries))
+
+        rained = ppt > 0
+        columns = [[], [], [], []]
+        for column in values:
+            present = ~numpy.isnan(column)
+            weighted = present & rained
+            columns[0].append(totals(present))
+            columns[1].append(totals(numpy.where(present, column, 0.0)))
+            columns[2].append(totals(numpy.where(weighted, column * ppt, 0.0)))
+            columns[3].append(totals(numpy.where(weighted, ppt, 0.0)))
+        count, total, weighted_total, weight = (numpy.stack(column, axis=1) for column in columns)
+
+        return cls(
+            period,
+            numpy.array(site_ids, dtype=str),
+            numpy.searchsorted(entries // 1000000, numpy.arange(len(site_ids) + 1)).astype(numpy.int64),
+            (entries % 1000000).astype(numpy.int32),
+            totals(numpy.nan_to_num(ppt)),
+            count.astype(numpy.int32),
+            total,
+            weighted_total,
+            weight,
+        )
+
+    def lookup(self, site_id, start_date, end_date, selected=None):
+        '''
+            Returns the results for a site's periods within the start_date - end_date window, as
+            {period key: {'ppt': total precipitation, analyte: summarize(...)}}. Analytes without
+            any valid samples in a period are left out of it.
+        '''
+        if site_id not in self._sites:
+            return {}
+
+        divisor, key_format = periods[self.period]
+        site_start, site_end = self._sites[site_id]
+        keys = self.keys[site_start:site_end]
+        start = site_start + int(numpy.searchsorted(keys, int(start_date) // divisor, side='left'))
+        end = site_start + int(numpy.searchsorted(keys, int(end_date) // divisor, side='right'))
+
+        columns = [column for column, analyte in enumerate(analytes) if selected is None or analyte in selected]
+        ppt = self.ppt[start:end].tolist()
+        counts, totals, weighted_totals, weights = (array[start:end].tolist() for array in
+                                                    (self.count, self.total, self.weighted_total, self.weight))
+
+        results = {}
+        for i, key in enumerate(self.keys[start:end].tolist()):
+            result = {'ppt': round(ppt[i], 4)}
+            for column in columns:
+                if counts[i][column]:
+                    result[analytes[column]] = summarize(analytes[column], counts[i][column], totals[i][column],
+                                                         weighted_totals[i][column], weights[i][column])
+            results[key_format.format(key)] = result
+
+        return results
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in self.names)
+
+
+def build_rollups(site_ids, codes, yrmonths, ppt, values):
+    '''
+        Build the rollups of every period from the valid samples of a dataset, given as arrays
+        (see PeriodRollups.build).
+
+        Returns:
+            Type: Dictionary ({period: PeriodRollups})
+    '''
+    values = [to_averaged(analyte, column) for analyte, column in zip(analytes, values)]
+
+    return {period: PeriodRollups.build(period, site_ids, codes, yrmonths, ppt, values) for period in periods}
+
+
+class RollupBuilder:
+    '''
+        Collects the columns rollups are built from one csv row at a time, parsing them
+        chunk_size rows at a time, for backends that scan NTN-All-w.csv as they are built.
+
+        Input variables:
+            'fieldnames':
+                Type: list of strings (the columns of the rows given to add),
+    '''
+
+    def __init__(self, fieldnames):
+        self.positions = {name: fieldnames.index(name) for name in ['siteID', 'yrmonth', 'invalcode', 'ppt'] + analytes
+                          if name in fieldnames}
+        self.width = len(fieldnames)
+        self._site_codes = {}
+        self._rows = []
+        self._chunks = []
+
+    def add(self, row):
+        '''
+            Add a row, given as a list of values in fieldnames order (yrmonth may already be an
+            integer). The list is kept until its chunk is parsed, so must not be changed after.
+        '''
+        self._rows.append(row if len(row) >= self.width else row + [''] * (self.width - len(row)))
+
+        if len(self._rows) >= chunk_size:
+            self.flush()
+
+    def flush(self):
+        rows = self._rows
+        if not rows:
+            return
+
+        def strings(name):
+            return [row[self.positions[name]] for row in rows]
+
+        def numbers(name):
+            return parse_values(strings(name)) if name in self.positions else numpy.full(len(rows), numpy.nan)
+
+        if 'invalcode' in self.positions:
+            valid = numpy.array([not value.strip() for value in strings('invalcode')], dtype=bool)
+        else:
+            valid = numpy.ones(len(rows), dtype=bool)
+        codes = numpy.array([self._site_codes.setdefault(site_id, len(self._site_codes)) for site_id in strings('siteID')],
+                            dtype=numpy.int64)
+        yrmonths = numpy.array([int(yrmonth) if str(yrmonth).isdigit() else -1 for yrmonth in strings('yrmonth')],
+                               dtype=numpy.int64)
+        valid &= yrmonths >= 0
+        values = [numbers(analyte)[valid] for analyte in analytes]
+
+        self._chunks.append((codes[valid], yrmonths[valid], numbers('ppt')[valid], values))
+        self._rows = []
+
+    def build(self):
+        '''
+            Returns the rollups of every row added (see build_rollups).
+        '''
+        self.flush()
+
+        site_ids = sorted(self._site_codes)
+        # codes were given out in the order sites were first seen, renumber them in site id order.
+        renumber = numpy.zeros(len(site_ids), dtype=numpy.int64)
+        renumber[[self._site_codes[site_id] for site_id in site_ids]] = numpy.arange(len(site_ids))
+
+        chunks = self._chunks or [(numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64),
+                                   numpy.zeros(0), [numpy.zeros(0)] * len(analytes))]
+        codes, yrmonths, ppt = (numpy.concatenate(arrays) for arrays in list(zip(*chunks))[:3])
+        values = [numpy.concatenate(columns) for columns in zip(*(chunk[3] for chunk in chunks))]
+
+        return build_rollups(site_ids, renumber[codes], yrmonths, ppt, values)
+
+
+def from_rows(rows):
+    '''
+        Reduce an iterable of samples to rollups.
+
+        Input variables:
+            'rows':
+                Type: iterable of dictionaries (rows of NTN-All-w.csv),
+        Returns:
+            Type: Dictionary ({period: PeriodRollups})
+    '''
+    fieldnames = ['siteID', 'yrmonth', 'invalcode', 'ppt'] + analytes
+    builder = RollupBuilder(fieldnames)
+
+    for row in rows:
+        builder.add([row.get(name) or '' for name in fieldnames])
+
+    return builder.build()
+
+
+def to_arrays(rollups):
+    '''
+        Returns rollups as a flat dictionary of numpy arrays, to be saved with an index or database.
+    '''
+    return {'rollups_{}_{}'.format(period, name): getattr(period_rollups, name)
+            for period, period_rollups in rollups.items() for name in PeriodRollups.names}
+
+
+def from_arrays(arrays):
+    '''
+        Returns the rollups saved by to_arrays.
+
+        Raises:
+            KeyError if arrays does not hold rollups.
+    '''
+    return {period: PeriodRollups(period, *(arrays['rollups_{}_{}'.format(period, name)] for name in PeriodRollups.names))
+            for period in periods}
+
+
+def lookup(rollups, period, site_id, start_date, end_date, selected=None):
+    '''
+        Returns the rollups for a site whose period falls within the start_date - end_date window.
+
+        Input variables:
+            'period':
+                Type: string (one of periods),
+            'start_date':
+                Type: string (YYYYMM),
+            'end_date':
+                Type: string (YYYYMM),
+            'selected':
+                Type: list of strings (analytes to return, all if None),
+        Returns:
+            Type: Dictionary ({period key: results})
+    '''
+    return rollups[period].lookup(site_id, start_date, end_date, selected)
+
+
+_rollups = (None, None)
+
+
+def get_rollups(samples):
+    '''
+        Returns the rollups for a sample backend. Every backend builds them along with its data,
+        only a database ingested before rollups were kept with it has them built here, once per
+        dataset version.
+    '''
+    global _rollups
+
+    if getattr(samples, 'rollups', None) is not None:
+        return samples.rollups
+
+    key = (type(samples).__name__, samples.path, samples.version)
+
+    if _rollups[0] != key:
+        rows = samples.iter_sites(sorted(samples.site_ids()), '000000', '999999', fields=['ppt', 'invalcode'] + analytes)
+        _rollups = (key, from_rows(rows))
+
+    return _rollups[1]
@@ -0,0 +1,276 @@
+'''
+	This script contains a SQLite backed store for the NTN weekly samples, along with the ingest
+	command used to load NTN-All-w.csv into it. Several workers can share one on-disk copy, and
+	lookups are answered from a composite (siteID, yrmonth) index. The monthly and annual rollups
+	(see common/rollups.py) are built during ingest and kept in the database as numpy arrays.
+
+	Usage:
+		python -m common.sample_db [csv_path] [db_path]
+'''
+import argparse
+import csv
+import io
+import logging
+import os
+import sqlite3
+import threading
+
+import numpy
+
+from common import metrics, rollups
+from common.sample_index import key_columns
+from common.sample_store import dataset_version
+
+log = logging.getLogger('logger')
+
+# Columns with a type other than TEXT. Every other column is stored exactly as it appears in the
+# csv so that values such as "-9" and "-9.000" are returned unchanged.
+column_types = {
+    'siteID': 'TEXT NOT NULL',
+    'labno': 'TEXT NOT NULL',
+    'yrmonth': 'INTEGER NOT NULL',
+}
+
+batch_size = 10000
+# Stay well below SQLite's default limit of 999 parameters per query.
+max_query_sites = 500
+
+
+def ingest(csv_path, db_path):
+    '''
+        Load a csv file into a new SQLite database. The database is built next to db_path and
+        moved into place once complete, so readers never see a partially loaded file.
+
+        Input variables:
+            'csv_path':
+                Type: string,
+            'db_path':
+                Type: string,
+        Returns:
+            Type: integer (number of rows loaded)
+    '''
+    tmp_path = db_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    version = dataset_version(csv_path)
+    count = 0
+    connection = sqlite3.connect(tmp_path)
+
+    try:
+        connection.execute('PRAGMA journal_mode=OFF')
+        connection.execute('PRAGMA synchronous=OFF')
+
+        with open(csv_path, 'r', encoding='utf8', newline='') as csvfile:
+            reader = csv.reader(csvfile)
+            fieldnames = next(reader)
+            columns = ', '.join('"{}" {}'.format(name, column_types.get(name, 'TEXT')) for name in fieldnames)
+            placeholders = ', '.join('?' for name in fieldnames)
+            yrmonth = fieldnames.index('yrmonth')
+            width = len(fieldnames)
+
+            connection.execute('CREATE TABLE samples ({})'.format(columns))
+            connection.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+
+            insert = 'INSERT INTO samples VALUES ({})'.format(placeholders)
+            rollup_builder = rollups.RollupBuilder(fieldnames)
+            batch = []
+            for row in reader:
+                if not row:
+                    continue
+                # rows without a yrmonth are never in a date window, as in the other backends.
+                if len(row) <= yrmonth or len(row[yrmonth]) != 6 or not row[yrmonth].isdigit():
+                    log.warning('Skipped line {} of {}, which has an invalid yrmonth.'.format(reader.line_num, csv_path))
+                    continue
+                # short rows are padded with blanks and long rows cut to the header.
+                row = row[:width] + [''] * (width - len(row))
+                row[yrmonth] = int(row[yrmonth])
+                rollup_builder.add(row)
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    connection.executemany(insert, batch)
+                    count += len(batch)
+                    batch = []
+            connection.executemany(insert, batch)
+            count += len(batch)
+
+        connection.execute('CREATE INDEX samples_site_yrmonth ON samples (siteID, yrmonth, labno)')
+        connection.execute('CREATE TABLE rollups (name TEXT PRIMARY KEY, value BLOB)')
+        connection.executemany('INSERT INTO rollups VALUES (?, ?)', [
+            (name, array_bytes(array)) for name, array in rollups.to_arrays(rollup_builder.build()).items()
+        ])
+        connection.executemany('INSERT INTO meta VALUES (?, ?)', [
+            ('fieldnames', ','.join(fieldnames)),
+            ('source_version', '{}:{}'.format(*version)),
+        ])
+        connection.commit()
+        connection.execute('PRAGMA journal_mode=WAL')
+    finally:
+        connection.close()
+
+    os.replace(tmp_path, db_path)
+
+    return count
+
+
+def array_bytes(array):
+    '''
+        Helper function that returns a numpy array in the .npy format, to be kept in a BLOB.
+    '''
+    buffer = io.BytesIO()
+    numpy.save(buffer, array, allow_pickle=False)
+
+    return buffer.getvalue()
+
+
+class SampleDatabase:
+    '''
+        Weekly samples read from a database built by ingest. Each thread gets its own
+        connection.
+    '''
+
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise FileNotFoundError('Sample database {} has not been ingested.'.format(path))
+
+        self.path = path
+        self.version = dataset_version(path)
+        self._local = threading.local()
+
+        meta = dict(self.connection.execute('SELECT key, value FROM meta'))
+        self.fieldnames = meta['fieldnames'].split(',')
+        self.source_version = meta['source_version']
+
+        try:
+            arrays = {name: numpy.load(io.BytesIO(value), allow_pickle=False)
+                      for name, value in self.connection.execute('SELECT name, value FROM rollups')}
+            self.rollups = rollups.from_arrays(arrays)
+        except (sqlite3.OperationalError, KeyError):
+            # ingested before rollups were kept in the database, see rollups.get_rollups.
+            self.rollups = None
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+
+        if connection is None:
+            connection = sqlite3.connect(self.path)
+            self._local.connection = connection
+
+        return connection
+
+    def columns(self, fields=None):
+        '''
+            Returns the columns to select: every column, or only the key columns and the given fields.
+        '''
+        if fields is None:
+            return self.fieldnames
+
+        return [name for name in self.fieldnames if name in key_columns or name in fields]
+
+    def _select(self, columns):
+        return 'SELECT {} FROM samples '.format(', '.join('"{}"'.format(name) for name in columns))
+
+    def _to_dict(self, row, columns=None):
+        sample = dict(zip(columns or self.fieldnames, row))
+        sample['yrmonth'] = '{:06d}'.format(sample['yrmonth'])
+
+        return sample
+
+    def __contains__(self, site_id):
+        query = 'SELECT 1 FROM samples WHERE siteID = ? LIMIT 1'
+
+        return self.connection.execute(query, (site_id,)).fetchone() is not None
+
+    def site_ids(self):
+        return [row[0] for row in self.connection.execute('SELECT DISTINCT siteID FROM samples')]
+
+    def get(self, site_id, start_date, end_date, after=None, fields=None):
+        '''
+            Returns all samples for a given site whose yrmonth falls within the start_date -
+            end_date window (inclusive), ordered by (yrmonth, labno).
+
+            Input variables:
+                'site_id':
+                    Type: string,
+                'start_date':
+                    Type: string (YYYYMM),
+                'end_date':
+                    Type: string (YYYYMM),
+                'after':
+                    Type: tuple(yrmonth, labno) (only return samples that sort after this key),
+                'fields':
+                    Type: list of strings (columns to return along with siteID, labno and
+                          yrmonth, all if None),
+            Returns:
+                Type: list of dictionaries
+        '''
+        return list(self.iter_samples(site_id, start_date, end_date, after, fields))
+
+    def iter_samples(self, site_id, start_date, end_date, after=None, fields=None, limit=None):
+        '''
+            Generator version of get, yielding samples as they are read from the database, and at
+            most limit samples if given.
+        '''
+        columns = self.columns(fields)
+        query = self._select(columns) + 'WHERE siteID = ? AND yrmonth BETWEEN ? AND ? '
+        params = [site_id, int(start_date), int(end_date)]
+
+        if after is not None:
+            query += 'AND (yrmonth > ? OR (yrmonth = ? AND labno > ?)) '
+            params += [int(after[0]), int(after[0]), after[1]]
+
+        query += 'ORDER BY yrmonth, labno, rowid '
+        if limit is not None:
+            query += 'LIMIT ?'
+            params.append(limit)
+
+        for row in self.connection.execute(query, params):
+            yield self._to_dict(row, columns)
+
+    def iter_sites(self, site_ids, start_date, end_date, fields=None):
+        '''
+            Yields the samples for several sites, grouped by site in the order the sites are given
+            (as the other backends do), using one query per max_query_sites sites.
+        '''
+        columns = self.columns(fields)
+        select = ', '.join('samples."{}"'.format(name) for name in columns)
+
+        for i in range(0, len(site_ids), max_query_sites):
+            chunk = list(site_ids[i:i + max_query_sites])
+            # each site is joined with its position in the request, which orders the results.
+            requested = ', '.join('({}, ?)'.format(position) for position in range(len(chunk)))
+            query = 'WITH requested (position, site_id) AS (VALUES {}) ' \
+                    'SELECT {} FROM requested CROSS JOIN samples ON samples.siteID = requested.site_id ' \
+                    'WHERE samples.yrmonth BETWEEN ? AND ? ' \
+                    'ORDER BY requested.position, samples.yrmonth, samples.labno, samples.rowid'.format(requested, select)
+
+            for row in self.connection.execute(query, chunk + [int(start_date), int(end_date)]):
+                yield self._to_dict(row, columns)
+
+
+_databases = {}
+
+
+def get_database(path):
+    '''
+        Returns the SampleDatabase for a given database file, reopening it if it has been
+        re-ingested since it was last opened.
+    '''
+    database = _databases.get(path)
+
+    if database is None or database.version != dataset_version(path):
+        database = SampleDatabase(path)
+        metrics.dataset_reloads.inc(dataset='sqlite')
+        _databases[path] = database
+
+    return database
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load NTN-All-w.csv into a SQLite database.')
+    parser.add_argument('csv_path', nargs='?', default='NTN-All-w.csv')
+    parser.add_argument('db_path', nargs='?', default='ntn_samples.db')
+    args = parser.parse_args()
+
+    print('Loaded {} samples into {}.'.format(ingest(args.csv_path, args.db_path), args.db_path))
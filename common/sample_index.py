@@ -0,0 +1,278 @@
+'''
+	This script contains a byte-offset index over NTN-All-w.csv. The index holds, for every row, its
+	yrmonth and byte range as compact numpy arrays grouped by siteID and sorted by yrmonth, and is
+	kept in a sidecar file next to the csv. Lookups binary search a site's yrmonths, memory-map the
+	csv and parse only the rows in the matching ranges, so little more than the arrays (about 16
+	bytes a row) is held in memory between requests. The monthly and annual rollups (see
+	common/rollups.py) are built in the same scan and kept in the sidecar file too.
+'''
+import csv
+import itertools
+import mmap
+import os
+
+import numpy
+
+from common import metrics, rollups
+from common.columns import key_columns
+from common.sample_store import dataset_version
+
+index_suffix = '.idx.npz'
+# Bumped whenever the arrays kept in the sidecar file change, so older sidecars are rebuilt.
+index_format = 2
+
+
+def build_index(path):
+    '''
+        Scan a csv file once and record the site, yrmonth and byte range of every row, and build
+        the rollups.
+
+        Input variables:
+            'path':
+                Type: string,
+        Returns:
+            Type: Dictionary (of numpy arrays, as saved in the sidecar file)
+    '''
+    version = dataset_version(path)
+    site_ids, yrmonths, starts, ends = [], [], [], []
+
+    with open(path, 'rb') as csvfile:
+        header = csvfile.readline()
+        fieldnames = next(csv.reader([header.decode('utf8')]))
+        site_column = fieldnames.index('siteID')
+        yrmonth_column = fieldnames.index('yrmonth')
+        rollup_builder = rollups.RollupBuilder(fieldnames)
+
+        offset = len(header)
+        for line in csvfile:
+            row = next(csv.reader([line.decode('utf8')]), None)
+            end = offset + len(line)
+
+            if row:
+                site_ids.append(row[site_column])
+                # a yrmonth that is not a number never falls within a date window.
+                yrmonths.append(int(row[yrmonth_column]) if row[yrmonth_column].isdigit() else -1)
+                starts.append(offset)
+                ends.append(end)
+                rollup_builder.add(row)
+
+            offset = end
+
+    distinct = sorted(set(site_ids))
+    lookup = {site_id: code for code, site_id in enumerate(distinct)}
+    codes = numpy.array([lookup[site_id] for site_id in site_ids], dtype=numpy.int32)
+    yrmonths = numpy.array(yrmonths, dtype=numpy.int32)
+
+    # lexsort is stable, so rows for the same site and yrmonth keep their file order.
+    order = numpy.lexsort((yrmonths, codes))
+    offset_type = numpy.uint32 if offset < 1 << 32 else numpy.uint64
+
+    return dict(
+        rollups.to_arrays(rollup_builder.build()),
+        format=numpy.array(index_format),
+        version=numpy.array(version, dtype=numpy.int64),
+        header=numpy.array([0, len(header)], dtype=numpy.int64),
+        fieldnames=numpy.array(fieldnames, dtype=str),
+        site_ids=numpy.array(distinct, dtype=str),
+        site_offsets=numpy.searchsorted(codes[order], numpy.arange(len(distinct) + 1)).astype(numpy.int64),
+        yrmonths=yrmonths[order],
+        starts=numpy.array(starts, dtype=offset_type)[order],
+        ends=numpy.array(ends, dtype=offset_type)[order],
+    )
+
+
+def load_index(path):
+    '''
+        Returns the index for a csv file, reading it from the sidecar file if it matches the
+        csv's current mtime and size, and rebuilding (and rewriting) it otherwise.
+    '''
+    index_path = path + index_suffix
+    version = list(dataset_version(path))
+
+    try:
+        with numpy.load(index_path, allow_pickle=False) as sidecar:
+            index = {name: sidecar[name] for name in sidecar.files}
+        if index['format'] == index_format and index['version'].tolist() == version:
+            return index
+    except (OSError, ValueError, KeyError):
+        pass
+
+    index = build_index(path)
+
+    # write to a temporary file first so other workers never read a partial index.
+    tmp_path = '{}.{}.tmp'.format(index_path, os.getpid())
+    with open(tmp_path, 'wb') as index_file:
+        numpy.savez(index_file, **index)
+    os.replace(tmp_path, index_path)
+
+    return index
+
+
+class SampleIndex:
+    '''
+        Weekly samples fetched from a memory-mapped NTN-All-w.csv using a byte-offset index.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        index = load_index(path)
+        self.version = tuple(index['version'].tolist())
+        self.fieldnames = index['fieldnames'].tolist()
+        self.header = tuple(index['header'].tolist())
+        self.yrmonths = index['yrmonths']
+        self.starts = index['starts']
+        self.ends = index['ends']
+        self.rollups = rollups.from_arrays(index)
+
+        offsets = index['site_offsets'].tolist()
+        self._sites = {site_id: (offsets[code], offsets[code + 1])
+                       for code, site_id in enumerate(index['site_ids'].tolist())}
+
+        with open(path, 'rb') as csvfile:
+            self._map = mmap.mmap(csvfile.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __contains__(self, site_id):
+        return site_id in self._sites
+
+    def site_ids(self):
+        return list(self._sites)
+
+    def window(self, site_id, start_date, end_date):
+        '''
+            Returns the range of rows (in index order) holding a site's samples whose yrmonth
+            falls within the start_date - end_date window (inclusive).
+        '''
+        site_start, site_end = self._sites[site_id]
+        yrmonths = self.yrmonths[site_start:site_end]
+
+        return (site_start + int(numpy.searchsorted(yrmonths, int(start_date), side='left')),
+                site_start + int(numpy.searchsorted(yrmonths, int(end_date), side='right')))
+
+    def ranges(self, site_id, start_date, end_date):
+        '''
+            Returns the byte ranges holding a site's samples whose yrmonth falls within the
+            start_date - end_date window (inclusive). Rows that sit next to each other in the
+            file share a range.
+
+            Returns:
+                Type: list of tuple(start, end)
+        '''
+        if site_id not in self._sites:
+            return []
+
+        start, end = self.window(site_id, start_date, end_date)
+        order = numpy.argsort(self.starts[start:end], kind='stable')
+        starts = self.starts[start:end][order].astype(numpy.int64)
+        ends = self.ends[start:end][order].astype(numpy.int64)
+
+        # a range ends wherever the next row does not start where this one ends.
+        breaks = numpy.flatnonzero(starts[1:] != ends[:-1]) + 1
+        firsts = numpy.concatenate(([0], breaks))
+        lasts = numpy.concatenate((breaks - 1, [len(starts) - 1]))
+
+        return list(zip(starts[firsts].tolist(), ends[lasts].tolist())) if len(starts) else []
+
+    def read(self, start, end):
+        return self._map[start:end]
+
+    def columns(self, fields=None):
+        '''
+            Returns the positions of the columns to parse: every column, or only the key columns
+            and the given fields.
+        '''
+        if fields is None:
+            return None
+
+        return [i for i, name in enumerate(self.fieldnames) if name in key_columns or name in fields]
+
+    def get(self, site_id, start_date, end_date, after=None, fields=None):
+        '''
+            Returns all samples for a given site whose yrmonth falls within the start_date -
+            end_date window (inclusive), ordered by (yrmonth, labno).
+
+            Input variables:
+                'site_id':
+                    Type: string,
+                'start_date':
+                    Type: string (YYYYMM),
+                'end_date':
+                    Type: string (YYYYMM),
+                'after':
+                    Type: tuple(yrmonth, labno) (only return samples that sort after this key),
+                'fields':
+                    Type: list of strings (columns to return along with siteID, labno and
+                          yrmonth, all if None),
+            Returns:
+                Type: list of dictionaries
+        '''
+        return list(self.iter_samples(site_id, start_date, end_date, after, fields))
+
+    def iter_samples(self, site_id, start_date, end_date, after=None, fields=None, limit=None):
+        '''
+            Generator version of get, parsing and yielding one yrmonth at a time, and at most limit
+            samples if given.
+        '''
+        if site_id not in self._sites:
+            return
+        if limit is not None:
+            yield from itertools.islice(self.iter_samples(site_id, start_date, end_date, after, fields), limit)
+            return
+
+        columns = self.columns(fields)
+        start, end = self.window(site_id, start_date, end_date)
+
+        if after is not None:
+            after = tuple(after)
+            start = max(start, self.window(site_id, after[0], end_date)[0])
+
+        # rows for the same yrmonth are adjacent, so each run of them is parsed and put in labno
+        # order on its own.
+        yrmonths = self.yrmonths[start:end]
+        bounds = [start] + (numpy.flatnonzero(yrmonths[1:] != yrmonths[:-1]) + start + 1).tolist() + [end]
+        starts = self.starts[start:end].tolist()
+        ends = self.ends[start:end].tolist()
+
+        for run_start, run_end in zip(bounds[:-1], bounds[1:]):
+            lines = [self.read(starts[i - start], ends[i - start]).decode('utf8')
+                     for i in range(run_start, run_end)]
+            if columns is None:
+                rows = [dict(zip(self.fieldnames, row)) for row in csv.reader(lines) if row]
+            else:
+                rows = [{self.fieldnames[i]: row[i] for i in columns} for row in csv.reader(lines) if row]
+
+            rows.sort(key=lambda row: (row['yrmonth'], row['labno']))
+            if after is not None and rows and rows[0]['yrmonth'] == after[0]:
+                rows = [row for row in rows if (row['yrmonth'], row['labno']) > after]
+            yield from rows
+
+    def iter_sites(self, site_ids, start_date, end_date, fields=None):
+        '''
+            Yields the samples for several sites in one call, grouped by site.
+        '''
+        for site_id in site_ids:
+            yield from self.iter_samples(site_id, start_date, end_date, fields=fields)
+
+
+_indexes = {}
+
+
+def get_index(path):
+    '''
+        Returns the SampleIndex for a given csv file, rebuilding it if the file on disk changes.
+    '''
+    index = _indexes.get(path)
+
+    if index is None or index.version != dataset_version(path):
+        index = SampleIndex(path)
+        metrics.dataset_reloads.inc(dataset='mmap')
+        _indexes[path] = index
+
+    return index
+
+
+def set_index(path, index):
+    '''
+        Make an index loaded elsewhere (see common/dataset_refresh.py) the index for a csv file.
+    '''
+    metrics.dataset_reloads.inc(dataset='mmap')
+    _indexes[path] = index
@@ -0,0 +1,337 @@
+'''
+	This script contains an in-memory store for the NTN weekly samples found in NTN-All-w.csv.
+	Samples are partitioned by siteID and sorted by yrmonth, so a lookup is a dictionary hit
+	followed by a binary search over the requested date window. Columns are held in the compact
+	typed encodings of common/columns.py rather than as a dictionary of strings per row, and rows
+	are only built, with the columns asked for, when they are read.
+'''
+import csv
+import os
+
+import numpy
+
+from common import columns as encodings
+from common.columns import key_columns
+from common import metrics
+from common.fast_json import sample_fragment
+from common import rollups
+from common.rollups import analytes, parse_values
+
+# Rows built at once by SampleStore.iter_samples.
+chunk_rows = 500
+# Most bytes of encoded rows kept per store, see SampleStore.fragment. A store keeps no more than
+# its columns take (SampleStore.nbytes), so a small dataset keeps a small cache.
+max_fragment_bytes = 16 * 1024 * 1024
+
+
+def dataset_version(path):
+    '''
+        Helper function that returns a value identifying the current version of a data file.
+
+        Input variables:
+            'path':
+                Type: string,
+        Returns:
+            Type: tuple(mtime in nanoseconds, size in bytes)
+    '''
+    stat = os.stat(path)
+
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class SampleStore:
+    '''
+        Weekly samples loaded from NTN-All-w.csv, partitioned by siteID. The samples for each
+        site are sorted by (yrmonth, labno) and held as one contiguous range of every column.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.version = dataset_version(path)
+        self.fieldnames = []
+        self.columns = {}
+        self._sites = {}
+        self._duplicates = set()
+        self._fragments = {}
+        self._fragment_bytes = 0
+        self.max_fragment_bytes = 0
+        self.rollups = None
+
+        self.load()
+
+    def load(self):
+        '''
+            Read the whole csv file once, encode each column and build the per-site ranges and
+            the monthly and annual rollups.
+        '''
+        with open(self.path, 'r', encoding='utf8', newline='') as csvfile:
+            reader = csv.reader(csvfile)
+            self.fieldnames = next(reader, [])
+            values = [[] for _ in self.fieldnames]
+            width = len(self.fieldnames)
+
+            for row in reader:
+                if row:
+                    # short rows are padded with blanks, so every column has a value for every row.
+                    if len(row) < width:
+                        row += [''] * (width - len(row))
+                    for column, value in zip(values, row):
+                        column.append(value)
+
+        strings = dict(zip(self.fieldnames, values))
+        del values
+
+        # the columns rows are sorted on keep an encoding whose order matches the text's.
+        site_ids = encodings.CodedColumn.encode(strings.pop('siteID'))
+        yrmonths = encodings.IntColumn.encode(strings['yrmonth']) or encodings.CodedColumn.encode(strings['yrmonth'])
+        lab_nos = encodings.TextColumn.encode(strings['labno']) or encodings.CodedColumn.encode(strings['labno'])
+        order = numpy.lexsort((sort_key(lab_nos), sort_key(yrmonths), site_ids.codes))
+
+        columns = {}
+        for name in self.fieldnames:
+            if name == 'yrmonth':
+                columns[name] = yrmonths.take(order)
+            elif name == 'labno':
+                columns[name] = lab_nos.take(order)
+            elif name != 'siteID':
+                columns[name] = encodings.encode(strings.pop(name)).take(order)
+        self.columns = columns
+
+        codes = site_ids.codes[order]
+        bounds = numpy.searchsorted(codes, numpy.arange(len(site_ids.distinct) + 1))
+        self._sites = {site_id: (int(bounds[code]), int(bounds[code + 1]))
+                       for code, site_id in enumerate(site_ids.distinct)}
+
+        # rows sharing a (siteID, yrmonth, labno) key are never given a cached encoding.
+        yrmonth_keys, lab_no_keys = sort_key(columns['yrmonth']), sort_key(columns['labno'])
+        shared = (codes[1:] == codes[:-1]) & (yrmonth_keys[1:] == yrmonth_keys[:-1]) & (lab_no_keys[1:] == lab_no_keys[:-1])
+        for position in numpy.flatnonzero(shared).tolist():
+            self._duplicates.add((site_ids.distinct[codes[position]], columns['yrmonth'].render(position, position + 1)[0],
+                                  columns['labno'].render(position, position + 1)[0]))
+
+        self.max_fragment_bytes = min(max_fragment_bytes, self.nbytes)
+
+        # the rollups are reduced straight from the typed columns, with the samples in csv order
+        # as the other backends reduce them, so every backend sums them in the same order.
+        count = len(codes)
+        yrmonth_numbers = self.yrmonths(0, count)
+        in_file_order = numpy.empty_like(order)
+        in_file_order[order] = numpy.arange(count)
+        in_file_order = in_file_order[(self.valid(0, count) & (yrmonth_numbers >= 0))[in_file_order]]
+
+        self.rollups = rollups.build_rollups(
+            site_ids.distinct,
+            codes[in_file_order],
+            yrmonth_numbers[in_file_order],
+            self.numbers('ppt', 0, count)[in_file_order],
+            [self.numbers(analyte, 0, count)[in_file_order] for analyte in analytes],
+        )
+
+    def __contains__(self, site_id):
+        return site_id in self._sites
+
+    def site_ids(self):
+        return list(self._sites)
+
+    @property
+    def nbytes(self):
+        '''
+            Bytes held by the encoded columns.
+        '''
+        return sum(column.nbytes for column in self.columns.values())
+
+    def window(self, site_id, start_date, end_date, after=None):
+        '''
+            Returns the range of positions holding a site's samples whose yrmonth falls within the
+            start_date - end_date window (inclusive) and, if given, sort after the after key.
+        '''
+        site_start, site_end = self._sites[site_id]
+        yrmonths = self.columns['yrmonth']
+        start = yrmonths.search(start_date, site_start, site_end)
+        end = yrmonths.search(end_date, site_start, site_end, side='right')
+
+        if after is not None:
+            # search to the cursor's yrmonth, then step over the few samples in that month.
+            after = tuple(after)
+            start = max(start, yrmonths.search(after[0], site_start, site_end))
+            while start < end and (yrmonths.render(start, start + 1)[0],
+                                   self.columns['labno'].render(start, start + 1)[0]) <= after:
+                start += 1
+
+        return start, end
+
+    def rows(self, site_id, start, end, fields=None):
+        '''
+            Build the rows at positions start - end of a site's range, with every column or only
+            the key columns and the given fields.
+        '''
+        names = [name for name in self.fieldnames if name != 'siteID'
+                 and (fields is None or name in key_columns or name in fields)]
+        values = [self.columns[name].render(start, end) for name in names]
+
+        return [dict(zip(names, row), siteID=site_id) for row in zip(*values)]
+
+    def get(self, site_id, start_date, end_date, after=None, fields=None):
+        '''
+            Returns all samples for a given site whose yrmonth falls within the start_date -
+            end_date window (inclusive).
+
+            Input variables:
+                'site_id':
+                    Type: string,
+                'start_date':
+                    Type: string (YYYYMM),
+                'end_date':
+                    Type: string (YYYYMM),
+                'after':
+                    Type: tuple(yrmonth, labno) (only return samples that sort after this key),
+                'fields':
+                    Type: list of strings (columns to return along with siteID, labno and
+                          yrmonth, all if None),
+            Returns:
+                Type: list of dictionaries
+        '''
+        if site_id not in self._sites:
+            return []
+
+        start, end = self.window(site_id, start_date, end_date, after)
+
+        return self.rows(site_id, start, end, fields)
+
+    def numbers(self, name, start, end):
+        '''
+            Returns a numeric column at positions start - end as floats, equal to the values parsed
+            from the csv, with missing values (blanks and negative sentinels) as NaN.
+        '''
+        column = self.columns.get(name)
+
+        if column is None:
+            return numpy.full(end - start, numpy.nan)
+        if isinstance(column, encodings.NumericColumn):
+            return column.floats(start, end)
+
+        return parse_values(column.render(start, end))
+
+    def valid(self, start, end):
+        '''
+            Returns a boolean array that is False for the samples at positions start - end that
+            have a non-blank invalcode.
+        '''
+        invalcodes = self.columns.get('invalcode')
+
+        if invalcodes is None:
+            return numpy.ones(end - start, dtype=bool)
+        if isinstance(invalcodes, encodings.CodedColumn):
+            return numpy.array([not value.strip() for value in invalcodes.distinct], dtype=bool)[invalcodes.codes[start:end]]
+
+        return numpy.array([not value.strip() for value in invalcodes.render(start, end)], dtype=bool)
+
+    def yrmonths(self, start, end):
+        '''
+            Returns the yrmonths at positions start - end as integers, with -1 for any that are not
+            a number (such samples never fall within a date window).
+        '''
+        column = self.columns['yrmonth']
+
+        if isinstance(column, encodings.IntColumn):
+            return column.values[start:end].astype(numpy.int64)
+
+        return numpy.array([int(value) if value.isdigit() else -1 for value in column.render(start, end)], dtype=numpy.int64)
+
+    def series(self, site_id, name, start_date, end_date):
+        '''
+            Returns one numeric column of a site's samples within the start_date - end_date window
+            as arrays, read straight from the encoded columns. Missing values (blanks and negative
+            sentinels) and samples with a non-blank invalcode are NaN.
+
+            Input variables:
+                'site_id':
+                    Type: string,
+                'name':
+                    Type: string (a numeric column, such as ppt or an analyte),
+                'start_date':
+                    Type: string (YYYYMM),
+                'end_date':
+                    Type: string (YYYYMM),
+            Returns:
+                Type: tuple(numpy array of yrmonths as integers, numpy array of floats)
+        '''
+        if site_id not in self._sites:
+            return numpy.array([], dtype=int), numpy.array([], dtype=float)
+
+        start, end = self.window(site_id, start_date, end_date)
+        values = self.numbers(name, start, end)
+        values[~self.valid(start, end)] = numpy.nan
+
+        return self.yrmonths(start, end), values
+
+    def fragment(self, row):
+        '''
+            Returns a complete row encoded as it appears in a by_id response, encoding it the first
+            time it is asked for, until max_fragment_bytes (or nbytes, if less) are held.
+        '''
+        key = (row['siteID'], row['yrmonth'], row['labno'])
+        fragment = self._fragments.get(key)
+
+        if fragment is None:
+            fragment = sample_fragment(row)
+            if key not in self._duplicates and self._fragment_bytes < self.max_fragment_bytes:
+                self._fragments[key] = fragment
+                self._fragment_bytes += len(fragment)
+
+        return fragment
+
+    def iter_samples(self, site_id, start_date, end_date, after=None, fields=None, limit=None):
+        '''
+            Generator version of get, building chunk_rows rows at a time as they are asked for,
+            and at most limit rows if given.
+        '''
+        if site_id not in self._sites:
+            return
+
+        start, end = self.window(site_id, start_date, end_date, after)
+        if limit is not None:
+            end = min(end, start + limit)
+
+        for chunk_start in range(start, end, chunk_rows):
+            yield from self.rows(site_id, chunk_start, min(chunk_start + chunk_rows, end), fields)
+
+    def iter_sites(self, site_ids, start_date, end_date, fields=None):
+        '''
+            Yields the samples for several sites in one call, grouped by site.
+        '''
+        for site_id in site_ids:
+            yield from self.iter_samples(site_id, start_date, end_date, fields=fields)
+
+
+def sort_key(column):
+    '''
+        Helper function that returns an array that sorts like the text of a key column.
+    '''
+    return column.codes if isinstance(column, encodings.CodedColumn) else column.values
+
+
+_stores = {}
+
+
+def get_store(path):
+    '''
+        Returns the SampleStore for a given csv file, loading it on first use. The store is kept
+        for the life of the worker and is only reloaded if the file on disk changes.
+    '''
+    store = _stores.get(path)
+
+    if store is None or store.version != dataset_version(path):
+        store = SampleStore(path)
+        metrics.dataset_reloads.inc(dataset='memory')
+        _stores[path] = store
+
+    return store
+
+
+def set_store(path, store):
+    '''
+        Make a store loaded elsewhere (see common/dataset_refresh.py) the store for a csv file.
+    '''
+    metrics.dataset_reloads.inc(dataset='memory')
+    _stores[path] = store
@@ -0,0 +1,187 @@
+'''
+	This script contains a cache for the NTN site catalog (http://nadp.slh.wisc.edu/data/sites/CSV/).
+	The catalog is kept in memory for a TTL, served stale while a background refresh runs, fetched
+	with conditional GETs and persisted to disk so a cold worker can answer without the upstream.
+'''
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+
+from common import http_client, metrics
+
+log = logging.getLogger('logger')
+
+# -- Directory persisted catalogs are written to, one file per url.
+cache_dir = 'site_cache'
+
+
+def parse_sites(text):
+    '''
+        Helper function to convert the catalog csv to a dictionary keyed by siteid.
+
+        Input variables:
+            'text':
+                Type: string,
+        Returns:
+            Type: Dictionary
+    '''
+    reader = csv.DictReader(io.StringIO(text))
+
+    return {site.pop("siteid"): site for site in reader}
+
+
+class SiteCatalog:
+    '''
+        A cached copy of the site catalog found at a url.
+
+        Input variables:
+            'ttl':
+                Type: float (seconds a fetched catalog is considered fresh),
+            'max_stale':
+                Type: float (seconds past the ttl a catalog may be served while it is refreshed
+                      in the background. After this the refresh happens on the request.),
+            'timeout':
+                Type: float or tuple(connect, read) (seconds to wait on the upstream),
+    '''
+
+    def __init__(self, url, cache_path=None, ttl=3600, max_stale=86400, timeout=http_client.default_timeout):
+        self.url = url
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.timeout = timeout
+
+        self.sites = {}
+        self.text = None
+        self.version = None
+        self.etag = None
+        self.last_modified = None
+        self.fetched_at = 0
+
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+        self.load()
+
+    def age(self):
+        return time.time() - self.fetched_at
+
+    def get(self):
+        '''
+            Returns the catalog, refreshing it first if it has never been fetched or is past
+            max_stale, or in the background if it is past its ttl.
+
+            Returns:
+                Type: Dictionary
+        '''
+        age = self.age()
+
+        if not self.sites or age > self.ttl + self.max_stale:
+            self.refresh()
+        elif age > self.ttl:
+            self.refresh_in_background()
+
+        return self.sites
+
+    def refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        thread = threading.Thread(target=self.refresh, name='site-catalog-refresh', daemon=True)
+        thread.start()
+
+    def refresh(self):
+        '''
+            Fetch the catalog from the upstream using a conditional GET. On failure the catalog
+            already held, if any, is kept.
+
+            Returns:
+                Type: Boolean (whether the catalog was fetched or revalidated)
+        '''
+        headers = {}
+        if self.sites and self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.sites and self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+
+        try:
+            response = http_client.get(self.url, headers=headers, timeout=self.timeout)
+
+            if response.status_code == 304:
+                self.fetched_at = time.time()
+                self.save()
+                return True
+
+            assert response.status_code == 200
+            self.update(response.text, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+            self.save()
+            return True
+        except Exception as e:
+            log.error(e)
+            return False
+        finally:
+            self._refreshing = False
+
+    def update(self, text, etag=None, last_modified=None, fetched_at=None):
+        sites = parse_sites(text)
+
+        self.text = text
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = time.time() if fetched_at is None else fetched_at
+        version = hashlib.sha1(text.encode('utf8')).hexdigest()
+        if version != self.version:
+            metrics.dataset_reloads.inc(dataset='sites')
+        self.version = version
+        self.sites = sites
+
+    def load(self):
+        '''
+            Load a catalog previously persisted by save, if there is one.
+        '''
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+
+        try:
+            with open(self.cache_path, 'r', encoding='utf8') as cache_file:
+                cached = json.load(cache_file)
+            self.update(cached['text'], cached['etag'], cached['last_modified'], cached['fetched_at'])
+        except Exception as e:
+            log.error(e)
+
+    def save(self):
+        if not self.cache_path or not self.sites:
+            return
+
+        cached = dict(url=self.url, text=self.text, etag=self.etag, last_modified=self.last_modified,
+                      fetched_at=self.fetched_at)
+
+        os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(self.cache_path, os.getpid())
+        with open(tmp_path, 'w', encoding='utf8') as cache_file:
+            json.dump(cached, cache_file)
+        os.replace(tmp_path, self.cache_path)
+
+
+_catalogs = {}
+
+
+def get_catalog(url, **kwargs):
+    '''
+        Returns the SiteCatalog for a given url, persisted under cache_dir.
+    '''
+    catalog = _catalogs.get(url)
+
+    if catalog is None:
+        cache_path = os.path.join(cache_dir, hashlib.sha1(url.encode('utf8')).hexdigest() + '.json')
+        catalog = SiteCatalog(url, cache_path=cache_path, **kwargs)
+        _catalogs[url] = catalog
+
+    return catalog
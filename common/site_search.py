@@ -0,0 +1,119 @@
+'''
+	This script contains a search index over the NTN site catalog, built once per catalog version.
+	Sites are held in site id order with an inverted index (value -> positions) per searchable
+	attribute and their latitudes sorted, so a search intersects a few small arrays instead of
+	checking every site in the catalog.
+'''
+import numpy
+
+# Catalog attributes sites can be searched by. Values are matched without regard to case.
+attributes = ('state', 'status', 'network', 'county')
+
+
+class SiteSearchIndex:
+    '''
+        Input variables:
+            'sites':
+                Type: Dictionary (site catalog keyed by site id, as returned by ntn_site_runner),
+    '''
+
+    def __init__(self, sites):
+        self.site_ids = sorted(sites)
+        postings = {attribute: {} for attribute in attributes}
+        latitudes = []
+        longitudes = []
+
+        for position, site_id in enumerate(self.site_ids):
+            site = sites[site_id]
+            for attribute in attributes:
+                postings[attribute].setdefault(normalize(site.get(attribute, '')), []).append(position)
+
+            try:
+                location = (float(site['latitude']), float(site['longitude']))
+            except (KeyError, TypeError, ValueError):
+                location = (numpy.nan, numpy.nan)
+            latitudes.append(location[0])
+            longitudes.append(location[1])
+
+        self.postings = {attribute: {value: numpy.array(positions, dtype=int) for value, positions in values.items()}
+                         for attribute, values in postings.items()}
+        self.longitudes = numpy.array(longitudes, dtype=float)
+
+        # sites without coordinates are left out of the latitude order, so never match a bbox.
+        latitudes = numpy.array(latitudes, dtype=float)
+        located = numpy.flatnonzero(~numpy.isnan(latitudes))
+        self.by_latitude = located[numpy.argsort(latitudes[located], kind='stable')]
+        self.sorted_latitudes = latitudes[self.by_latitude]
+
+    def within_bbox(self, bbox):
+        '''
+            Returns the positions of the sites inside a bounding box, in position order. A box
+            whose min_longitude is greater than its max_longitude crosses the antimeridian.
+
+            Input variables:
+                'bbox':
+                    Type: tuple(min_latitude, min_longitude, max_latitude, max_longitude),
+            Returns:
+                Type: numpy array of integers
+        '''
+        min_lat, min_lon, max_lat, max_lon = bbox
+        start = numpy.searchsorted(self.sorted_latitudes, min_lat, side='left')
+        end = numpy.searchsorted(self.sorted_latitudes, max_lat, side='right')
+        positions = self.by_latitude[start:end]
+
+        longitudes = self.longitudes[positions]
+        if min_lon <= max_lon:
+            mask = (longitudes >= min_lon) & (longitudes <= max_lon)
+        else:
+            mask = (longitudes >= min_lon) | (longitudes <= max_lon)
+
+        return numpy.sort(positions[mask])
+
+    def search(self, bbox=None, **filters):
+        '''
+            Returns the ids of the sites that are inside bbox (if given) and match every filter.
+
+            Input variables:
+                'bbox':
+                    Type: tuple(min_latitude, min_longitude, max_latitude, max_longitude),
+                'filters':
+                    Type: strings keyed by attribute (such as state='WY' or status='A'),
+            Returns:
+                Type: list of strings (sorted)
+        '''
+        positions = None
+
+        # the smallest posting lists are intersected first, so later intersections stay small.
+        matches = sorted((self.postings[attribute].get(normalize(value), numpy.array([], dtype=int))
+                          for attribute, value in filters.items() if value is not None), key=len)
+        for match in matches:
+            positions = match if positions is None else numpy.intersect1d(positions, match, assume_unique=True)
+
+        if bbox is not None:
+            inside = self.within_bbox(bbox)
+            positions = inside if positions is None else numpy.intersect1d(positions, inside, assume_unique=True)
+
+        if positions is None:
+            return list(self.site_ids)
+
+        return [self.site_ids[position] for position in positions.tolist()]
+
+
+def normalize(value):
+    return (value or '').strip().upper()
+
+
+_index = (None, None)
+
+
+def get_search_index(sites, version):
+    '''
+        Returns the SiteSearchIndex for a version of the site catalog, building it only when the
+        version changes.
+    '''
+    global _index
+
+    if _index[0] != version or _index[0] is None:
+        _index = (version, SiteSearchIndex(sites))
+
+    return _index[1]
@@ -0,0 +1,239 @@
+'''
+	This script contains a spatial index over site coordinates. Sites are bucketed into a grid of
+	latitude/longitude cells, so a radius query only looks at the sites in cells that can intersect
+	the search circle. Distances to those sites are computed in one vectorized haversine pass, and
+	the exact (geodesic) distance is only computed for sites close enough to the edge of the circle
+	that the haversine approximation could change the result. Nearest site queries search outward
+	from the query point one widening ring of cells at a time, so they only look at as much of the
+	grid as it takes to find k sites.
+'''
+import math
+
+from geopy import distance
+import numpy
+
+# Conservative (smallest) miles per degree of latitude, and miles per degree of longitude at the
+# equator, so bounding boxes computed with them always contain the whole search circle.
+miles_per_degree_lat = 68.7
+miles_per_degree_lon = 69.1
+
+# Mean earth radius in miles, and the largest relative difference allowed between a haversine
+# distance and the geodesic distance it approximates. Haversine on the mean sphere is within ~0.6%
+# of the WGS-84 geodesic, so this leaves a comfortable margin.
+earth_radius = 3958.8
+haversine_error = 0.01
+
+# A radius whose bounding cells cover the whole globe, where a nearest site search stops widening.
+max_search_radius = math.pi * earth_radius * (1 + haversine_error)
+
+
+def haversine_miles(location, latitudes, longitudes):
+    '''
+        Batch distance function that returns the great-circle distance, in miles, from location to
+        every point in latitudes/longitudes.
+
+        Input variables:
+            'location':
+                Type: tuple(latitude, longitude),
+            'latitudes':
+                Type: numpy array of floats,
+            'longitudes':
+                Type: numpy array of floats,
+        Returns:
+            Type: numpy array of floats
+    '''
+    lat = math.radians(location[0])
+    lon = math.radians(location[1])
+    latitudes = numpy.radians(latitudes)
+    longitudes = numpy.radians(longitudes)
+
+    a = numpy.sin((latitudes - lat) / 2) ** 2 \
+        + math.cos(lat) * numpy.cos(latitudes) * numpy.sin((longitudes - lon) / 2) ** 2
+
+    return 2 * earth_radius * numpy.arcsin(numpy.sqrt(numpy.minimum(a, 1.0)))
+
+
+def within_radius_mask(location, latitudes, longitudes, radius):
+    '''
+        Batch version of point_within_radius. Returns a boolean array that is True for every point
+        within radius miles (geodesic) of location.
+
+        Input variables:
+            'location':
+                Type: tuple(latitude, longitude),
+            'latitudes':
+                Type: numpy array of floats,
+            'longitudes':
+                Type: numpy array of floats,
+            'radius':
+                Type: float (in miles),
+        Returns:
+            Type: numpy array of booleans
+    '''
+    miles = haversine_miles(location, latitudes, longitudes)
+    mask = miles <= radius * (1 - haversine_error)
+
+    # only the points whose haversine distance is too close to the radius to decide need the
+    # exact distance.
+    boundary = numpy.flatnonzero(~mask & (miles <= radius * (1 + haversine_error) + 1e-6))
+    for i in boundary:
+        mask[i] = distance.distance(location, (latitudes[i], longitudes[i])).miles <= radius
+
+    return mask
+
+
+class SiteGrid:
+    '''
+        A grid of cell_size x cell_size degree cells, each holding the ids of the sites within it.
+
+        Input variables:
+            'sites':
+                Type: Dictionary (site catalog keyed by site id, as returned by ntn_site_runner),
+            'cell_size':
+                Type: float (degrees),
+    '''
+
+    def __init__(self, sites, cell_size=1.0):
+        self.cell_size = cell_size
+        self.lat_cells = int(math.ceil(180 / cell_size))
+        self.lon_cells = int(math.ceil(360 / cell_size))
+        self.coordinates = {}
+        self.site_ids = []
+        statuses = []
+        cells = {}
+
+        for site_id, site in sites.items():
+            try:
+                location = (float(site['latitude']), float(site['longitude']))
+            except (KeyError, TypeError, ValueError):
+                continue
+
+            self.coordinates[site_id] = location
+            cells.setdefault(self.cell(location), []).append(len(self.site_ids))
+            self.site_ids.append(site_id)
+            statuses.append(site.get('status', ''))
+
+        self.latitudes = numpy.array([self.coordinates[site_id][0] for site_id in self.site_ids], dtype=float)
+        self.longitudes = numpy.array([self.coordinates[site_id][1] for site_id in self.site_ids], dtype=float)
+        self.statuses = numpy.array(statuses, dtype=object)
+        self.cells = {cell: numpy.array(indexes, dtype=int) for cell, indexes in cells.items()}
+
+    def cell(self, location):
+        lat_index = min(int((location[0] + 90) // self.cell_size), self.lat_cells - 1)
+        lon_index = int((location[1] + 180) // self.cell_size) % self.lon_cells
+
+        return (lat_index, lon_index)
+
+    def bounding_cells(self, location, radius):
+        '''
+            Returns the cells that may hold a site within radius miles of location.
+        '''
+        lat, lon = location
+        lat_delta = radius / miles_per_degree_lat
+        min_lat = max(lat - lat_delta, -90.0)
+        max_lat = min(lat + lat_delta, 90.0)
+
+        lat_range = range(self.cell((min_lat, 0))[0], self.cell((max_lat, 0))[0] + 1)
+
+        widest = max(abs(min_lat), abs(max_lat))
+        if widest >= 90.0:
+            lon_delta = 180.0
+        else:
+            lon_delta = radius / (miles_per_degree_lon * math.cos(math.radians(widest)))
+
+        first = int((lon - lon_delta + 180) // self.cell_size)
+        count = int((lon + lon_delta + 180) // self.cell_size) - first + 1
+
+        if count >= self.lon_cells:
+            lon_range = range(self.lon_cells)
+        else:
+            lon_range = [(first + offset) % self.lon_cells for offset in range(count)]
+
+        return [(lat_index, lon_index) for lat_index in lat_range for lon_index in lon_range]
+
+    def candidates(self, location, radius):
+        '''
+            Returns the positions (in site_ids) of every site in the cells returned by
+            bounding_cells.
+        '''
+        indexes = [self.cells[cell] for cell in self.bounding_cells(location, radius) if cell in self.cells]
+
+        return numpy.concatenate(indexes) if indexes else numpy.array([], dtype=int)
+
+    def within_radius(self, location, radius):
+        '''
+            Returns the ids of the sites within radius miles (geodesic) of location.
+
+            Input variables:
+                'location':
+                    Type: tuple(latitude, longitude),
+                'radius':
+                    Type: float (in miles),
+            Returns:
+                Type: list of strings
+        '''
+        indexes = self.candidates(location, radius)
+        mask = within_radius_mask(location, self.latitudes[indexes], self.longitudes[indexes], radius)
+
+        return [self.site_ids[i] for i in indexes[mask]]
+
+    def nearest(self, location, k, statuses=None):
+        '''
+            Returns the k sites nearest (geodesic) to location, closest first. The search radius
+            starts at one cell and doubles until the cells searched hold k sites that are certainly
+            closer than any site outside them.
+
+            Input variables:
+                'location':
+                    Type: tuple(latitude, longitude),
+                'k':
+                    Type: integer,
+                'statuses':
+                    Type: list of strings (only sites with one of these statuses, any if None),
+            Returns:
+                Type: list of tuple(site id, miles)
+        '''
+        if k <= 0 or not self.site_ids:
+            return []
+
+        radius = self.cell_size * miles_per_degree_lat
+        while True:
+            indexes = self.candidates(location, radius)
+            if statuses is not None:
+                indexes = indexes[numpy.isin(self.statuses[indexes], list(statuses))]
+            miles = haversine_miles(location, self.latitudes[indexes], self.longitudes[indexes])
+
+            # a site this close by haversine is closer (geodesic) than any site outside the cells
+            # searched, with room left for the window below.
+            certain = radius * (1 - haversine_error) ** 2 / (1 + haversine_error)
+            if numpy.count_nonzero(miles <= certain) >= k or radius >= max_search_radius:
+                break
+            radius *= 2
+
+        if not len(indexes):
+            return []
+
+        # any site that could be among the k closest by geodesic distance is within this window of
+        # the k-th closest by haversine distance, so only those need the exact distance.
+        kth = numpy.partition(miles, min(k, len(miles)) - 1)[min(k, len(miles)) - 1]
+        window = indexes[miles <= kth * (1 + haversine_error) / (1 - haversine_error) + 1e-6]
+        results = sorted((distance.distance(location, (self.latitudes[i], self.longitudes[i])).miles, self.site_ids[i])
+                         for i in window)
+
+        return [(site_id, miles) for miles, site_id in results[:k]]
+
+
+_grid = (None, None)
+
+
+def get_grid(sites, version):
+    '''
+        Returns the SiteGrid for a version of the site catalog, building it only when the
+        version changes.
+    '''
+    global _grid
+
+    if _grid[0] != version or _grid[0] is None:
+        _grid = (version, SiteGrid(sites))
+
+    return _grid[1]
@@ -0,0 +1,153 @@
+'''
+	This script contains time series statistics for one site and analyte: a summary with
+	percentiles, monthly means with a rolling mean, the mean of each calendar month and a
+	deseasonalized linear trend. Everything is computed with NumPy over arrays of the samples'
+	yrmonths and values, which the in-memory store reads straight from its typed columns.
+
+	Missing values, negative sentinels and samples with a non-blank invalcode are left out, and
+	means are taken as they are for the rollups (see common/rollups.py), so pH is averaged
+	through its hydrogen ion concentration.
+'''
+import math
+
+import numpy
+
+from common.rollups import analytes, from_averaged, parse_value, rounded, to_averaged
+
+# Columns statistics can be computed for.
+series_columns = ['ppt'] + analytes
+default_percentiles = [5, 25, 50, 75, 95]
+default_window = 12
+
+
+def load_series(samples, site_id, name, start_date, end_date):
+    '''
+        Returns the yrmonths and values of one column of a site's samples within the start_date -
+        end_date window, with missing and invalid values as NaN. Backends that can read a column
+        directly (the in-memory store) are asked for it, others have the rows parsed.
+
+        Input variables:
+            'samples':
+                Type: SampleStore, SampleIndex or SampleDatabase,
+            'site_id':
+                Type: string,
+            'name':
+                Type: string (one of series_columns),
+            'start_date':
+                Type: string (YYYYMM),
+            'end_date':
+                Type: string (YYYYMM),
+        Returns:
+            Type: tuple(numpy array of yrmonths as integers, numpy array of floats)
+    '''
+    if hasattr(samples, 'series'):
+        return samples.series(site_id, name, start_date, end_date)
+
+    rows = list(samples.iter_samples(site_id, start_date, end_date, fields=[name, 'invalcode']))
+    yrmonths = numpy.array([int(row['yrmonth']) for row in rows], dtype=int)
+    parsed = [None if row.get('invalcode', '').strip() else parse_value(row.get(name)) for row in rows]
+    values = numpy.array([numpy.nan if value is None else value for value in parsed], dtype=float)
+
+    return yrmonths, values
+
+
+def monthly_means(yrmonths, values):
+    '''
+        Returns the mean of the values in each month that has any, in month order.
+
+        Returns:
+            Type: tuple(numpy array of month numbers (year * 12 + month - 1), numpy array of means)
+    '''
+    valid = ~numpy.isnan(values)
+    months = (yrmonths[valid] // 100) * 12 + yrmonths[valid] % 100 - 1
+    keys, inverse = numpy.unique(months, return_inverse=True)
+
+    totals = numpy.bincount(inverse, weights=values[valid], minlength=len(keys))
+    counts = numpy.bincount(inverse, minlength=len(keys))
+
+    return keys, totals / numpy.maximum(counts, 1)
+
+
+def rolling_means(months, means, window):
+    '''
+        Returns, for every month in months, the mean of the monthly means within the window
+        months ending at it. A month needs at least half the window to have data, else it is NaN.
+    '''
+    if not len(months):
+        return numpy.array([], dtype=float)
+
+    # place the monthly means on a contiguous month axis, so the window is a fixed span of months.
+    span = numpy.zeros(months[-1] - months[0] + 1)
+    present = numpy.zeros(len(span))
+    span[months - months[0]] = means
+    present[months - months[0]] = 1
+
+    totals = numpy.concatenate(([0.0], numpy.cumsum(span)))
+    counts = numpy.concatenate(([0.0], numpy.cumsum(present)))
+    ends = months - months[0] + 1
+    starts = numpy.maximum(ends - window, 0)
+
+    window_counts = counts[ends] - counts[starts]
+    rolling = (totals[ends] - totals[starts]) / numpy.maximum(window_counts, 1)
+    rolling[window_counts < math.ceil(window / 2)] = numpy.nan
+
+    return rolling
+
+
+def statistics(yrmonths, values, percentiles=default_percentiles, window=default_window, analyte=None):
+    '''
+        Compute the statistics of one site and analyte. Means (the summary, monthly, rolling and
+        seasonal means) are taken of the analyte's to_averaged values, the spread and percentiles
+        of its values as they are.
+
+        Input variables:
+            'yrmonths':
+                Type: numpy array of integers (YYYYMM),
+            'values':
+                Type: numpy array of floats (NaN for missing values),
+            'percentiles':
+                Type: list of floats (0 - 100),
+            'window':
+                Type: integer (months in the rolling mean),
+            'analyte':
+                Type: string (one of series_columns),
+        Returns:
+            Type: Dictionary
+    '''
+    valid = values[~numpy.isnan(values)]
+    averaged = to_averaged(analyte, values)
+
+    if valid.size:
+        mean = from_averaged(analyte, to_averaged(analyte, valid).mean())
+        summary = dict(count=int(valid.size), missing=int(values.size - valid.size), mean=rounded(mean),
+                       std=rounded(valid.std()), min=rounded(valid.min()), max=rounded(valid.max()))
+        quantiles = numpy.percentile(valid, percentiles)
+    else:
+        summary = dict(count=0, missing=int(values.size), mean=None, std=None, min=None, max=None)
+        quantiles = [numpy.nan] * len(percentiles)
+
+    months, means = monthly_means(yrmonths, averaged)
+    rolling = from_averaged(analyte, rolling_means(months, means, window))
+
+    # the mean of each calendar month, and the monthly means less their calendar month's mean.
+    calendar = months % 12
+    seasonal_totals = numpy.bincount(calendar, weights=means, minlength=12)
+    seasonal_counts = numpy.bincount(calendar, minlength=12)
+    seasonal = from_averaged(analyte, seasonal_totals / numpy.maximum(seasonal_counts, 1))
+    means = from_averaged(analyte, means)
+    anomalies = means - seasonal[calendar]
+
+    if len(months) >= 2:
+        slope = numpy.polyfit(months / 12.0, anomalies, 1)[0]
+    else:
+        slope = numpy.nan
+
+    return dict(
+        summary=summary,
+        percentiles={'{:g}'.format(percentile): rounded(value) for percentile, value in zip(percentiles, quantiles)},
+        seasonal={'{:02d}'.format(month + 1): rounded(seasonal[month]) for month in range(12) if seasonal_counts[month]},
+        trend=dict(slope_per_year=rounded(slope), months=int(len(months))),
+        monthly=[dict(yrmonth='{:04d}{:02d}'.format(month // 12, month % 12 + 1), mean=rounded(mean),
+                      rolling_mean=rounded(rolling_mean))
+                 for month, mean, rolling_mean in zip(months.tolist(), means.tolist(), rolling.tolist())],
+    )
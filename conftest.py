@@ -1,4 +1,5 @@
 from uuid import UUID, uuid4
+import csv
 import pytest
 import json
 import requests
@@ -9,6 +10,8 @@ currentdir = os.path.dirname(
     os.path.abspath(inspect.getfile(inspect.currentframe()))
 )
 
+from benchmarks.stub_server import StubServer
+
 # All tests are skipped for endpoints in unimplemented.
 unimplemented = []
 
@@ -36,3 +39,61 @@ def http_pool(request):
 @pytest.fixture(scope='session')
 def host(request):
     return request.config.getoption('--host')
+
+
+ntn_samples_header = ['siteID', 'labno', 'dateon', 'dateoff', 'yrmonth', 'ppt', 'subppt', 'svol',
+                      'flagCa', 'flagMg', 'flagK', 'flagNa', 'flagNH4', 'flagNO3', 'flagCl',
+                      'flagSO4', 'flagBr', 'valcode', 'invalcode', 'ph', 'Conduc', 'Ca', 'Mg', 'K',
+                      'Na', 'NH4', 'NO3', 'Cl', 'SO4', 'Br', 'modifiedOn']
+
+
+def ntn_sample_row(site_id, lab_no, yrmonth, value='0.100', ppt='1.000'):
+    """Build one NTN-All-w.csv row, using value for every concentration"""
+    row = dict.fromkeys(ntn_samples_header, value)
+    row.update({
+        'siteID': site_id, 'labno': lab_no, 'yrmonth': yrmonth,
+        'dateon': '{}-{}-01 08:00'.format(yrmonth[:4], yrmonth[4:]),
+        'dateoff': '{}-{}-08 08:00'.format(yrmonth[:4], yrmonth[4:]),
+        'ppt': ppt, 'subppt': ppt, 'svol': '100.000', 'Br': '-9',
+        'valcode': 'w ', 'invalcode': '            ', 'modifiedOn': '',
+    })
+    for flag in [field for field in ntn_samples_header if field.startswith('flag')]:
+        row[flag] = ' '
+    return row
+
+
+@pytest.fixture
+def ntn_samples_csv(tmp_path):
+    """A small NTN-All-w.csv with rows out of order and interleaved across sites"""
+    rows = [
+        ntn_sample_row('WY02', 'WY0003SW', '201603'),
+        ntn_sample_row('AB32', 'TQ1132SW', '201609', value='0.250', ppt='0.508'),
+        ntn_sample_row('WY02', 'WY0001SW', '201601'),
+        ntn_sample_row('AB32', 'TQ0742SW', '201609', value='-9.000', ppt='0.762'),
+        ntn_sample_row('WY02', 'WY0002SW', '201602', value='0.300', ppt='2.000'),
+        ntn_sample_row('AB32', 'TQ1501SW', '201610', value='0.500', ppt='1.500'),
+        ntn_sample_row('WY02', 'WY0004SW', '201701', value='0.200', ppt='0.000'),
+    ]
+    path = tmp_path / 'NTN-All-w.csv'
+    with open(str(path), 'w', encoding='utf8', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=ntn_samples_header)
+        writer.writeheader()
+        writer.writerows(rows)
+    return str(path)
+
+
+ntn_sites_csv = '\n'.join([
+    'siteid,network,siteName,county,state,latitude,longitude,elevation,startdate,stopdate,status',
+    'AB32,NTN,Fort Mackay,,AB,57.2096,-111.6471,265,2016-09-13 05:00,,A',
+    'WY02,NTN,Sinks Canyon,Fremont,WY,42.7336,-108.8498,2164,1984-08-21 05:00,,A',
+    'WY97,NTN,South Pass City,Fremont,WY,42.4944,-108.8320,2524,1985-04-30 05:00,,A',
+    'WY99,NTN,Newcastle,Weston,WY,43.8729,-104.1919,1466,1981-08-11 05:00,2009-01-13 16:00,I',
+]) + '\n'
+
+
+@pytest.fixture
+def ntn_sites_server():
+    """A local stand-in for http://nadp.slh.wisc.edu/data/sites/CSV/?net=NTN"""
+    server = StubServer(ntn_sites_csv).start()
+    yield server
+    server.stop()
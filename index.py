@@ -4,33 +4,80 @@
 '''
 
 # -- built-in imports
-import csv
-import io
+import base64
 import json
+import os
 import re
 
 # -- external imports
 import arrow
-from flask import abort, Flask, jsonify, Response
+from flask import abort, Flask, jsonify, Response, stream_with_context
 from geopy import distance
 from webargs import fields
-import requests
 from webargs.flaskparser import  use_kwargs
 from marshmallow import EXCLUDE, post_load, Schema, validates_schema, ValidationError
 
 # -- user-defined imports
-from common import logger
+from common import compression, dataset_refresh, fast_json, logger, metrics, rollups, sample_db, sample_index, sample_store, site_catalog, site_search, spatial, time_series
 from common.error_handling import get_error
+from common.response_cache import ResponseCache
 
 # -- Setup Flask app
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024
+# -- Where weekly samples are read from: 'memory' (NTN-All-w.csv), 'mmap' (NTN-All-w.csv plus
+# -- its NTN-All-w.csv.idx.npz byte-offset index) or 'sqlite' (ntn_samples.db)
+app.config['SAMPLE_BACKEND'] = os.environ.get('NTN_SAMPLE_BACKEND', 'memory')
 
-# -- Setup logging
+# -- Setup logging. Records are written by a background thread, tagged with the request's id
+# -- (see common/logger.py).
 index_log = logger.get_logger('logger', 'ntn_index.log')
-
-ntn_sites_url = 'http://nadp.slh.wisc.edu/data/sites/CSV/?net=NTN'
+logger.init_app(app)
+
+# -- Setup response cache
+response_cache = ResponseCache(max_entries=1024, max_bytes=64 * 1024 * 1024, max_age=300)
+
+# -- Setup metrics (see /metrics)
+metrics.init_app(app)
+metrics.registry.register(metrics.Gauge(
+    'ntn_response_cache_requests_total', 'Response cache lookups, by result.', ('result',),
+    collect=lambda: {('hit',): response_cache.hits, ('miss',): response_cache.misses}, kind='counter'))
+metrics.registry.register(metrics.Gauge(
+    'ntn_response_cache_bytes', 'Size of the responses held in the response cache.',
+    collect=lambda: {(): response_cache.size}))
+
+# -- Setup response compression (gzip, and brotli if installed). Registered after metrics so that
+# -- compression time is part of the recorded request latency.
+compression.init_app(app)
+
+# -- Data sources can be overridden with environment variables, e.g. to point at synthetic data
+# -- and a local stand-in for the upstream (see benchmarks/).
+ntn_sites_url = os.environ.get('NTN_SITES_URL', 'http://nadp.slh.wisc.edu/data/sites/CSV/?net=NTN')
 max_radius = 3958.8
+ntn_samples_file = os.environ.get('NTN_SAMPLES_FILE', 'NTN-All-w.csv')
+ntn_samples_db = os.environ.get('NTN_SAMPLES_DB', 'ntn_samples.db')
+# -- When set, NTN-All-w.csv is re-downloaded from here in the background every
+# -- NTN_REFRESH_INTERVAL seconds (see common/dataset_refresh.py)
+ntn_samples_url = os.environ.get('NTN_SAMPLES_URL')
+ntn_refresh_interval = float(os.environ.get('NTN_REFRESH_INTERVAL', 86400))
+sample_formats = ['json', 'ndjson', 'csv']
+# -- Columns that can be selected with fields=. siteID and labno (and siteid for sites) are the keys
+# -- responses are nested under, so they are always returned.
+sample_fields = ['dateon', 'dateoff', 'yrmonth', 'ppt', 'subppt', 'svol', 'flagCa', 'flagMg', 'flagK', 'flagNa',
+                 'flagNH4', 'flagNO3', 'flagCl', 'flagSO4', 'flagBr', 'valcode', 'invalcode', 'ph', 'Conduc',
+                 'Ca', 'Mg', 'K', 'Na', 'NH4', 'NO3', 'Cl', 'SO4', 'Br', 'modifiedOn']
+site_fields = ['network', 'siteName', 'county', 'state', 'latitude', 'longitude', 'elevation', 'startdate',
+               'stopdate', 'status']
+max_site_ids = 100
+max_nearest = 100
+max_window = 120
+max_page_size = 5000
+
+# -- Setup background dataset refresh
+if ntn_samples_url:
+    refresher = dataset_refresh.DatasetRefresher(
+        ntn_samples_url, ntn_samples_file, backend=app.config['SAMPLE_BACKEND'], db_path=ntn_samples_db,
+        sites_url=ntn_sites_url, interval=ntn_refresh_interval).start()
 
 
 @app.errorhandler(422)
@@ -96,66 +143,824 @@ def validate_location(location):
             Type: Boolean or throws a ValidationError
     """
 
-    loc_regex = r'^\(-?(([1-8]?[0-9])(\.[0-9]{1,10})?|90(\.0{1,10})?), ?-?((([1-9]?[0-9]|1[0-7][0-9])(\.[0-9]{1,10})?)|180(\.0{1,10})?)\)$'
+    loc_regex = r'^\(-?(([1-8]?[0-9])(\.[0-9]{1,10})?|90(\.0{1,10})?), ?-?((([1-9]?[0-9]|1[0-7][0-9])(\.[0-9]{1,10})?)|180(\.0{1,10})?)\)$'
+
+    if re.compile(loc_regex).match(location) is None:
+        raise ValidationError(get_error('01x006'))
+
+    return True
+
+
+def validate_bbox(bbox):
+    """
+        Helper function to validate format of user-provided bounding box. min_longitude may be
+        greater than max_longitude, for a box that crosses the antimeridian.
+
+        Input variables:
+            'bbox':
+                Type: string,
+        Returns:
+            Type: Boolean or throws a ValidationError
+    """
+
+    try:
+        min_lat, min_lon, max_lat, max_lon = (float(value) for value in bbox.strip('()').split(','))
+    except ValueError:
+        raise ValidationError(get_error('01x018'))
+
+    if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lon <= 180 and -180 <= max_lon <= 180):
+        raise ValidationError(get_error('01x018'))
+
+    return True
+
+
+def validate_percentiles(percentiles):
+    """
+        Helper function to validate a user-provided list of percentiles.
+
+        Input variables:
+            'percentiles':
+                Type: list of strings,
+        Returns:
+            Type: Boolean or throws a ValidationError
+    """
+
+    try:
+        valid = len(percentiles) > 0 and all(0 <= float(percentile) <= 100 for percentile in percentiles)
+    except ValueError:
+        valid = False
+
+    if not valid:
+        raise ValidationError(get_error('01x021'))
+
+    return True
+
+
+def validate_cursor(cursor):
+    """
+        Helper function to validate a pagination cursor returned by encode_cursor.
+
+        Input variables:
+            'cursor':
+                Type: string,
+        Returns:
+            Type: Boolean or throws a ValidationError
+    """
+
+    decode_cursor(cursor)
+
+    return True
+
+
+# -- Helper functions
+def encode_cursor(row):
+    '''
+        Helper function that returns an opaque cursor pointing just past a sample.
+
+        Input variables:
+            'row':
+                Type: Dictionary (sample),
+        Returns:
+            Type: string
+    '''
+
+    key = json.dumps([row['siteID'], row['yrmonth'], row['labno']])
+
+    return base64.urlsafe_b64encode(key.encode('utf8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    '''
+        Helper function that returns the (siteID, yrmonth, labno) key held by a cursor.
+
+        Input variables:
+            'cursor':
+                Type: string,
+        Returns:
+            Type: tuple or throws a ValidationError
+    '''
+
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf8'))
+        assert isinstance(key, list) and len(key) == 3 and all(isinstance(part, str) for part in key)
+        assert len(key[0]) == 4 and re.fullmatch(r'\d{6}', key[1])
+    except Exception as e:
+        raise ValidationError(get_error('01x014'))
+
+    return tuple(key)
+
+
+def ntn_site_runner(url):
+    '''
+        Helper function that returns the site catalog csv found at url as a dictionary. The
+        catalog is cached (see common/site_catalog.py), so most calls never leave the process.
+
+        Input variables:
+            'url':
+                Type: string,
+        Returns:
+            Type: Dictionary
+    '''
+
+    with metrics.phase('upstream'):
+        return site_catalog.get_catalog(url).get()
+
+
+def get_samples():
+    '''
+        Helper function that returns the sample backend configured by SAMPLE_BACKEND. Every
+        backend provides get(site_id, start_date, end_date).
+
+        Returns:
+            Type: SampleStore, SampleIndex or SampleDatabase
+    '''
+
+    if app.config['SAMPLE_BACKEND'] == 'sqlite':
+        return sample_db.get_database(ntn_samples_db)
+    if app.config['SAMPLE_BACKEND'] == 'mmap':
+        return sample_index.get_index(ntn_samples_file)
+
+    return sample_store.get_store(ntn_samples_file)
+
+
+def load_samples():
+    '''
+        Helper function that loads the configured sample backend and the sample index csv
+        responses are read from (whatever the backend) when a worker starts, so neither is built
+        or loaded on the request path. The index is saved alongside the csv (see
+        common/sample_index.py), so only the first worker for a dataset scans the file.
+    '''
+
+    try:
+        get_samples()
+        sample_index.get_index(ntn_samples_file)
+    except Exception as e:
+        index_log.error(e)
+
+
+def samples_version(args):
+    '''
+        Helper function that returns the version of the data a samples response is built from,
+        used to key the response cache.
+
+        Input variables:
+            'args':
+                Type: Dictionary (validated arguments),
+        Returns:
+            Type: tuple
+    '''
+
+    try:
+        version = get_samples().version
+    except Exception as e:
+        version = None
+
+    # sites selected by state or location also depend on the site catalog.
+    if 'state' in args or 'location' in args:
+        return (version, sites_version(args))
+
+    return (version,)
+
+
+def sites_version(args):
+    '''
+        Helper function that returns the version of the site catalog, used to key the response
+        cache.
+
+        Input variables:
+            'args':
+                Type: Dictionary (validated arguments),
+        Returns:
+            Type: string
+    '''
+
+    catalog = site_catalog.get_catalog(ntn_sites_url)
+    with metrics.phase('upstream'):
+        sites = catalog.get()
+
+    # an empty catalog means the upstream could not be reached, so responses built from it are not kept.
+    if not sites:
+        response_cache.no_store()
+
+    return catalog.version
+
+
+def selected_site_ids(args):
+    '''
+        Helper function that returns the site ids selected by the site_id, site_ids, state or
+        location (with radius and include_inactive) arguments of a samples request.
+
+        Input variables:
+            'args':
+                Type: Dictionary (validated arguments),
+        Returns:
+            Type: list of strings
+    '''
+
+    if 'site_ids' in args:
+        return args['site_ids']
+
+    if 'state' in args:
+        sites = ntn_site_runner(ntn_sites_url)
+        return sorted(site_id for site_id, site in sites.items() if site['state'] == args['state'])
+
+    if 'location' in args:
+        catalog = site_catalog.get_catalog(ntn_sites_url)
+        with metrics.phase('upstream'):
+            sites = catalog.get()
+
+        with metrics.phase('distance'):
+            site_ids = spatial.get_grid(sites, catalog.version).within_radius(args['location'], args['radius'])
+
+        # if include_inactive flag is set, include inactive sites, otherwise only include active sites.
+        return sorted(site_id for site_id in site_ids
+                      if args['include_inactive'] and sites[site_id]['status'] == 'I' or sites[site_id]['status'] == 'A')
+
+    return [args['site_id']]
+
+
+def paged_samples(site_ids, start_date, end_date, limit, cursor=None, columns=None):
+    '''
+        Helper function that returns one page of samples, in (siteID, yrmonth, labno) order. Each
+        site resumes directly at the cursor position rather than from the start of the window, and
+        no more than the limit + 1 samples needed to tell whether there is a next page are read.
+
+        Input variables:
+            'site_ids':
+                Type: list of strings,
+            'start_date':
+                Type: string (YYYYMM),
+            'end_date':
+                Type: string (YYYYMM),
+            'limit':
+                Type: integer (page size),
+            'cursor':
+                Type: tuple(siteID, yrmonth, labno) (the last sample of the previous page),
+            'columns':
+                Type: list of strings (columns needed, all if None),
+        Returns:
+            Type: tuple(list of dictionaries, cursor for the next page or None)
+    '''
+
+    samples = get_samples()
+    rows = []
+
+    for site_id in sorted(site_ids):
+        if cursor is not None and site_id < cursor[0]:
+            continue
+
+        after = cursor[1:] if cursor is not None and site_id == cursor[0] else None
+
+        for row in samples.iter_samples(site_id, start_date, end_date, after, columns, limit + 1 - len(rows)):
+            if len(rows) == limit:
+                return rows, encode_cursor(rows[-1])
+            rows.append(row)
+
+    return rows, None
+
+
+def ndjson_samples(site_ids, start_date, end_date, columns=None):
+    '''
+        Generator that yields the samples for a list of sites as newline delimited json, one
+        sample per line, as they are read from the sample backend.
+
+        Input variables:
+            'site_ids':
+                Type: list of strings,
+            'start_date':
+                Type: string (YYYYMM),
+            'end_date':
+                Type: string (YYYYMM),
+            'columns':
+                Type: list of strings (columns to return along with siteID and labno, all if None),
+        Returns:
+            Type: generator of bytes
+    '''
+
+    try:
+        for row in metrics.timed(get_samples().iter_sites(site_ids, start_date, end_date, columns), 'lookup'):
+            if columns is not None:
+                row = {key: value for key, value in row.items() if key in ('siteID', 'labno') or key in columns}
+            yield fast_json.dumps(row) + b'\n'
+    except Exception as e:
+        index_log.error(e)
+
+
+def csv_samples(site_ids, start_date, end_date):
+    '''
+        Generator that yields the header line of NTN-All-w.csv followed by the original bytes of
+        every matching row, without parsing them. Rows come out in the order they are stored in
+        the file, so the rows for every site are read in a single pass. The sample index is loaded
+        with the backend when the worker starts (see load_samples).
+
+        Input variables:
+            'site_ids':
+                Type: list of strings,
+            'start_date':
+                Type: string (YYYYMM),
+            'end_date':
+                Type: string (YYYYMM),
+        Returns:
+            Type: generator of bytes
+    '''
+
+    try:
+        index = sample_index.get_index(ntn_samples_file)
+        yield index.read(*index.header)
+
+        ranges = sorted(block for site_id in site_ids for block in index.ranges(site_id, start_date, end_date))
+
+        # merge ranges that sit next to each other in the file into a single read.
+        chunk_start = chunk_end = None
+        for start, end in ranges + [(None, None)]:
+            if start is not None and start == chunk_end:
+                chunk_end = end
+                continue
+
+            if chunk_start is not None:
+                chunk = index.read(chunk_start, chunk_end)
+                yield chunk if chunk.endswith(b'\n') else chunk + b'\n'
+            chunk_start, chunk_end = start, end
+    except Exception as e:
+        index_log.error(e)
+
+
+def point_within_radius(input_location, site_location, radius):
+    '''
+        Validation function that returns a boolean value of whether or not a given site_location is
+        within the supplied distance (radius) of the input_location.
+
+        Input variables:
+            'input_location':
+                Type: tuple(latitude, longitude),
+            'site_location':
+                Type: tuple(latitude, longitude),
+            'radius':
+                Type: float (in miles),
+        Returns:
+            Type: Boolean
+    '''
+
+    dis = distance.distance(input_location, site_location).miles
+
+    if dis <= radius:
+        return True
+    else:
+        return False
+
+
+# -- Schemas and Endpoints
+class ntn_get_by_id_schema(Schema):
+    start_date=fields.Integer(
+        required=True,
+        validate=lambda timestamp: 0 <= timestamp <= int(arrow.utcnow().timestamp),
+        error_messages={
+            "null": get_error('01x002', key='start_date', minimum=0, maximum=int(arrow.utcnow().timestamp)),
+            "required": get_error('01x002', key='start_date', minimum=0, maximum=int(arrow.utcnow().timestamp)),
+            "invalid": get_error('01x002', key='start_date', minimum=0, maximum=int(arrow.utcnow().timestamp)),
+            "type": get_error('01x002', key='start_date', minimum=0, maximum=int(arrow.utcnow().timestamp)),
+            "validator_failed": get_error('01x002', key='start_date', minimum=0, maximum=int(arrow.utcnow().timestamp)),
+        }
+    )
+    end_date=fields.Integer(
+        required=True,
+        validate=lambda timestamp: 0 <= timestamp <= int(arrow.utcnow().timestamp),
+        error_messages={
+            "null": get_error('01x002', key='end_date', minimum=0, maximum=int(arrow.utcnow().timestamp)),
+            "required": get_error('01x002', key='end_date', minimum=0, maximum=int(arrow.utcnow().timestamp)),
+            "invalid": get_error('01x002', key='end_date', minimum=0, maximum=int(arrow.utcnow().timestamp)),
+            "type": get_error('01x002', key='end_date', minimum=0, maximum=int(arrow.utcnow().timestamp)),
+            "validator_failed": get_error('01x002', key='end_date', minimum=0, maximum=int(arrow.utcnow().timestamp)),
+        }
+    )
+    site_id=fields.String(
+        required=False,
+        validate=lambda p:  len(p) == 4,
+        error_messages={
+            "null": get_error('01x004'),
+            "invalid": get_error('01x004'),
+            "type": get_error('01x004'),
+            "validator_failed": get_error('01x004'),
+        }
+    )
+    site_ids=fields.DelimitedList(
+        fields.String(),
+        required=False,
+        validate=lambda ids: 1 <= len(ids) <= max_site_ids and all(len(id) == 4 for id in ids),
+        error_messages={
+            "null": get_error('01x009', maximum=max_site_ids),
+            "invalid": get_error('01x009', maximum=max_site_ids),
+            "type": get_error('01x009', maximum=max_site_ids),
+            "validator_failed": get_error('01x009', maximum=max_site_ids),
+        }
+    )
+    state=fields.String(
+        required=False,
+        validate=lambda state: len(state) == 2 and state.isalpha(),
+        error_messages={
+            "null": get_error('01x010'),
+            "invalid": get_error('01x010'),
+            "type": get_error('01x010'),
+            "validator_failed": get_error('01x010'),
+        }
+    )
+    location = fields.String(
+        required=False,
+        validate=lambda p: validate_location(p),
+        error_messages={
+            "null": get_error('01x006'),
+            "invalid": get_error('01x006'),
+            "type": get_error('01x006'),
+            "validator_failed": get_error('01x006'),
+        }
+    )
+    radius=fields.Float(
+        required=False,
+        validate=lambda radius: 0 <= radius <= max_radius,
+        error_messages={
+            "null": get_error('01x002', key='radius', minimum=0, maximum=max_radius),
+            "invalid": get_error('01x002', key='radius', minimum=0, maximum=max_radius),
+            "type": get_error('01x002', key='radius', minimum=0, maximum=max_radius),
+            "validator_failed": get_error('01x002', key='radius', minimum=0, maximum=max_radius),
+        }
+    )
+    include_inactive=fields.Boolean(
+        required=False,
+        default=True,
+        missing=True,
+        truthy = ['True'], # sets custom truthy values
+        falsy = ['False'], # sets custom falsy values
+        error_messages={
+            "null": get_error('01x005'),
+            "invalid": get_error('01x005'),
+            "type": get_error('01x005'),
+            "validator_failed": get_error('01x005'),
+        }
+    )
+    format=fields.String(
+        required=False,
+        missing='json',
+        validate=lambda f: f in sample_formats,
+        error_messages={
+            "null": get_error('01x008', formats=', '.join(sample_formats)),
+            "invalid": get_error('01x008', formats=', '.join(sample_formats)),
+            "type": get_error('01x008', formats=', '.join(sample_formats)),
+            "validator_failed": get_error('01x008', formats=', '.join(sample_formats)),
+        }
+    )
+    limit=fields.Integer(
+        required=False,
+        validate=lambda limit: 1 <= limit <= max_page_size,
+        error_messages={
+            "null": get_error('01x002', key='limit', minimum=1, maximum=max_page_size),
+            "invalid": get_error('01x002', key='limit', minimum=1, maximum=max_page_size),
+            "type": get_error('01x002', key='limit', minimum=1, maximum=max_page_size),
+            "validator_failed": get_error('01x002', key='limit', minimum=1, maximum=max_page_size),
+        }
+    )
+    cursor=fields.String(
+        required=False,
+        validate=lambda cursor: validate_cursor(cursor),
+        error_messages={
+            "null": get_error('01x014'),
+            "invalid": get_error('01x014'),
+            "type": get_error('01x014'),
+            "validator_failed": get_error('01x014'),
+        }
+    )
+    columns=fields.DelimitedList(
+        fields.String(),
+        data_key='fields',
+        required=False,
+        validate=lambda columns: len(columns) > 0 and all(column in sample_fields for column in columns),
+        error_messages={
+            "null": get_error('01x016', fields=', '.join(sample_fields)),
+            "invalid": get_error('01x016', fields=', '.join(sample_fields)),
+            "type": get_error('01x016', fields=', '.join(sample_fields)),
+            "validator_failed": get_error('01x016', fields=', '.join(sample_fields)),
+        }
+    )
+
+    class Meta:
+        unknown = EXCLUDE
+        strict = True
+
+    def __init__(self):
+        super().__init__()
+
+    @validates_schema
+    def validate_schema(self, args, **kwargs):
+        '''
+            A custom validator for the schema. This is used when multiple arguments or their
+            validation rely upon other arguments.
+        '''
+        # exactly one of site_id, site_ids, state or location (with radius) selects the sites to return.
+        selections = [arg for arg in ['site_id', 'site_ids', 'state', 'location'] if arg in args]
+        if 'radius' in args and 'location' not in args:
+            raise ValidationError(get_error('01x006'), 'location')
+        if not selections:
+            raise ValidationError(get_error('01x004'), 'site_id')
+        if len(selections) > 1:
+            raise ValidationError(get_error('01x011'), 'site_id')
+        if 'location' in args and 'radius' not in args:
+            raise ValidationError(get_error('01x002', key='radius', minimum=0, maximum=max_radius), 'radius')
+
+        if ('limit' in args or 'cursor' in args) and args['format'] != 'json':
+            raise ValidationError(get_error('01x015'), 'format')
+        if 'columns' in args and args['format'] == 'csv':
+            raise ValidationError(get_error('01x017'), 'format')
+
+        try:
+            assert args['start_date'] <= args['end_date']
+        except Exception as e:
+            raise ValidationError(e, 'schema_validation')
+
+    @post_load
+    def massage_input(self, args, **kwargs):
+        '''
+            A custom formatter for input arguments. After input arguments are validated, this
+            function can be ran to format/massage data into data that is more suitable for our use.
+        '''
+        for date in ['start_date', 'end_date']:
+            if date in args:
+                args[date] = arrow.get(args[date]).format('YYYYMM')
+
+        if 'site_id' in args:
+            args['site_id'] = args['site_id'].upper()
+        if 'site_ids' in args:
+            # drop duplicates, keeping the order the ids were given in.
+            args['site_ids'] = list(dict.fromkeys(site_id.upper() for site_id in args['site_ids']))
+        if 'state' in args:
+            args['state'] = args['state'].upper()
+        if 'location' in args:
+            formatted_location = args['location'].strip('()').split(',')
+            args['location'] = (float(formatted_location[0]), float(formatted_location[1]))
+
+        if 'cursor' in args:
+            args['cursor'] = decode_cursor(args['cursor'])
+            args.setdefault('limit', max_page_size)
+        if 'columns' in args:
+            args['columns'] = list(dict.fromkeys(args['columns']))
+
+        return args
+
+
+@app.route('/<version>/ntn/samples/get/by_id/', methods=['GET'], strict_slashes=False)
+@use_kwargs(ntn_get_by_id_schema, location='query')
+@metrics.validated
+@response_cache.cached(samples_version)
+def ntn_get_by_site_id(version, **kwargs):
+    '''
+        An endpoint that returns all weekly samples for a given site ID, list of site IDs, state
+        or every site within a radius of a location, that were sampled between a given start and
+        end date.
+
+        Input variables:
+            'site_id':
+                Required: One of site_id, site_ids, state or location,
+                Type: String,
+                Validation: Must contain 4 characters.
+            'site_ids':
+                Required: One of site_id, site_ids, state or location,
+                Type: Comma separated list of strings,
+                Validation: Must contain 1 to max_site_ids ids of 4 characters.
+            'state':
+                Required: One of site_id, site_ids, state or location,
+                Type: String,
+                Validation: Must contain 2 letters.
+            'location':
+                Required: One of site_id, site_ids, state or location,
+                Type: String,
+                Validation: Must be in the format (latitude, longitude). Selects the sites within
+                            radius miles of it.
+            'radius':
+                Required: With location,
+                Type: Float,
+                Validation: Must be greater than or equal to 0 and less than or equal to max_radius.
+            'include_inactive':
+                Required: No,
+                Default: True,
+                Type: Boolean,
+                Validation: Must be True or False. With location, whether inactive sites
+                            (status==I) are included.
+            'format':
+                Required: No,
+                Default: json,
+                Type: String,
+                Validation: Must be one of sample_formats. ndjson streams one sample per line and
+                            csv streams the matching rows of NTN-All-w.csv as they are stored.
+            'limit':
+                Required: No,
+                Type: Integer,
+                Validation: Must be between 1 and max_page_size. Returns at most limit samples,
+                            ordered by site, yrmonth and labno, along with a next_cursor.
+            'cursor':
+                Required: No,
+                Type: String,
+                Validation: Must be a next_cursor returned by a previous request.
+            'fields':
+                Required: No,
+                Default: All columns,
+                Type: Comma separated list of strings,
+                Validation: Must be columns found in sample_fields. Only these columns are
+                            returned for each sample. Not available with format=csv.
+        Output:
+            Type: application/json, application/x-ndjson or text/csv
+    '''
+
+    response = dict(data=dict(), errors=dict())
+
+    if not version == 'v1.0':
+        error = get_error('01x001')
+        response['errors'].update(error)
+        json_abort(400, response)
+
+    site_ids = selected_site_ids(kwargs)
+
+    if kwargs['format'] == 'ndjson':
+        rows = ndjson_samples(site_ids, kwargs['start_date'], kwargs['end_date'], kwargs.get('columns'))
+        return Response(stream_with_context(metrics.timed(rows, 'serialization')), mimetype='application/x-ndjson')
+
+    if kwargs['format'] == 'csv':
+        # csv rows are copied from the file unparsed, so the whole body is the lookup.
+        rows = csv_samples(site_ids, kwargs['start_date'], kwargs['end_date'])
+        return Response(stream_with_context(metrics.timed(rows, 'lookup')), mimetype='text/csv')
+
+    try:
+        with metrics.phase('lookup'):
+            samples = get_samples()
+            columns = kwargs.get('columns')
+            if 'limit' in kwargs:
+                rows, response['next_cursor'] = paged_samples(site_ids, kwargs['start_date'], kwargs['end_date'],
+                                                              kwargs['limit'], kwargs.get('cursor'), columns)
+            else:
+                rows = samples.iter_sites(site_ids, kwargs['start_date'], kwargs['end_date'], columns)
+
+            for row in rows:
+                site_id = row["siteID"]
+
+                if not site_id in response['data']:
+                    response['data'][site_id] = {}
+
+                response['data'][site_id][row["labno"]] = row
+
+        with metrics.phase('serialization'):
+            # the in-memory store keeps each row's full encoding, other backends (and projections)
+            # encode rows as they go.
+            if columns is None:
+                fragment = getattr(samples, 'fragment', fast_json.sample_fragment)
+            else:
+                fragment = lambda row: fast_json.sample_fragment(row, columns)
+            response['data'] = fast_json.join_object(
+                (site_id, fast_json.join_object((lab_no, fragment(row)) for lab_no, row in sorted(site_rows.items())))
+                for site_id, site_rows in sorted(response['data'].items())
+            )
+
+    except Exception as e:
+        index_log.error(e)
+        response_cache.no_store()
+
+    return fast_json.response(response)
+
+
+class ntn_samples_aggregate_schema(Schema):
+    start_date=fields.Integer(
+        required=True,
+        validate=lambda timestamp: 0 <= timestamp <= int(arrow.utcnow().timestamp),
+        error_messages={
+            "null": get_error('01x002', key='start_date', minimum=0, maximum=int(arrow.utcnow().timestamp)),
+            "required": get_error('01x002', key='start_date', minimum=0, maximum=int(arrow.utcnow().timestamp)),
+            "invalid": get_error('01x002', key='start_date', minimum=0, maximum=int(arrow.utcnow().timestamp)),
+            "type": get_error('01x002', key='start_date', minimum=0, maximum=int(arrow.utcnow().timestamp)),
+            "validator_failed": get_error('01x002', key='start_date', minimum=0, maximum=int(arrow.utcnow().timestamp)),
+        }
+    )
+    end_date=fields.Integer(
+        required=True,
+        validate=lambda timestamp: 0 <= timestamp <= int(arrow.utcnow().timestamp),
+        error_messages={
+            "null": get_error('01x002', key='end_date', minimum=0, maximum=int(arrow.utcnow().timestamp)),
+            "required": get_error('01x002', key='end_date', minimum=0, maximum=int(arrow.utcnow().timestamp)),
+            "invalid": get_error('01x002', key='end_date', minimum=0, maximum=int(arrow.utcnow().timestamp)),
+            "type": get_error('01x002', key='end_date', minimum=0, maximum=int(arrow.utcnow().timestamp)),
+            "validator_failed": get_error('01x002', key='end_date', minimum=0, maximum=int(arrow.utcnow().timestamp)),
+        }
+    )
+    site_id=fields.String(
+        required=True,
+        validate=lambda p:  len(p) == 4,
+        error_messages={
+            "null": get_error('01x004'),
+            "required": get_error('01x004'),
+            "invalid": get_error('01x004'),
+            "type": get_error('01x004'),
+            "validator_failed": get_error('01x004'),
+        }
+    )
+    period=fields.String(
+        required=False,
+        missing='monthly',
+        validate=lambda period: period in rollups.periods,
+        error_messages={
+            "null": get_error('01x012', periods=', '.join(rollups.periods)),
+            "invalid": get_error('01x012', periods=', '.join(rollups.periods)),
+            "type": get_error('01x012', periods=', '.join(rollups.periods)),
+            "validator_failed": get_error('01x012', periods=', '.join(rollups.periods)),
+        }
+    )
+    analytes=fields.DelimitedList(
+        fields.String(),
+        required=False,
+        validate=lambda selected: len(selected) > 0 and all(analyte in rollups.analytes for analyte in selected),
+        error_messages={
+            "null": get_error('01x013', analytes=', '.join(rollups.analytes)),
+            "invalid": get_error('01x013', analytes=', '.join(rollups.analytes)),
+            "type": get_error('01x013', analytes=', '.join(rollups.analytes)),
+            "validator_failed": get_error('01x013', analytes=', '.join(rollups.analytes)),
+        }
+    )
+
+    class Meta:
+        unknown = EXCLUDE
+        strict = True
+
+    def __init__(self):
+        super().__init__()
+
+    @validates_schema
+    def validate_schema(self, args, **kwargs):
+        '''
+            A custom validator for the schema. This is used when multiple arguments or their
+            validation rely upon other arguments.
+        '''
+        try:
+            assert args['start_date'] <= args['end_date']
+        except Exception as e:
+            raise ValidationError(e, 'schema_validation')
+
+    @post_load
+    def massage_input(self, args, **kwargs):
+        for date in ['start_date', 'end_date']:
+            if date in args:
+                args[date] = arrow.get(args[date]).format('YYYYMM')
 
-    if re.compile(loc_regex).match(location) is None:
-        raise ValidationError(get_error('01x006'))
+        if 'site_id' in args:
+            args['site_id'] = args['site_id'].upper()
 
-    return True
+        return args
 
 
-# -- Helper functions
-def ntn_site_runner(url):
+@app.route('/<version>/ntn/samples/aggregate/', methods=['GET'], strict_slashes=False)
+@use_kwargs(ntn_samples_aggregate_schema, location='query')
+@metrics.validated
+@response_cache.cached(samples_version)
+def ntn_samples_aggregate(version, **kwargs):
     '''
-        Helper function to convert csv response to a dictionary.
+        An endpoint that returns monthly or annual rollups for a given site ID: the sample count,
+        mean and precipitation-weighted mean of each analyte, and the total precipitation, for
+        every period between a given start and end date.
 
         Input variables:
-            'url':
-                Type: string,
-        Returns:
-            Type: Dictionary
+            'site_id':
+                Required: Yes,
+                Type: String,
+                Validation: Must contain 4 characters.
+            'period':
+                Required: No,
+                Default: monthly,
+                Type: String,
+                Validation: Must be monthly or annual.
+            'analytes':
+                Required: No,
+                Default: All analytes,
+                Type: Comma separated list of strings,
+                Validation: Must be analytes found in rollups.analytes.
+        Output:
+            Type: application/json
     '''
 
-    result={}
+    response = dict(data=dict(), errors=dict())
+
+    if not version == 'v1.0':
+        error = get_error('01x001')
+        response['errors'].update(error)
+        json_abort(400, response)
 
     try:
-        response = requests.get(url)
-        assert response.status_code == 200
-        reader = csv.DictReader(io.StringIO(response.text))
-        data = list(reader)
-        result.update({site.pop("siteid"): site for site in data})
+        with metrics.phase('lookup'):
+            periods = rollups.lookup(rollups.get_rollups(get_samples()), kwargs['period'], kwargs['site_id'],
+                                     kwargs['start_date'], kwargs['end_date'], kwargs.get('analytes'))
+        if periods:
+            response['data'][kwargs['site_id']] = periods
     except Exception as e:
         index_log.error(e)
+        response_cache.no_store()
 
-    return result
-
-
-def point_within_radius(input_location, site_location, radius):
-    '''
-        Validation function that returns a boolean value of whether or not a given site_location is
-        within the supplied distance (radius) of the input_location.
-
-        Input variables:
-            'input_location':
-                Type: tuple(latitude, longitude),
-            'site_location':
-                Type: tuple(latitude, longitude),
-            'radius':
-                Type: float (in miles),
-        Returns:
-            Type: Boolean
-    '''
-
-    dis = distance.distance(input_location, site_location).miles
-
-    if dis <= radius:
-        return True
-    else:
-        return False
+    with metrics.phase('serialization'):
+        return fast_json.response(response)
 
 
-# -- Schemas and Endpoints
-class ntn_get_by_id_schema(Schema):
+class ntn_samples_statistics_schema(Schema):
     start_date=fields.Integer(
         required=True,
         validate=lambda timestamp: 0 <= timestamp <= int(arrow.utcnow().timestamp),
@@ -189,6 +994,39 @@ class ntn_get_by_id_schema(Schema):
             "validator_failed": get_error('01x004'),
         }
     )
+    analyte=fields.String(
+        required=True,
+        validate=lambda analyte: analyte in time_series.series_columns,
+        error_messages={
+            "null": get_error('01x020', analytes=', '.join(time_series.series_columns)),
+            "required": get_error('01x020', analytes=', '.join(time_series.series_columns)),
+            "invalid": get_error('01x020', analytes=', '.join(time_series.series_columns)),
+            "type": get_error('01x020', analytes=', '.join(time_series.series_columns)),
+            "validator_failed": get_error('01x020', analytes=', '.join(time_series.series_columns)),
+        }
+    )
+    window=fields.Integer(
+        required=False,
+        missing=time_series.default_window,
+        validate=lambda window: 1 <= window <= max_window,
+        error_messages={
+            "null": get_error('01x002', key='window', minimum=1, maximum=max_window),
+            "invalid": get_error('01x002', key='window', minimum=1, maximum=max_window),
+            "type": get_error('01x002', key='window', minimum=1, maximum=max_window),
+            "validator_failed": get_error('01x002', key='window', minimum=1, maximum=max_window),
+        }
+    )
+    percentiles=fields.DelimitedList(
+        fields.String(),
+        required=False,
+        validate=lambda percentiles: validate_percentiles(percentiles),
+        error_messages={
+            "null": get_error('01x021'),
+            "invalid": get_error('01x021'),
+            "type": get_error('01x021'),
+            "validator_failed": get_error('01x021'),
+        }
+    )
 
     class Meta:
         unknown = EXCLUDE
@@ -210,29 +1048,47 @@ class ntn_get_by_id_schema(Schema):
 
     @post_load
     def massage_input(self, args, **kwargs):
-        '''
-            A custom formatter for input arguments. After input arguments are validated, this
-            function can be ran to format/massage data into data that is more suitable for our use.
-        '''
         for date in ['start_date', 'end_date']:
             if date in args:
                 args[date] = arrow.get(args[date]).format('YYYYMM')
 
+        if 'site_id' in args:
+            args['site_id'] = args['site_id'].upper()
+        args['percentiles'] = sorted(set(float(percentile) for percentile in args.get('percentiles', time_series.default_percentiles)))
+
         return args
 
 
-@app.route('/<version>/ntn/samples/get/by_id/', methods=['GET'], strict_slashes=False)
-@use_kwargs(ntn_get_by_id_schema, location='query')
-def ntn_get_by_site_id(version, **kwargs):
+@app.route('/<version>/ntn/samples/statistics/', methods=['GET'], strict_slashes=False)
+@use_kwargs(ntn_samples_statistics_schema, location='query')
+@metrics.validated
+@response_cache.cached(samples_version)
+def ntn_samples_statistics(version, **kwargs):
     '''
-        An endpoint that returns all weekly samples for a given site ID, that were sampled between
-        a given start and end date.
+        An endpoint that returns statistics of one analyte for a given site ID, over the samples
+        between a given start and end date: a summary (count, mean, standard deviation, minimum
+        and maximum), percentiles, the mean of each calendar month, a deseasonalized linear trend,
+        and the mean and rolling mean of every month.
 
         Input variables:
             'site_id':
                 Required: Yes,
                 Type: String,
                 Validation: Must contain 4 characters.
+            'analyte':
+                Required: Yes,
+                Type: String,
+                Validation: Must be ppt or an analyte found in rollups.analytes.
+            'window':
+                Required: No,
+                Default: 12,
+                Type: Integer,
+                Validation: Must be between 1 and max_window. Months in the rolling mean.
+            'percentiles':
+                Required: No,
+                Default: 5,25,50,75,95,
+                Type: Comma separated list of floats,
+                Validation: Must be between 0 and 100.
         Output:
             Type: application/json
     '''
@@ -245,28 +1101,18 @@ def ntn_get_by_site_id(version, **kwargs):
         json_abort(400, response)
 
     try:
-        with open('NTN-All-w.csv', 'r', encoding='utf8') as csvfile:
-            reader = csv.DictReader(csvfile)
-
-            for row in reader:
-                site_id = row.pop("siteID")
-
-                # if its not our site_id or within the start_date - end_date window, throw it out.
-                if site_id != kwargs['site_id'] \
-                or not kwargs['start_date'] <= row["yrmonth"] <= kwargs["end_date"]:
-                    continue
-
-                if not site_id in response['data']:
-                    response['data'][site_id] = {}
-
-                lab_no = row.pop("labno")
-
-                response['data'][site_id][lab_no] = row
-
+        with metrics.phase('lookup'):
+            yrmonths, values = time_series.load_series(get_samples(), kwargs['site_id'], kwargs['analyte'],
+                                                       kwargs['start_date'], kwargs['end_date'])
+            if len(values):
+                response['data'][kwargs['site_id']] = {kwargs['analyte']: time_series.statistics(
+                    yrmonths, values, kwargs['percentiles'], kwargs['window'], kwargs['analyte'])}
     except Exception as e:
         index_log.error(e)
+        response_cache.no_store()
 
-    return response
+    with metrics.phase('serialization'):
+        return fast_json.response(response)
 
 
 class ntn_site_info_schema(Schema):
@@ -281,6 +1127,18 @@ class ntn_site_info_schema(Schema):
             "validator_failed": get_error('01x004', key='end_date'),
         }
     )
+    columns=fields.DelimitedList(
+        fields.String(),
+        data_key='fields',
+        required=False,
+        validate=lambda columns: len(columns) > 0 and all(column in site_fields for column in columns),
+        error_messages={
+            "null": get_error('01x016', fields=', '.join(site_fields)),
+            "invalid": get_error('01x016', fields=', '.join(site_fields)),
+            "type": get_error('01x016', fields=', '.join(site_fields)),
+            "validator_failed": get_error('01x016', fields=', '.join(site_fields)),
+        }
+    )
 
     class Meta:
         unknown = EXCLUDE
@@ -293,12 +1151,16 @@ class ntn_site_info_schema(Schema):
     def massage_input(self, args, **kwargs):
         if 'site_id' in args:
             args['site_id'] = args['site_id'].upper()
+        if 'columns' in args:
+            args['columns'] = list(dict.fromkeys(args['columns']))
 
         return args
 
 
 @app.route('/<version>/ntn/site/info/', methods=['GET'], strict_slashes=False)
 @use_kwargs(ntn_site_info_schema, location='query')
+@metrics.validated
+@response_cache.cached(sites_version)
 def site_info(version, **kwargs):
     '''
         An endpoint that returns the site information for a given site ID.
@@ -308,6 +1170,12 @@ def site_info(version, **kwargs):
                 Required: Yes,
                 Type: String,
                 Validation: Must contain 4 characters.
+            'fields':
+                Required: No,
+                Default: All columns,
+                Type: Comma separated list of strings,
+                Validation: Must be columns found in site_fields. Only these columns are returned
+                            for each site.
         Output:
             Type: application/json
     '''
@@ -322,13 +1190,13 @@ def site_info(version, **kwargs):
     sites = ntn_site_runner(ntn_sites_url)
 
     if kwargs['site_id'] in sites:
-        response['data'] = sites[kwargs['site_id']]
+        response['data'] = fast_json.site_fragment(sites, kwargs['site_id'], kwargs.get('columns'))
     else:
         error = get_error('01x004')
         response['errors'].update(error)
         json_abort(400, response)
 
-    return response
+    return fast_json.response(response)
 
 
 class site_info_by_radius_schema(Schema):
@@ -369,6 +1237,19 @@ class site_info_by_radius_schema(Schema):
         }
     )
 
+    columns=fields.DelimitedList(
+        fields.String(),
+        data_key='fields',
+        required=False,
+        validate=lambda columns: len(columns) > 0 and all(column in site_fields for column in columns),
+        error_messages={
+            "null": get_error('01x016', fields=', '.join(site_fields)),
+            "invalid": get_error('01x016', fields=', '.join(site_fields)),
+            "type": get_error('01x016', fields=', '.join(site_fields)),
+            "validator_failed": get_error('01x016', fields=', '.join(site_fields)),
+        }
+    )
+
     class Meta:
         unknown = EXCLUDE
         strict = True
@@ -381,12 +1262,16 @@ class site_info_by_radius_schema(Schema):
         if 'location' in args:
             formatted_location = args['location'].strip('()').split(',')
             args['location'] = (float(formatted_location[0]), float(formatted_location[1]))
+        if 'columns' in args:
+            args['columns'] = list(dict.fromkeys(args['columns']))
 
         return args
 
 
 @app.route('/<version>/ntn/site/info/by_radius', methods=['GET'], strict_slashes=False)
 @use_kwargs(site_info_by_radius_schema, location='query')
+@metrics.validated
+@response_cache.cached(sites_version)
 def site_info_by_radius(version, **kwargs):
     '''
         An endpoint that returns site information for all sites within a radius of a given latitude
@@ -406,6 +1291,12 @@ def site_info_by_radius(version, **kwargs):
                 Required: Yes,
                 Type: Float,
                 Validation: Must be greater than or equal to 0 and less than or equal to max_radius.
+            'fields':
+                Required: No,
+                Default: All columns,
+                Type: Comma separated list of strings,
+                Validation: Must be columns found in site_fields. Only these columns are returned
+                            for each site.
         Output:
             Type: application/json
     '''
@@ -417,15 +1308,291 @@ def site_info_by_radius(version, **kwargs):
         response['errors'].update(error)
         json_abort(400, response)
 
-    sites = ntn_site_runner(ntn_sites_url)
+    catalog = site_catalog.get_catalog(ntn_sites_url)
+    with metrics.phase('upstream'):
+        sites = catalog.get()
+
+    with metrics.phase('distance'):
+        grid = spatial.get_grid(sites, catalog.version)
+        site_ids = grid.within_radius(kwargs['location'], kwargs['radius'])
+
+    for site in site_ids:
+        # if include_inactive flag is set, include inactive sites, otherwise only include active sites.
+        if kwargs['include_inactive'] and sites[site]['status'] == 'I' \
+        or sites[site]['status'] == 'A':
+            response['data'][site] = fast_json.site_fragment(sites, site, kwargs.get('columns'))
+
+    with metrics.phase('serialization'):
+        response['data'] = fast_json.join_object(sorted(response['data'].items()))
+        return fast_json.response(response)
+
+
+class site_nearest_schema(Schema):
+    include_inactive=fields.Boolean(
+        required=False,
+        default=True,
+        missing=True,
+        truthy = ['True'], # sets custom truthy values
+        falsy = ['False'], # sets custom falsy values
+        error_messages={
+            "null": get_error('01x005'),
+            "required": get_error('01x005'),
+            "invalid": get_error('01x005'),
+            "type": get_error('01x005'),
+            "validator_failed": get_error('01x005'),
+        }
+    )
+    location = fields.String(
+        required=True,
+        validate=lambda p: validate_location(p),
+        error_messages={
+            "null": get_error('01x006'),
+            "required": get_error('01x006'),
+            "invalid": get_error('01x006'),
+            "type": get_error('01x006'),
+            "validator_failed": get_error('01x006'),
+        }
+    )
+    k=fields.Integer(
+        required=False,
+        missing=10,
+        validate=lambda k: 1 <= k <= max_nearest,
+        error_messages={
+            "null": get_error('01x002', key='k', minimum=1, maximum=max_nearest),
+            "invalid": get_error('01x002', key='k', minimum=1, maximum=max_nearest),
+            "type": get_error('01x002', key='k', minimum=1, maximum=max_nearest),
+            "validator_failed": get_error('01x002', key='k', minimum=1, maximum=max_nearest),
+        }
+    )
+    columns=fields.DelimitedList(
+        fields.String(),
+        data_key='fields',
+        required=False,
+        validate=lambda columns: len(columns) > 0 and all(column in site_fields for column in columns),
+        error_messages={
+            "null": get_error('01x016', fields=', '.join(site_fields)),
+            "invalid": get_error('01x016', fields=', '.join(site_fields)),
+            "type": get_error('01x016', fields=', '.join(site_fields)),
+            "validator_failed": get_error('01x016', fields=', '.join(site_fields)),
+        }
+    )
+
+    class Meta:
+        unknown = EXCLUDE
+        strict = True
+
+    def __init__(self):
+        super().__init__()
+
+    @post_load
+    def massage_input(self, args, **kwargs):
+        if 'location' in args:
+            formatted_location = args['location'].strip('()').split(',')
+            args['location'] = (float(formatted_location[0]), float(formatted_location[1]))
+        if 'columns' in args:
+            args['columns'] = list(dict.fromkeys(args['columns']))
+
+        return args
+
+
+@app.route('/<version>/ntn/site/nearest', methods=['GET'], strict_slashes=False)
+@use_kwargs(site_nearest_schema, location='query')
+@metrics.validated
+@response_cache.cached(sites_version)
+def site_nearest(version, **kwargs):
+    '''
+        An endpoint that returns the k sites nearest to a given latitude and longitude, closest
+        first, with the distance to each in miles, filtering out inactive sites (status==I) if
+        requested.
+
+        Input variables:
+            'include_inactive':
+                Required: No,
+                Default: True,
+                Type: Boolean,
+                Validation: Must be True or False.
+            'location':
+                Required: Yes,
+                Type: String,
+                Validation: Must be in the format (latitude, longitude).
+            'k':
+                Required: No,
+                Default: 10,
+                Type: Integer,
+                Validation: Must be greater than or equal to 1 and less than or equal to max_nearest.
+            'fields':
+                Required: No,
+                Default: All columns,
+                Type: Comma separated list of strings,
+                Validation: Must be columns found in site_fields. Only these columns are returned
+                            for each site.
+        Output:
+            Type: application/json
+    '''
+
+    response = dict(data=dict(), errors=dict())
+
+    if not version == 'v1.0':
+        error = get_error('01x001')
+        response['errors'].update(error)
+        json_abort(400, response)
+
+    catalog = site_catalog.get_catalog(ntn_sites_url)
+    with metrics.phase('upstream'):
+        sites = catalog.get()
+
+    with metrics.phase('distance'):
+        grid = spatial.get_grid(sites, catalog.version)
+        statuses = ['A', 'I'] if kwargs['include_inactive'] else ['A']
+        nearest = grid.nearest(kwargs['location'], kwargs['k'], statuses)
+
+    with metrics.phase('serialization'):
+        response['data'] = b'[' + b','.join(fast_json.join_object([
+            ('distance', fast_json.dumps(round(miles, 4))),
+            ('site', fast_json.site_fragment(sites, site_id, kwargs.get('columns'))),
+            ('site_id', fast_json.dumps(site_id)),
+        ]) for site_id, miles in nearest) + b']'
+        return fast_json.response(response)
+
+
+class site_search_schema(Schema):
+    bbox=fields.String(
+        required=False,
+        validate=lambda bbox: validate_bbox(bbox),
+        error_messages={
+            "null": get_error('01x018'),
+            "invalid": get_error('01x018'),
+            "type": get_error('01x018'),
+            "validator_failed": get_error('01x018'),
+        }
+    )
+    state=fields.String(
+        required=False,
+        validate=lambda state: len(state) == 2 and state.isalpha(),
+        error_messages={
+            "null": get_error('01x010'),
+            "invalid": get_error('01x010'),
+            "type": get_error('01x010'),
+            "validator_failed": get_error('01x010'),
+        }
+    )
+    status=fields.String(
+        required=False,
+        validate=lambda status: status.upper() in ('A', 'I'),
+        error_messages={
+            "null": get_error('01x019'),
+            "invalid": get_error('01x019'),
+            "type": get_error('01x019'),
+            "validator_failed": get_error('01x019'),
+        }
+    )
+    network=fields.String(required=False)
+    county=fields.String(required=False)
+    columns=fields.DelimitedList(
+        fields.String(),
+        data_key='fields',
+        required=False,
+        validate=lambda columns: len(columns) > 0 and all(column in site_fields for column in columns),
+        error_messages={
+            "null": get_error('01x016', fields=', '.join(site_fields)),
+            "invalid": get_error('01x016', fields=', '.join(site_fields)),
+            "type": get_error('01x016', fields=', '.join(site_fields)),
+            "validator_failed": get_error('01x016', fields=', '.join(site_fields)),
+        }
+    )
+
+    class Meta:
+        unknown = EXCLUDE
+        strict = True
+
+    def __init__(self):
+        super().__init__()
+
+    @post_load
+    def massage_input(self, args, **kwargs):
+        if 'bbox' in args:
+            args['bbox'] = tuple(float(value) for value in args['bbox'].strip('()').split(','))
+        if 'columns' in args:
+            args['columns'] = list(dict.fromkeys(args['columns']))
+
+        return args
+
+
+@app.route('/<version>/ntn/site/search', methods=['GET'], strict_slashes=False)
+@use_kwargs(site_search_schema, location='query')
+@metrics.validated
+@response_cache.cached(sites_version)
+def site_info_search(version, **kwargs):
+    '''
+        An endpoint that returns site information for all sites inside a bounding box and matching
+        the given catalog attributes. Every filter is optional, and sites must match all of those
+        given.
+
+        Input variables:
+            'bbox':
+                Required: No,
+                Type: String,
+                Validation: Must be in the format (min_latitude, min_longitude, max_latitude,
+                            max_longitude). min_longitude may be greater than max_longitude for a
+                            box that crosses the antimeridian.
+            'state':
+                Required: No,
+                Type: String,
+                Validation: Must be a 2 character state or province code.
+            'status':
+                Required: No,
+                Type: String,
+                Validation: Must be A (active) or I (inactive).
+            'network':
+                Required: No,
+                Type: String,
+            'county':
+                Required: No,
+                Type: String,
+            'fields':
+                Required: No,
+                Default: All columns,
+                Type: Comma separated list of strings,
+                Validation: Must be columns found in site_fields. Only these columns are returned
+                            for each site.
+        Output:
+            Type: application/json
+    '''
+
+    response = dict(data=dict(), errors=dict())
+
+    if not version == 'v1.0':
+        error = get_error('01x001')
+        response['errors'].update(error)
+        json_abort(400, response)
+
+    catalog = site_catalog.get_catalog(ntn_sites_url)
+    with metrics.phase('upstream'):
+        sites = catalog.get()
+
+    with metrics.phase('lookup'):
+        index = site_search.get_search_index(sites, catalog.version)
+        site_ids = index.search(kwargs.get('bbox'), **{attribute: kwargs.get(attribute) for attribute in site_search.attributes})
+
+    with metrics.phase('serialization'):
+        response['data'] = fast_json.join_object(
+            (site_id, fast_json.site_fragment(sites, site_id, kwargs.get('columns'))) for site_id in site_ids)
+        return fast_json.response(response)
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    '''
+        An endpoint that returns this worker's request latency histograms (overall and per phase),
+        response cache hit/miss counts and dataset reload counts, in the Prometheus text format.
+
+        Output:
+            Type: text/plain
+    '''
 
-    for site in sites:
-        site_location = (float(sites[site]['latitude']), float(sites[site]['longitude']))
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
-        if point_within_radius(kwargs['location'], site_location, kwargs['radius']):
-            # if include_inactive flag is set, include inactive sites, otherwise only include active sites.
-            if kwargs['include_inactive'] and sites[site]['status'] == 'I' \
-            or sites[site]['status'] == 'A':
-                response['data'][site] = sites[site]
 
-    return response
+# -- Load the samples when the worker starts rather than on its first request.
+if os.path.exists(ntn_samples_file):
+    load_samples()
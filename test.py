@@ -1,22 +1,37 @@
 # ---- builtin modules ----
+import csv
+import gzip
+import io
 import json
+import logging
+import math
 import os
-from random import choice
+import queue
+from random import choice, Random
 import sys
+import time
 
 # ---- external modules ----
 import arrow
+from flask import Flask, jsonify, Response, stream_with_context
+from geopy import distance
 from marshmallow import ValidationError
+import numpy
 import pytest
 import requests
 
 # ---- user defined modules ----
+from benchmarks import synthetic
+from benchmarks.stub_server import StubServer
+from conftest import ntn_sample_row, ntn_samples_header, ntn_sites_csv
 import inspect
 currentdir = os.path.dirname(
     os.path.abspath(inspect.getfile(inspect.currentframe()))
 )
-from index import validate_location, ntn_site_runner, point_within_radius
+from index import app, csv_samples, decode_cursor, encode_cursor, load_samples, paged_samples, samples_version, selected_site_ids, validate_bbox, validate_location, ntn_site_runner, point_within_radius
+from common import columns, compression, dataset_refresh, fast_json, http_client, logger, metrics, rollups, sample_db, sample_index, sample_store, site_catalog, site_search, spatial, time_series
 from common.error_handling import get_error
+from common.response_cache import CachedResponse, ResponseCache
 
 # change working directory so relative file loads still work
 root_dir = sys.path[0]
@@ -82,8 +97,1407 @@ class TestIndexFunctions:
         '''
 
         assert ntn_site_runner(url) == {}
+
+    @pytest.mark.parametrize('include_inactive,expected', ((True, ['WY02', 'WY97', 'WY99']), (False, ['WY02', 'WY97'])))
+    def test_sites_selected_by_location(self, ntn_sites_server, tmp_path, monkeypatch, include_inactive, expected):
+        '''
+            test a location and radius select the sites within it, sorted, leaving out inactive sites if asked
+        '''
+
+        monkeypatch.setattr(site_catalog, 'cache_dir', str(tmp_path))
+        monkeypatch.setattr('index.ntn_sites_url', ntn_sites_server.url)
+
+        args = dict(location=(42.4944, -108.8320), radius=300, include_inactive=include_inactive)
+        assert selected_site_ids(args) == expected
         
         
+@pytest.mark.data
+class TestSampleStore:
+    '''
+        Unit tests pertaining to the in-memory sample store found in common/sample_store.py
+    '''
+
+    def test_samples_partitioned_and_sorted(self, ntn_samples_csv):
+        '''
+            test samples are grouped by site and sorted by yrmonth
+        '''
+
+        store = sample_store.SampleStore(ntn_samples_csv)
+        assert sorted(store.site_ids()) == ['AB32', 'WY02']
+        rows = store.get('WY02', '000000', '999999')
+        assert [row['labno'] for row in rows] == ['WY0001SW', 'WY0002SW', 'WY0003SW', 'WY0004SW']
+
+    @pytest.mark.parametrize('start_date,end_date,expected', (('201602', '201603', ['WY0002SW', 'WY0003SW']),
+                                                              ('201604', '201612', []),
+                                                              ('201701', '201701', ['WY0004SW'])))
+    def test_date_window(self, ntn_samples_csv, start_date, end_date, expected):
+        '''
+            test only samples within the start_date - end_date window are returned
+        '''
+
+        store = sample_store.SampleStore(ntn_samples_csv)
+        assert [row['labno'] for row in store.get('WY02', start_date, end_date)] == expected
+
+    @pytest.mark.parametrize('backend', ('store', 'index'))
+    def test_iter_samples(self, ntn_samples_csv, backend):
+        '''
+            test iter_samples yields the same samples as get
+        '''
+
+        store = sample_store.SampleStore(ntn_samples_csv) if backend == 'store' else sample_index.SampleIndex(ntn_samples_csv)
+        assert list(store.iter_samples('WY02', '201601', '201701')) == store.get('WY02', '201601', '201701')
+
+    def test_iter_samples_lazy(self, ntn_samples_csv, monkeypatch):
+        '''
+            test iter_samples only builds the chunks of rows that are asked for
+        '''
+
+        monkeypatch.setattr(sample_store, 'chunk_rows', 1)
+        store = sample_store.SampleStore(ntn_samples_csv)
+        built = []
+        rows = store.rows
+        monkeypatch.setattr(store, 'rows', lambda *args: built.append(args[1:3]) or rows(*args))
+
+        samples = store.iter_samples('WY02', '000000', '999999')
+        assert next(samples)['labno'] == 'WY0001SW'
+        assert len(built) == 1
+
+    @pytest.mark.parametrize('backend', ('memory', 'mmap', 'sqlite'))
+    @pytest.mark.parametrize('after,limit,expected', ((None, 2, ['WY0001SW', 'WY0002SW']),
+                                                      (('201601', 'WY0001SW'), 2, ['WY0002SW', 'WY0003SW']),
+                                                      (None, 0, []),
+                                                      (None, 100, ['WY0001SW', 'WY0002SW', 'WY0003SW', 'WY0004SW'])))
+    def test_iter_samples_limit(self, ntn_samples_csv, tmp_path, backend, after, limit, expected):
+        '''
+            test iter_samples yields at most limit samples, after the given (yrmonth, labno)
+        '''
+
+        if backend == 'sqlite':
+            db_path = str(tmp_path / 'ntn_samples.db')
+            sample_db.ingest(ntn_samples_csv, db_path)
+            samples = sample_db.SampleDatabase(db_path)
+        elif backend == 'mmap':
+            samples = sample_index.SampleIndex(ntn_samples_csv)
+        else:
+            samples = sample_store.SampleStore(ntn_samples_csv)
+
+        rows = samples.iter_samples('WY02', '000000', '999999', after, limit=limit)
+        assert [row['labno'] for row in rows] == expected
+
+    def test_unknown_site(self, ntn_samples_csv):
+        '''
+            test a site_id that is not in the file
+        '''
+
+        store = sample_store.SampleStore(ntn_samples_csv)
+        assert store.get('9999', '000000', '999999') == []
+
+    @pytest.mark.parametrize('strings,encoding', ((['201601', '199912'], columns.IntColumn),
+                                                  (['-9', '-9.000', '0.250', '', '1234567.891', '-0.000'], columns.NumericColumn),
+                                                  (['1e5', '0.1', '.5'], columns.CodedColumn),
+                                                  (['WY{:04d}SW'.format(i) for i in range(300)], columns.TextColumn)))
+    def test_column_encodings(self, strings, encoding):
+        '''
+            test every column encoding gives back the csv values exactly
+        '''
+
+        column = columns.encode(strings)
+        assert isinstance(column, encoding)
+        assert column.render(0, len(strings)) == strings
+
+    def test_numeric_floats(self):
+        '''
+            test float32 values are given back as the float64 value of their csv text
+        '''
+
+        strings = ['0.1', '2.347', '-9', '', '1234.5', '-0.000']
+        column = columns.encode(strings)
+        assert column.values.dtype == numpy.float32
+
+        values = column.floats(0, len(strings))
+        assert values[[0, 1, 4, 5]].tolist() == [0.1, 2.347, 1234.5, 0.0]
+        assert numpy.isnan(values[[2, 3]]).all()
+
+    def test_fragment_cache_bounded(self, ntn_samples_csv):
+        '''
+            test a store caches no more encoded rows than its columns take
+        '''
+
+        store = sample_store.SampleStore(ntn_samples_csv)
+        assert store.max_fragment_bytes == min(sample_store.max_fragment_bytes, store.nbytes)
+
+        fragments = [store.fragment(row) for row in store.iter_sites(store.site_ids(), '000000', '999999')]
+        assert 0 < len(store._fragments) < len(fragments)
+        assert store._fragment_bytes - max(len(fragment) for fragment in fragments) < store.max_fragment_bytes
+
+    def test_typed_columns(self, ntn_samples_csv):
+        '''
+            test the store holds typed columns, with blanks and sentinels reported as missing
+        '''
+
+        store = sample_store.SampleStore(ntn_samples_csv)
+        assert store.columns['yrmonth'].values.dtype == numpy.int32
+        assert store.columns['Ca'].values.dtype == numpy.float32
+        assert isinstance(store.columns['valcode'], columns.CodedColumn)
+
+        start, end = store.window('WY02', '000000', '999999')
+        assert store.columns['Br'].missing(start, end).all()
+        assert not store.columns['Ca'].missing(start, end).any()
+
+    def test_ragged_rows(self, ntn_samples_csv):
+        '''
+            test a row missing trailing fields is loaded with them blank, and extra fields are dropped
+        '''
+
+        with open(ntn_samples_csv, 'a', encoding='utf8') as csvfile:
+            row = ntn_sample_row('WY02', 'WY0005SW', '201702')
+            csvfile.write(','.join(row[field] for field in ntn_samples_header[:-2]) + '\n')
+            row = ntn_sample_row('WY02', 'WY0006SW', '201703')
+            csvfile.write(','.join(row[field] for field in ntn_samples_header) + ',extra\n')
+
+        store = sample_store.SampleStore(ntn_samples_csv)
+        rows = store.get('WY02', '201702', '201703')
+        assert [(row['labno'], row['Br'], row['modifiedOn']) for row in rows] == [('WY0005SW', '', ''), ('WY0006SW', '-9', '')]
+        assert sorted(rows[0]) == sorted(ntn_samples_header)
+
+    def test_store_reloaded_on_change(self, ntn_samples_csv):
+        '''
+            test the cached store is reused until the file changes
+        '''
+
+        store = sample_store.get_store(ntn_samples_csv)
+        assert sample_store.get_store(ntn_samples_csv) is store
+
+        with open(ntn_samples_csv, 'a', encoding='utf8') as csvfile:
+            csvfile.write('AB32,TQ9999SW' + ',' * 29 + '\n')
+        assert sample_store.get_store(ntn_samples_csv) is not store
+
+
+@pytest.mark.data
+class TestSampleDatabase:
+    '''
+        Unit tests pertaining to the SQLite sample database found in common/sample_db.py
+    '''
+
+    def test_ingest(self, ntn_samples_csv, tmp_path):
+        '''
+            test the csv is loaded with an index and in WAL mode
+        '''
+
+        db_path = str(tmp_path / 'ntn_samples.db')
+        assert sample_db.ingest(ntn_samples_csv, db_path) == 7
+
+        database = sample_db.SampleDatabase(db_path)
+        assert database.connection.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        plan = database.connection.execute('EXPLAIN QUERY PLAN SELECT * FROM samples WHERE siteID = ? AND yrmonth BETWEEN ? AND ?',
+                                           ('AB32', 201601, 201612)).fetchall()
+        assert 'samples_site_yrmonth' in str(plan)
+
+    def test_ingest_skips_invalid_yrmonth(self, ntn_samples_csv, tmp_path, caplog):
+        '''
+            test rows without a valid yrmonth are skipped and reported rather than failing the ingest
+        '''
+
+        with open(ntn_samples_csv, 'a', encoding='utf8') as csvfile:
+            for yrmonth in ('', '2017-3'):
+                row = ntn_sample_row('WY02', 'WY0009SW', '201703')
+                row['yrmonth'] = yrmonth
+                csvfile.write(','.join(row[field] for field in ntn_samples_header) + '\n')
+            row = ntn_sample_row('WY02', 'WY0005SW', '201702')
+            csvfile.write(','.join(row[field] for field in ntn_samples_header[:-2]) + '\n')
+
+        db_path = str(tmp_path / 'ntn_samples.db')
+        with caplog.at_level(logging.WARNING, logger='logger'):
+            assert sample_db.ingest(ntn_samples_csv, db_path) == 8
+        assert [record.getMessage().split(',')[0] for record in caplog.records] == ['Skipped line 9 of {}'.format(ntn_samples_csv),
+                                                                                  'Skipped line 10 of {}'.format(ntn_samples_csv)]
+
+        database = sample_db.SampleDatabase(db_path)
+        assert database.get('WY02', '201702', '201712') == sample_store.SampleStore(ntn_samples_csv).get('WY02', '201702', '201712')
+
+    @pytest.mark.parametrize('site_id,start_date,end_date', (('WY02', '201602', '201603'),
+                                                             ('WY02', '000000', '999999'),
+                                                             ('AB32', '201609', '201609'),
+                                                             ('9999', '000000', '999999')))
+    def test_matches_sample_store(self, ntn_samples_csv, tmp_path, site_id, start_date, end_date):
+        '''
+            test the database returns the same samples as the in-memory store
+        '''
+
+        db_path = str(tmp_path / 'ntn_samples.db')
+        sample_db.ingest(ntn_samples_csv, db_path)
+
+        database = sample_db.get_database(db_path)
+        store = sample_store.SampleStore(ntn_samples_csv)
+        assert database.get(site_id, start_date, end_date) == store.get(site_id, start_date, end_date)
+
+    def test_iter_sites(self, ntn_samples_csv, tmp_path):
+        '''
+            test several sites are returned by one query, grouped by site in the order given
+        '''
+
+        db_path = str(tmp_path / 'ntn_samples.db')
+        sample_db.ingest(ntn_samples_csv, db_path)
+
+        database = sample_db.SampleDatabase(db_path)
+        store = sample_store.SampleStore(ntn_samples_csv)
+        index = sample_index.SampleIndex(ntn_samples_csv)
+        expected = store.get('AB32', '201601', '201612') + store.get('WY02', '201601', '201612')
+        assert list(store.iter_sites(['AB32', 'WY02', '9999'], '201601', '201612')) == expected
+        assert list(index.iter_sites(['AB32', 'WY02', '9999'], '201601', '201612')) == expected
+        assert list(database.iter_sites(['AB32', 'WY02', '9999'], '201601', '201612')) == expected
+
+        # sites come back in the order they were asked for, whatever the backend.
+        expected = store.get('WY02', '201601', '201612') + store.get('AB32', '201601', '201612')
+        assert list(store.iter_sites(['WY02', '9999', 'AB32'], '201601', '201612')) == expected
+        assert list(index.iter_sites(['WY02', '9999', 'AB32'], '201601', '201612')) == expected
+        assert list(database.iter_sites(['WY02', '9999', 'AB32'], '201601', '201612')) == expected
+
+    def test_fields(self, ntn_samples_csv, tmp_path):
+        '''
+            test only the key columns and requested fields are read
+        '''
+
+        db_path = str(tmp_path / 'ntn_samples.db')
+        sample_db.ingest(ntn_samples_csv, db_path)
+
+        database = sample_db.SampleDatabase(db_path)
+        index = sample_index.SampleIndex(ntn_samples_csv)
+        expected = [{key: row[key] for key in ('siteID', 'labno', 'yrmonth', 'Ca')}
+                    for row in sample_store.SampleStore(ntn_samples_csv).get('AB32', '201601', '201612')]
+        assert list(index.iter_sites(['AB32'], '201601', '201612', ['Ca'])) == expected
+        assert list(database.iter_sites(['AB32'], '201601', '201612', ['Ca'])) == expected
+        assert database.get('AB32', '201601', '201612', ('201609', 'TQ0742SW'), ['Ca']) == expected[1:]
+
+    def test_missing_database(self, tmp_path):
+        '''
+            test opening a database that has not been ingested
+        '''
+
+        assert pytest.raises(FileNotFoundError, sample_db.SampleDatabase, str(tmp_path / 'missing.db'))
+
+
+@pytest.mark.data
+class TestSampleIndex:
+    '''
+        Unit tests pertaining to the byte-offset sample index found in common/sample_index.py
+    '''
+
+    def test_ingest_skips_invalid_yrmonth(self, ntn_samples_csv, tmp_path, caplog):
+        '''
+            test rows without a valid yrmonth are skipped and reported rather than failing the ingest
+        '''
+
+        with open(ntn_samples_csv, 'a', encoding='utf8') as csvfile:
+            for yrmonth in ('', '2017-3'):
+                row = ntn_sample_row('WY02', 'WY0009SW', '201703')
+                row['yrmonth'] = yrmonth
+                csvfile.write(','.join(row[field] for field in ntn_samples_header) + '\n')
+            row = ntn_sample_row('WY02', 'WY0005SW', '201702')
+            csvfile.write(','.join(row[field] for field in ntn_samples_header[:-2]) + '\n')
+
+        db_path = str(tmp_path / 'ntn_samples.db')
+        with caplog.at_level(logging.WARNING, logger='logger'):
+            assert sample_db.ingest(ntn_samples_csv, db_path) == 8
+        assert [record.getMessage().split(',')[0] for record in caplog.records] == ['Skipped line 9 of {}'.format(ntn_samples_csv),
+                                                                                  'Skipped line 10 of {}'.format(ntn_samples_csv)]
+
+        database = sample_db.SampleDatabase(db_path)
+        assert database.get('WY02', '201702', '201712') == sample_store.SampleStore(ntn_samples_csv).get('WY02', '201702', '201712')
+
+    @pytest.mark.parametrize('site_id,start_date,end_date', (('WY02', '201602', '201603'),
+                                                             ('WY02', '000000', '999999'),
+                                                             ('AB32', '201609', '201609'),
+                                                             ('9999', '000000', '999999')))
+    def test_matches_sample_store(self, ntn_samples_csv, site_id, start_date, end_date):
+        '''
+            test the index returns the same samples as the in-memory store
+        '''
+
+        index = sample_index.SampleIndex(ntn_samples_csv)
+        store = sample_store.SampleStore(ntn_samples_csv)
+        assert index.get(site_id, start_date, end_date) == store.get(site_id, start_date, end_date)
+
+    def test_ranges_hold_rows(self, ntn_samples_csv):
+        '''
+            test each byte range holds only rows for the requested site
+        '''
+
+        index = sample_index.SampleIndex(ntn_samples_csv)
+        for start, end in index.ranges('AB32', '000000', '999999'):
+            for line in index.read(start, end).splitlines():
+                assert line.startswith(b'AB32,')
+
+    def test_compact_arrays(self, ntn_samples_csv):
+        '''
+            test the index is held as numpy arrays, sorted by yrmonth within each site
+        '''
+
+        index = sample_index.SampleIndex(ntn_samples_csv)
+        assert index.yrmonths.dtype == numpy.int32 and len(index.yrmonths) == 7
+        start, end = index.window('WY02', '000000', '999999')
+        assert index.yrmonths[start:end].tolist() == [201601, 201602, 201603, 201701]
+
+        with numpy.load(ntn_samples_csv + sample_index.index_suffix, allow_pickle=False) as sidecar:
+            assert sidecar['starts'].dtype == numpy.uint32
+            assert sidecar['site_ids'].tolist() == ['AB32', 'WY02']
+
+    def test_csv_passthrough(self, ntn_samples_csv, monkeypatch):
+        '''
+            test csv output is the header plus the original bytes of the matching rows
+        '''
+
+        monkeypatch.setattr('index.ntn_samples_file', ntn_samples_csv)
+        with open(ntn_samples_csv, 'rb') as csvfile:
+            lines = csvfile.read().splitlines(keepends=True)
+
+        output = b''.join(csv_samples(['WY02'], '201602', '201701'))
+        expected = [lines[0]] + [line for line in lines if line.startswith(b'WY02,') and b',201601,' not in line]
+        assert sorted(output.splitlines(keepends=True)) == sorted(expected)
+        assert output.startswith(lines[0])
+
+    def test_sidecar_rebuilt_on_change(self, ntn_samples_csv):
+        '''
+            test the sidecar index is reused until the csv changes
+        '''
+
+        index = sample_index.get_index(ntn_samples_csv)
+        assert os.path.exists(ntn_samples_csv + sample_index.index_suffix)
+        assert sample_index.get_index(ntn_samples_csv) is index
+
+        with open(ntn_samples_csv, 'a', encoding='utf8') as csvfile:
+            csvfile.write('ZZ99,ZZ0001SW,,,201801' + ',' * 26 + '\n')
+        index = sample_index.get_index(ntn_samples_csv)
+        assert [row['labno'] for row in index.get('ZZ99', '201801', '201801')] == ['ZZ0001SW']
+
+
+@pytest.mark.data
+class TestSiteCatalog:
+    '''
+        Unit tests pertaining to the site catalog cache found in common/site_catalog.py
+    '''
+
+    def test_cached_within_ttl(self, ntn_sites_server, tmp_path):
+        '''
+            test the upstream is only called once while the catalog is fresh
+        '''
+
+        catalog = site_catalog.SiteCatalog(ntn_sites_server.url, cache_path=str(tmp_path / 'sites.json'))
+        assert catalog.get()['AB32']['siteName'] == 'Fort Mackay'
+        assert 'siteid' not in catalog.get()['AB32']
+        catalog.get()
+        assert len(ntn_sites_server.requests) == 1
+
+    def test_conditional_refresh(self, ntn_sites_server, tmp_path):
+        '''
+            test an expired catalog is revalidated with its ETag
+        '''
+
+        catalog = site_catalog.SiteCatalog(ntn_sites_server.url, cache_path=str(tmp_path / 'sites.json'), ttl=0)
+        sites = catalog.get()
+        assert catalog.refresh()
+        assert ntn_sites_server.requests[-1]['If-None-Match'] == catalog.etag
+        assert catalog.sites is sites
+
+    def test_stale_served_during_outage(self, ntn_sites_server, tmp_path):
+        '''
+            test the last good catalog is served when the upstream fails
+        '''
+
+        catalog = site_catalog.SiteCatalog(ntn_sites_server.url, cache_path=str(tmp_path / 'sites.json'), ttl=0, max_stale=0)
+        catalog.get()
+        ntn_sites_server.fail = True
+        assert 'WY02' in catalog.get()
+
+    def test_cold_start_from_disk(self, ntn_sites_server, tmp_path):
+        '''
+            test a new catalog is loaded from the persisted copy without calling the upstream
+        '''
+
+        cache_path = str(tmp_path / 'sites.json')
+        site_catalog.SiteCatalog(ntn_sites_server.url, cache_path=cache_path).get()
+        ntn_sites_server.fail = True
+
+        catalog = site_catalog.SiteCatalog(ntn_sites_server.url, cache_path=cache_path)
+        assert sorted(catalog.get()) == ['AB32', 'WY02', 'WY97', 'WY99']
+        assert len(ntn_sites_server.requests) == 1
+
+
+@pytest.mark.data
+class TestHTTPClient:
+    '''
+        Unit tests pertaining to the upstream HTTP client found in common/http_client.py
+    '''
+
+    def test_circuit_breaker(self):
+        '''
+            test the circuit opens after failure_threshold failures and lets one trial call through
+            after reset_timeout
+        '''
+
+        breaker = http_client.CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        breaker.record_failure()
+        assert breaker.allow()
+        breaker.record_failure()
+        assert breaker.state == 'open' and not breaker.allow()
+
+        breaker.opened_at -= 60
+        assert breaker.allow() and not breaker.allow()
+        breaker.record_failure()
+        assert breaker.state == 'open'
+
+        breaker.opened_at -= 60
+        assert breaker.allow()
+        breaker.record_success()
+        assert breaker.state == 'closed' and breaker.allow()
+
+    def test_retries_then_fails_fast(self, ntn_sites_server):
+        '''
+            test a failing upstream is retried, then refused without a call once the circuit opens
+        '''
+
+        http_client.get_breaker(ntn_sites_server.url).failure_threshold = 1
+        ntn_sites_server.fail = True
+
+        assert http_client.get(ntn_sites_server.url).status_code == 503
+        assert len(ntn_sites_server.requests) == 1 + http_client.retries.total
+
+        with pytest.raises(http_client.CircuitOpenError):
+            http_client.get(ntn_sites_server.url)
+        assert len(ntn_sites_server.requests) == 1 + http_client.retries.total
+
+    def test_last_good_catalog_while_open(self, ntn_sites_server, tmp_path):
+        '''
+            test the site catalog is served from its last good copy while the circuit is open
+        '''
+
+        catalog = site_catalog.SiteCatalog(ntn_sites_server.url, cache_path=str(tmp_path / 'sites.json'), ttl=0, max_stale=0)
+        catalog.get()
+
+        breaker = http_client.get_breaker(ntn_sites_server.url)
+        breaker.opened_at = float('inf')
+        try:
+            assert 'WY02' in catalog.get()
+            assert len(ntn_sites_server.requests) == 1
+        finally:
+            breaker.record_success()
+
+
+@pytest.mark.data
+class TestDatasetRefresh:
+    '''
+        Unit tests pertaining to the background dataset refresh found in common/dataset_refresh.py
+    '''
+
+    @pytest.fixture
+    def samples_server(self, ntn_samples_csv):
+        with open(ntn_samples_csv, 'rb') as csvfile:
+            body = csvfile.read()
+        # the new dataset adds one sample to the file in the fixture.
+        row = ntn_sample_row('WY02', 'WY0005SW', '201702')
+        body += ','.join(row[field] for field in ntn_samples_header).encode('utf8') + b'\r\n'
+
+        server = StubServer(body).start()
+        yield server
+        server.stop()
+
+    @pytest.mark.parametrize('backend', ['memory', 'mmap', 'sqlite'])
+    def test_hot_swap(self, backend, samples_server, ntn_samples_csv, tmp_path, monkeypatch):
+        '''
+            test a new dataset is installed as the current backend while the old one keeps answering
+        '''
+
+        def in_worker(*args):
+            raise AssertionError('datasets are built in a separate process')
+
+        db_path = str(tmp_path / 'ntn_samples.db')
+        get = dict(memory=lambda: sample_store.get_store(ntn_samples_csv),
+                   mmap=lambda: sample_index.get_index(ntn_samples_csv),
+                   sqlite=lambda: sample_db.get_database(db_path))[backend]
+        if backend == 'sqlite':
+            sample_db.ingest(ntn_samples_csv, db_path)
+
+        old = get()
+        for target in ('common.sample_index.build_index', 'common.sample_store.SampleStore.load',
+                       'common.sample_db.ingest', 'common.dataset_refresh.validate_samples'):
+            monkeypatch.setattr(target, in_worker)
+        refresher = dataset_refresh.DatasetRefresher(samples_server.url, ntn_samples_csv, backend, db_path)
+        assert refresher.refresh_samples() == 'updated'
+
+        new = get()
+        assert new is not old
+        assert [row['labno'] for row in new.get('WY02', '201701', '201702')] == ['WY0004SW', 'WY0005SW']
+        assert [row['labno'] for row in old.get('WY02', '201701', '201702')] == ['WY0004SW']
+        # the sample index csv responses are read from is built along with every backend.
+        index = sample_index._indexes[ntn_samples_csv]
+        assert sample_index.get_index(ntn_samples_csv) is index and index.path == ntn_samples_csv
+        assert [row['labno'] for row in index.get('WY02', '201701', '201702')] == ['WY0004SW', 'WY0005SW']
+        assert not [name for name in os.listdir(str(tmp_path))
+                    if dataset_refresh.download_suffix in name or name.endswith('.tmp')]
+
+        # the installed download is revalidated with its ETag on the next check.
+        assert refresher.refresh_samples() == 'not_modified'
+        assert 'If-None-Match' in samples_server.requests[-1]
+        assert get() is new
+
+    def test_invalid_download(self, samples_server, ntn_samples_csv):
+        '''
+            test a download that is not a samples csv is discarded and the current dataset kept
+        '''
+
+        store = sample_store.get_store(ntn_samples_csv)
+        samples_server.set_body('siteid,network\nAB32,NTN\n')
+        refresher = dataset_refresh.DatasetRefresher(samples_server.url, ntn_samples_csv)
+
+        assert refresher.refresh_samples() == 'invalid'
+        assert sample_store.get_store(ntn_samples_csv) is store
+        assert not [name for name in os.listdir(os.path.dirname(ntn_samples_csv))
+                    if dataset_refresh.download_suffix in name]
+
+    def test_upstream_failure(self, samples_server, ntn_samples_csv):
+        '''
+            test a failed check is recorded so it is retried on the next interval, not immediately
+        '''
+
+        samples_server.fail = True
+        refresher = dataset_refresh.DatasetRefresher(samples_server.url, ntn_samples_csv)
+
+        assert refresher.refresh_samples() == 'failed'
+        assert refresher.source()['checked_at'] > 0
+
+
+@pytest.mark.data
+class TestPagination:
+    '''
+        Unit tests pertaining to keyset pagination of samples found in index.py
+    '''
+
+    @pytest.mark.parametrize('backend', ('memory', 'mmap', 'sqlite'))
+    @pytest.mark.parametrize('limit', (1, 2, 3, 100))
+    def test_pages_cover_window(self, ntn_samples_csv, tmp_path, monkeypatch, backend, limit):
+        '''
+            test following next_cursor returns every sample exactly once, in order
+        '''
+
+        db_path = str(tmp_path / 'ntn_samples.db')
+        sample_db.ingest(ntn_samples_csv, db_path)
+        monkeypatch.setattr('index.ntn_samples_file', ntn_samples_csv)
+        monkeypatch.setattr('index.ntn_samples_db', db_path)
+        monkeypatch.setitem(app.config, 'SAMPLE_BACKEND', backend)
+
+        store = sample_store.SampleStore(ntn_samples_csv)
+        expected = [row['labno'] for row in store.iter_sites(['AB32', 'WY02'], '201601', '201712')]
+
+        labnos = []
+        cursor = None
+        while True:
+            rows, next_cursor = paged_samples(['WY02', 'AB32'], '201601', '201712', limit, cursor)
+            assert len(rows) <= limit
+            labnos += [row['labno'] for row in rows]
+            if next_cursor is None:
+                break
+            cursor = decode_cursor(next_cursor)
+
+        assert labnos == expected
+
+    @pytest.mark.parametrize('cursor', ('abc', '', 'WyJBQjMyIl0=',
+                                        encode_cursor(dict(siteID='AB', yrmonth='201609', labno='TQ1132SW')),
+                                        encode_cursor(dict(siteID='AB32', yrmonth='2016-09', labno='TQ1132SW')),
+                                        encode_cursor(dict(siteID='AB32', yrmonth='201609\n', labno='TQ1132SW'))))
+    def test_invalid_cursor(self, cursor):
+        '''
+            test cursors that were not made by encode_cursor
+        '''
+
+        assert pytest.raises(ValidationError, decode_cursor, cursor)
+
+
+@pytest.mark.data
+class TestRollups:
+    '''
+        Unit tests pertaining to the monthly and annual rollups found in common/rollups.py
+    '''
+
+    def test_annual_means(self, ntn_samples_csv):
+        '''
+            test annual mean and precipitation-weighted mean
+        '''
+
+        store = sample_store.SampleStore(ntn_samples_csv)
+        annual = rollups.lookup(rollups.get_rollups(store), 'annual', 'WY02', '201601', '201712', ['Ca'])
+        assert annual['2016'] == {'ppt': 4.0, 'Ca': {'count': 3, 'mean': 0.1667, 'weighted_mean': 0.2}}
+        # no precipitation, so there is nothing to weight by.
+        assert annual['2017']['Ca'] == {'count': 1, 'mean': 0.2, 'weighted_mean': None}
+
+    def test_sentinel_values_excluded(self, ntn_samples_csv):
+        '''
+            test -9 values are left out of the means
+        '''
+
+        store = sample_store.SampleStore(ntn_samples_csv)
+        monthly = rollups.lookup(store.rollups, 'monthly', 'AB32', '201609', '201609')
+        assert monthly['201609']['Ca'] == {'count': 1, 'mean': 0.25, 'weighted_mean': 0.25}
+        assert monthly['201609']['ppt'] == 1.27
+        assert 'Br' not in monthly['201609']
+
+    def test_invalid_samples_excluded(self):
+        '''
+            test samples with an invalcode are left out entirely
+        '''
+
+        rows = [{'siteID': 'AB32', 'yrmonth': '201609', 'invalcode': 'c ', 'ppt': '1.0', 'Ca': '5.0'},
+                {'siteID': 'AB32', 'yrmonth': '201609', 'invalcode': '  ', 'ppt': '1.0', 'Ca': '1.0'}]
+        monthly = rollups.lookup(rollups.from_rows(rows), 'monthly', 'AB32', '201609', '201609')
+        assert monthly['201609']['Ca']['mean'] == 1.0
+
+    @pytest.mark.parametrize('backend', ('mmap', 'sqlite'))
+    def test_matches_backends(self, ntn_samples_csv, tmp_path, backend):
+        '''
+            test rollups built with the mmap index and sqlite database match the in-memory store's
+        '''
+
+        store = sample_store.SampleStore(ntn_samples_csv)
+        if backend == 'sqlite':
+            db_path = str(tmp_path / 'ntn_samples.db')
+            sample_db.ingest(ntn_samples_csv, db_path)
+            other = sample_db.SampleDatabase(db_path)
+        else:
+            other = sample_index.SampleIndex(ntn_samples_csv)
+
+        for period in rollups.periods:
+            for site_id in ('AB32', 'WY02', '9999'):
+                expected = rollups.lookup(store.rollups, period, site_id, '000000', '999999')
+                assert rollups.lookup(rollups.get_rollups(other), period, site_id, '000000', '999999') == expected
+
+    def test_kept_with_backends(self, ntn_samples_csv, tmp_path):
+        '''
+            test rollups are read back from the mmap sidecar and sqlite database rather than rebuilt
+        '''
+
+        sample_index.SampleIndex(ntn_samples_csv)
+        with numpy.load(ntn_samples_csv + sample_index.index_suffix, allow_pickle=False) as sidecar:
+            assert sidecar['rollups_annual_keys'].tolist() == [2016, 2016, 2017]
+
+        db_path = str(tmp_path / 'ntn_samples.db')
+        sample_db.ingest(ntn_samples_csv, db_path)
+        database = sample_db.SampleDatabase(db_path)
+        assert database.rollups['monthly'].site_ids.tolist() == ['AB32', 'WY02']
+
+        # a database ingested before rollups were kept has them built from its samples.
+        database.connection.execute('DROP TABLE rollups')
+        database.connection.commit()
+        legacy = sample_db.SampleDatabase(db_path)
+        assert legacy.rollups is None
+        assert rollups.lookup(rollups.get_rollups(legacy), 'monthly', 'WY02', '201601', '201601') == \
+            rollups.lookup(database.rollups, 'monthly', 'WY02', '201601', '201601')
+
+
+@pytest.mark.data
+class TestTimeSeries:
+    '''
+        Unit tests pertaining to the time series statistics found in common/time_series.py
+    '''
+
+    @pytest.mark.parametrize('backend', ('mmap', 'sqlite'))
+    @pytest.mark.parametrize('name', ('Ca', 'Br', 'ppt'))
+    def test_series_matches_backends(self, ntn_samples_csv, tmp_path, backend, name):
+        '''
+            test a series read from the store's columns matches one parsed from another backend's rows
+        '''
+
+        store = sample_store.SampleStore(ntn_samples_csv)
+        if backend == 'sqlite':
+            db_path = str(tmp_path / 'ntn_samples.db')
+            sample_db.ingest(ntn_samples_csv, db_path)
+            other = sample_db.SampleDatabase(db_path)
+        else:
+            other = sample_index.SampleIndex(ntn_samples_csv)
+
+        for site_id in ('AB32', 'WY02', '9999'):
+            yrmonths, values = time_series.load_series(store, site_id, name, '000000', '999999')
+            expected_yrmonths, expected_values = time_series.load_series(other, site_id, name, '000000', '999999')
+            assert list(yrmonths) == list(expected_yrmonths)
+            assert numpy.allclose(values, expected_values, equal_nan=True)
+
+    def test_sentinel_values_missing(self, ntn_samples_csv):
+        '''
+            test -9 values are NaN in a series
+        '''
+
+        store = sample_store.SampleStore(ntn_samples_csv)
+        yrmonths, values = store.series('WY02', 'Br', '000000', '999999')
+        assert len(yrmonths) == 4 and numpy.isnan(values).all()
+
+    def test_statistics(self):
+        '''
+            test the summary, percentiles, seasonal means, trend and rolling means
+        '''
+
+        yrmonths = numpy.array([201601, 201601, 201602, 201603, 201701, 201702, 201703, 201704])
+        values = numpy.array([1.0, 3.0, 2.0, numpy.nan, 3.0, 4.0, 5.0, 6.0])
+        result = time_series.statistics(yrmonths, values, percentiles=[0, 50, 100], window=2)
+
+        assert result['summary'] == {'count': 7, 'missing': 1, 'mean': 3.4286, 'std': 1.5908, 'min': 1.0, 'max': 6.0}
+        assert result['percentiles'] == {'0': 1.0, '50': 3.0, '100': 6.0}
+        assert result['seasonal'] == {'01': 2.5, '02': 3.0, '03': 5.0, '04': 6.0}
+        # the trend is fitted to each monthly mean less its calendar month's mean.
+        years = numpy.array([2016, 2016 + 1 / 12, 2017, 2017 + 1 / 12, 2017 + 2 / 12, 2017 + 3 / 12])
+        slope = numpy.polyfit(years, [-0.5, -1.0, 0.5, 1.0, 0.0, 0.0], 1)[0]
+        assert result['trend'] == {'slope_per_year': round(slope, 4), 'months': 6}
+        assert result['monthly'] == [
+            {'yrmonth': '201601', 'mean': 2.0, 'rolling_mean': 2.0},
+            {'yrmonth': '201602', 'mean': 2.0, 'rolling_mean': 2.0},
+            {'yrmonth': '201701', 'mean': 3.0, 'rolling_mean': 3.0},
+            {'yrmonth': '201702', 'mean': 4.0, 'rolling_mean': 3.5},
+            {'yrmonth': '201703', 'mean': 5.0, 'rolling_mean': 4.5},
+            {'yrmonth': '201704', 'mean': 6.0, 'rolling_mean': 5.5},
+        ]
+
+    def test_ph_averaged_as_rollups(self):
+        '''
+            test pH means are taken through the hydrogen ion concentration, as they are by the rollups
+        '''
+
+        yrmonths = numpy.array([201601, 201601, 201602])
+        values = numpy.array([4.0, 6.0, 5.0])
+        result = time_series.statistics(yrmonths, values, window=1, analyte='ph')
+        expected = rollups.summarize('ph', 3, 100.0 + 1.0 + 10.0, 0.0, 0.0)['mean']
+
+        assert result['summary']['mean'] == expected == round(6 - math.log10(111.0 / 3), 4)
+        assert result['monthly'][0]['mean'] == round(6 - math.log10(50.5), 4)
+        assert result['summary']['min'] == 4.0 and result['percentiles']['50'] == 5.0
+
+    def test_series_ph_matches_rollups(self, ntn_samples_csv):
+        '''
+            test the monthly pH means of a series match the monthly rollups
+        '''
+
+        store = sample_store.SampleStore(ntn_samples_csv)
+        yrmonths, values = time_series.load_series(store, 'AB32', 'ph', '000000', '999999')
+        result = time_series.statistics(yrmonths, values, analyte='ph')
+        monthly = rollups.lookup(store.rollups, 'monthly', 'AB32', '000000', '999999', ['ph'])
+
+        assert {month['yrmonth']: month['mean'] for month in result['monthly']} == \
+            {key: results['ph']['mean'] for key, results in monthly.items() if 'ph' in results}
+
+    def test_statistics_empty(self):
+        '''
+            test a series without any valid values
+        '''
+
+        result = time_series.statistics(numpy.array([201601]), numpy.array([numpy.nan]))
+        assert result['summary']['count'] == 0
+        assert result['percentiles']['50'] is None
+        assert result['monthly'] == [] and result['trend']['slope_per_year'] is None
+
+
+@pytest.mark.data
+class TestResponseCache:
+    '''
+        Unit tests pertaining to the response cache found in common/response_cache.py
+    '''
+
+    def test_lru_eviction(self):
+        '''
+            test the least recently used entry is evicted once max_entries is reached
+        '''
+
+        cache = ResponseCache(max_entries=2)
+        for key in ('a', 'b'):
+            cache.put(key, CachedResponse(key.encode('utf8'), 'application/json'))
+        cache.get('a')
+        cache.put('c', CachedResponse(b'c', 'application/json'))
+        assert cache.get('b') is None
+        assert cache.get('a') is not None and cache.get('c') is not None
+
+    def test_size_bound(self):
+        '''
+            test entries are evicted to stay under max_bytes
+        '''
+
+        cache = ResponseCache(max_bytes=400)
+        for key in range(10):
+            cache.put(key, CachedResponse(b'x' * 100, 'application/json'))
+        assert cache.size <= 400
+        assert len(cache) == 4
+
+    def test_cached_endpoint(self):
+        '''
+            test responses are reused, revalidated with their ETag and rebuilt when the version changes
+        '''
+
+        app = Flask(__name__)
+        cache = ResponseCache()
+        calls = []
+        versions = {'current': 1}
+
+        @app.route('/<name>')
+        @cache.cached(lambda kwargs: versions['current'])
+        def endpoint(name):
+            calls.append(name)
+            return dict(data=dict(name=name, version=versions['current']))
+
+        client = app.test_client()
+        response = client.get('/a')
+        assert response.headers['Cache-Control'] == 'public, max-age=300'
+        etag = response.headers['ETag']
+
+        assert client.get('/a').headers['ETag'] == etag
+        assert client.get('/a', headers={'If-None-Match': etag}).status_code == 304
+        assert calls == ['a']
+
+        versions['current'] = 2
+        response = client.get('/a', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert json.loads(response.data)['data']['version'] == 2
+        assert calls == ['a', 'a']
+
+    def test_no_store(self):
+        '''
+            test a response marked with no_store is not kept or reused by clients and proxies
+        '''
+
+        app = Flask(__name__)
+        cache = ResponseCache()
+        calls = []
+
+        @app.route('/<name>')
+        @cache.cached(lambda kwargs: 1)
+        def endpoint(name):
+            calls.append(name)
+            if len(calls) == 1:
+                cache.no_store()
+            return dict(data=dict(name=name))
+
+        client = app.test_client()
+        response = client.get('/a')
+        assert response.headers['Cache-Control'] == 'no-store' and 'ETag' not in response.headers
+        assert len(cache) == 0
+
+        assert client.get('/a').headers['Cache-Control'] == 'public, max-age=300'
+        client.get('/a')
+        assert calls == ['a', 'a']
+
+    @pytest.mark.parametrize('backend', ('memory', 'mmap', 'sqlite'))
+    def test_samples_loaded_at_startup(self, ntn_samples_csv, tmp_path, monkeypatch, backend):
+        '''
+            test the configured backend and the sample index csv responses use are loaded before any request
+        '''
+
+        db_path = str(tmp_path / 'ntn_samples.db')
+        sample_db.ingest(ntn_samples_csv, db_path)
+        monkeypatch.setattr('index.ntn_samples_file', ntn_samples_csv)
+        monkeypatch.setattr('index.ntn_samples_db', db_path)
+        monkeypatch.setitem(app.config, 'SAMPLE_BACKEND', backend)
+        monkeypatch.setattr(sample_store, '_stores', {})
+        monkeypatch.setattr(sample_index, '_indexes', {})
+        monkeypatch.setattr(sample_db, '_databases', {})
+
+        load_samples()
+        index = sample_index._indexes[ntn_samples_csv]
+        loaded = dict(memory=sample_store._stores, mmap=sample_index._indexes, sqlite=sample_db._databases)[backend]
+        assert len(loaded) == 1
+
+        output = b''.join(csv_samples(['WY02'], '201601', '201601'))
+        assert sample_index._indexes[ntn_samples_csv] is index and output.count(b'\n') == 2
+
+    def test_failed_lookup_not_replayed(self, ntn_samples_csv, monkeypatch):
+        '''
+            test a lookup that fails answers without data once, rather than for as long as it is cached
+        '''
+
+        monkeypatch.setattr('index.ntn_samples_file', ntn_samples_csv)
+        monkeypatch.setitem(app.config, 'SAMPLE_BACKEND', 'memory')
+        lookup = rollups.lookup
+
+        def locked(*args):
+            raise RuntimeError('database is locked')
+
+        monkeypatch.setattr(rollups, 'lookup', locked)
+
+        client = app.test_client()
+        url = '/v1.0/ntn/samples/aggregate/?site_id=WY02&start_date=1451606400&end_date=1483228800&period=annual'
+        response = client.get(url)
+        assert response.status_code == 200 and json.loads(response.data)['data'] == {}
+        assert response.headers['Cache-Control'] == 'no-store'
+
+        monkeypatch.setattr(rollups, 'lookup', lookup)
+        assert list(json.loads(client.get(url).data)['data']['WY02']) == ['2016', '2017']
+
+    def test_samples_version_loads_catalog(self, ntn_samples_csv, ntn_sites_server, tmp_path, monkeypatch):
+        '''
+            test samples selected by state are keyed by the site catalog's version once it is loaded
+        '''
+
+        monkeypatch.setattr(site_catalog, 'cache_dir', str(tmp_path))
+        monkeypatch.setattr(site_catalog, '_catalogs', {})
+        monkeypatch.setattr('index.ntn_samples_file', ntn_samples_csv)
+        monkeypatch.setattr('index.ntn_sites_url', ntn_sites_server.url)
+
+        version = samples_version(dict(state='WY'))
+        assert version[1] is not None
+        assert version[1] == site_catalog.get_catalog(ntn_sites_server.url).version
+
+
+@pytest.mark.data
+class TestFastJSON:
+    '''
+        Unit tests pertaining to the JSON encoding found in common/fast_json.py
+    '''
+
+    def test_matches_jsonify(self, ntn_samples_csv, monkeypatch):
+        '''
+            test responses are byte for byte what jsonify produced, with and without orjson
+        '''
+
+        store = sample_store.SampleStore(ntn_samples_csv)
+        rows = store.get('AB32', '201609', '201610')
+        expected = dict(data={'AB32': {row['labno']: {key: value for key, value in row.items()
+                                                      if key not in ('siteID', 'labno')} for row in rows}},
+                        errors=dict(), next_cursor=None)
+        data = fast_json.join_object([('AB32', fast_json.join_object(
+            sorted((row['labno'], store.fragment(row)) for row in rows)))])
+
+        with Flask(__name__).app_context():
+            jsonified = jsonify(expected).data
+
+            assert fast_json.response(dict(data=data, errors=dict(), next_cursor=None)).data == jsonified
+            monkeypatch.setattr(fast_json, 'orjson', None)
+            assert fast_json.response(dict(expected)).data == jsonified
+
+    def test_fragments_cached(self, ntn_samples_csv):
+        '''
+            test rows and site records are only encoded once
+        '''
+
+        store = sample_store.SampleStore(ntn_samples_csv)
+        row = store.get('WY02', '201601', '201601')[0]
+        assert store.fragment(row) is store.fragment(row)
+
+        sites = site_catalog.parse_sites(ntn_sites_csv)
+        assert fast_json.site_fragments(sites) is fast_json.site_fragments(sites)
+        assert json.loads(fast_json.site_fragments(sites)['AB32']) == sites['AB32']
+
+
+@pytest.mark.data
+class TestCompression:
+    '''
+        Unit tests pertaining to the response compression found in common/compression.py
+    '''
+
+    def test_cached_payloads(self, monkeypatch):
+        '''
+            test a cached response is compressed once per encoding, with its own ETag
+        '''
+
+        app = Flask(__name__)
+        compression.init_app(app)
+        cache = ResponseCache()
+        compressed = []
+        compress = compression.compress
+        monkeypatch.setattr(compression, 'compress', lambda body, encoding: compressed.append(encoding) or compress(body, encoding))
+
+        @app.route('/large')
+        @cache.cached(lambda kwargs: 1)
+        def large():
+            return dict(data=['sample'] * 1000)
+
+        client = app.test_client()
+        plain = client.get('/large')
+        assert 'Content-Encoding' not in plain.headers
+        assert plain.headers['Vary'] == 'Accept-Encoding'
+
+        for i in range(2):
+            response = client.get('/large', headers={'Accept-Encoding': 'gzip, deflate'})
+            assert response.headers['Content-Encoding'] == 'gzip'
+            assert gzip.decompress(response.data) == plain.data
+        assert compressed == ['gzip']
+        assert response.headers['ETag'] != plain.headers['ETag']
+        assert cache.size == len(plain.data) + len(response.data)
+
+        revalidated = client.get('/large', headers={'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['ETag']})
+        assert revalidated.status_code == 304
+
+    def test_streamed_and_small_responses(self):
+        '''
+            test streamed responses are compressed as they are generated and small ones are not compressed
+        '''
+
+        app = Flask(__name__)
+        compression.init_app(app)
+        lines = [json.dumps(dict(labno=i)) + '\n' for i in range(20000)]
+
+        @app.route('/stream')
+        def stream():
+            return app.response_class(iter(lines), mimetype='application/x-ndjson')
+
+        @app.route('/small')
+        def small():
+            return dict(data=dict())
+
+        client = app.test_client()
+        response = client.get('/stream', headers={'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(response.data) == ''.join(lines).encode('utf8')
+
+        assert 'Content-Encoding' not in client.get('/small', headers={'Accept-Encoding': 'gzip'}).headers
+
+
+@pytest.mark.data
+class TestLogger:
+    '''
+        Unit tests pertaining to the queued, structured logging found in common/logger.py
+    '''
+
+    def test_get_logger_idempotent(self, tmp_path):
+        '''
+            test getting a logger twice adds a single queue handler
+        '''
+
+        log_file = str(tmp_path / 'idempotent.log')
+        first = logger.get_logger('test_idempotent', log_file)
+        second = logger.get_logger('test_idempotent', log_file)
+
+        assert first is second
+        assert len(first.handlers) == 1
+
+    def test_request_records(self, tmp_path):
+        '''
+            test records logged during a request are JSON lines carrying its id, path and timings
+        '''
+
+        log_file = str(tmp_path / 'request.log')
+        test_log = logger.get_logger('test_request_records', log_file)
+
+        test_app = Flask(__name__)
+        metrics.init_app(test_app)
+        logger.init_app(test_app)
+
+        @test_app.route('/logged')
+        def logged():
+            with metrics.phase('lookup'):
+                pass
+            test_log.error('lookup failed')
+            return dict(data=dict())
+
+        response = test_app.test_client().get('/logged?site_id=AK01', headers={'X-Request-ID': 'abc123'})
+        assert response.headers['X-Request-ID'] == 'abc123'
+        assert len(test_app.test_client().get('/logged').headers['X-Request-ID']) == 32
+
+        logger.get_listener(log_file).queue.join()
+        with open(log_file) as f:
+            record = json.loads(f.readline())
+
+        assert record['message'] == 'lookup failed'
+        assert record['level'] == 'ERROR'
+        assert record['request_id'] == 'abc123'
+        assert record['method'] == 'GET'
+        assert record['path'] == '/logged?site_id=AK01'
+        assert 'lookup' in record['timings']
+
+    def test_rate_limit(self):
+        '''
+            test repeats of a message past the burst are suppressed, and counted on the next one let through
+        '''
+
+        rate_limit = logger.RateLimitFilter(interval=60, burst=2)
+        records = [logging.LogRecord('test', logging.ERROR, __file__, 1, 'upstream down', None, None)
+                   for _ in range(6)]
+
+        assert [rate_limit.filter(record) for record in records[:5]] == [True, True, False, False, False]
+        assert rate_limit.filter(logging.LogRecord('test', logging.ERROR, __file__, 1, 'other', None, None))
+
+        # move the window back past the interval
+        for window in rate_limit._windows.values():
+            window[0] -= 61
+        assert rate_limit.filter(records[5])
+        assert records[5].suppressed == 3
+
+    def test_full_queue_drops(self):
+        '''
+            test a full queue drops records instead of blocking
+        '''
+
+        handler = logger.NonBlockingQueueHandler(queue.Queue(1))
+        before = logger.dropped_records.value(reason='queue_full')
+        for _ in range(3):
+            handler.handle(logging.LogRecord('test', logging.ERROR, __file__, 1, 'message', None, None))
+
+        assert handler.queue.qsize() == 1
+        assert logger.dropped_records.value(reason='queue_full') == before + 2
+
+
+@pytest.mark.data
+class TestMetrics:
+    '''
+        Unit tests pertaining to the request metrics found in common/metrics.py
+    '''
+
+    def test_histogram_render(self):
+        '''
+            test histogram buckets are cumulative and end with +Inf, _sum and _count
+        '''
+
+        histogram = metrics.Histogram('test_seconds', 'Test.', ('endpoint',), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 5.0):
+            histogram.observe(value, endpoint='a')
+
+        assert histogram.render()[2:] == [
+            'test_seconds_bucket{endpoint="a",le="0.1"} 1',
+            'test_seconds_bucket{endpoint="a",le="1.0"} 2',
+            'test_seconds_bucket{endpoint="a",le="+Inf"} 3',
+            'test_seconds_sum{endpoint="a"} 5.55',
+            'test_seconds_count{endpoint="a"} 3',
+        ]
+
+    def test_request_phases(self):
+        '''
+            test requests record their total latency and phases, and report the phases in Server-Timing
+        '''
+
+        app = Flask(__name__)
+        metrics.init_app(app)
+
+        @app.route('/phases')
+        @metrics.validated
+        def phases():
+            with metrics.phase('lookup'):
+                pass
+            return dict(data=dict())
+
+        before = metrics.request_latency.count(endpoint='phases', status=200)
+        response = app.test_client().get('/phases')
+
+        assert [timing.split(';')[0] for timing in response.headers['Server-Timing'].split(', ')] == \
+            ['validation', 'lookup']
+        assert metrics.request_latency.count(endpoint='phases', status=200) == before + 1
+        assert metrics.phase_latency.count(endpoint='phases', phase='lookup') >= 1
+
+    def test_streamed_phases(self):
+        '''
+            test a streamed body records its phases when it has been sent, without counting nested phases twice
+        '''
+
+        app = Flask(__name__)
+        metrics.init_app(app)
+
+        def slow(items, seconds):
+            for item in items:
+                time.sleep(seconds)
+                yield item
+
+        @app.route('/streamed')
+        def streamed():
+            rows = (row + b'\n' for row in metrics.timed(slow([b'a', b'b'], 0.05), 'lookup'))
+            return Response(stream_with_context(metrics.timed(slow(rows, 0.01), 'serialization')))
+
+        lookup = metrics.phase_latency.total(endpoint='streamed', phase='lookup')
+        serialization = metrics.phase_latency.total(endpoint='streamed', phase='serialization')
+        assert app.test_client().get('/streamed').data == b'a\nb\n'
+
+        assert metrics.phase_latency.total(endpoint='streamed', phase='lookup') - lookup >= 0.1
+        assert 0.02 <= metrics.phase_latency.total(endpoint='streamed', phase='serialization') - serialization < 0.07
+
+    def test_metrics_endpoint(self, ntn_samples_csv):
+        '''
+            test /metrics reports response cache lookups and dataset reloads
+        '''
+
+        before = metrics.dataset_reloads.value(dataset='memory')
+        sample_store.get_store(ntn_samples_csv)
+        assert metrics.dataset_reloads.value(dataset='memory') == before + 1
+
+        body = app.test_client().get('/metrics').data.decode('utf8')
+        assert '# TYPE ntn_response_cache_requests_total counter' in body
+        assert 'ntn_response_cache_requests_total{result="hit"}' in body
+        assert 'ntn_dataset_reloads_total{dataset="memory"}' in body
+        assert 'ntn_request_duration_seconds_bucket' in body
+
+
+@pytest.mark.data
+class TestSyntheticData:
+    '''
+        Unit tests pertaining to the synthetic benchmark data found in benchmarks/synthetic.py
+    '''
+
+    def test_generate(self, tmp_path):
+        '''
+            test the generated files load into the sample store and site catalog
+        '''
+
+        samples_path, sites_path, count = synthetic.generate(str(tmp_path), 1)
+        store = sample_store.SampleStore(samples_path)
+        with open(sites_path, encoding='utf8') as sites_file:
+            sites = site_catalog.parse_sites(sites_file.read())
+
+        assert sorted(store.site_ids()) == sorted(sites) == sorted(synthetic.site_ids(1))
+        assert count == synthetic.base_sites * synthetic.base_years * 52
+        assert len(set(synthetic.site_ids(100))) == synthetic.base_sites * 100
+
+
+def random_sites(count, seed=2300):
+    '''
+        Build a site catalog of count sites scattered over the globe.
+    '''
+
+    rng = Random(seed)
+    return {'S{:03d}'.format(i): {'latitude': str(rng.uniform(-90, 90)), 'longitude': str(rng.uniform(-180, 180)), 'status': 'A'}
+            for i in range(count)}
+
+
+@pytest.mark.data
+class TestSiteGrid:
+    '''
+        Unit tests pertaining to the spatial index found in common/spatial.py
+    '''
+
+    @pytest.mark.parametrize('location', ((42.4944, -108.8320), (0, 0), (89.5, 10), (-89.9, -170),
+                                          (10, 179.9), (-10, -179.9), (65.155, -147.491)))
+    @pytest.mark.parametrize('radius', (0, 50, 500, 2500, 3958.8))
+    def test_matches_linear_scan(self, location, radius):
+        '''
+            test the grid returns the same sites as checking every site
+        '''
+
+        sites = random_sites(400)
+        grid = spatial.SiteGrid(sites, cell_size=2.0)
+        expected = [site_id for site_id, site in sites.items()
+                    if point_within_radius(location, (float(site['latitude']), float(site['longitude'])), radius)]
+        assert sorted(grid.within_radius(location, radius)) == sorted(expected)
+
+    @pytest.mark.parametrize('radius', (0, 25, 300, 1500))
+    def test_within_radius_mask_parity(self, radius):
+        '''
+            test the vectorized distance check agrees with point_within_radius over a grid of query points
+        '''
+
+        sites = random_sites(60)
+        latitudes = [float(site['latitude']) for site in sites.values()]
+        longitudes = [float(site['longitude']) for site in sites.values()]
+        # include a point exactly on each site so the radius 0 edge case is covered.
+        query_points = [(lat, lon) for lat in range(-80, 81, 20) for lon in range(-180, 180, 45)]
+        query_points += list(zip(latitudes[:5], longitudes[:5]))
+
+        for location in query_points:
+            mask = spatial.within_radius_mask(location, numpy.array(latitudes), numpy.array(longitudes), radius)
+            expected = [point_within_radius(location, site, radius) for site in zip(latitudes, longitudes)]
+            assert list(mask) == expected
+
+    def test_haversine_miles(self):
+        '''
+            test the batch haversine distance stays within the allowed error of the geodesic distance
+        '''
+
+        sites = random_sites(200)
+        latitudes = numpy.array([float(site['latitude']) for site in sites.values()])
+        longitudes = numpy.array([float(site['longitude']) for site in sites.values()])
+        miles = spatial.haversine_miles((42.4944, -108.8320), latitudes, longitudes)
+
+        for i in range(len(miles)):
+            geodesic = distance.distance((42.4944, -108.8320), (latitudes[i], longitudes[i])).miles
+            assert abs(miles[i] - geodesic) <= spatial.haversine_error * geodesic
+
+    def test_candidates_pruned(self):
+        '''
+            test a small radius only looks at nearby cells
+        '''
+
+        grid = spatial.SiteGrid(random_sites(400), cell_size=2.0)
+        assert len(grid.candidates((0, 0), 50)) < len(grid.coordinates) / 10
+
+    def test_invalid_coordinates_skipped(self):
+        '''
+            test sites without usable coordinates are left out of the grid
+        '''
+
+        grid = spatial.SiteGrid({'AB32': {'latitude': '57.2096', 'longitude': '-111.6471'},
+                                 'XX01': {'latitude': '', 'longitude': ''}})
+        assert grid.within_radius((57.2096, -111.6471), 0) == ['AB32']
+
+    @pytest.mark.parametrize('location', ((42.4944, -108.8320), (0, 0), (89.5, 10), (-10, -179.9)))
+    @pytest.mark.parametrize('k', (1, 5, 50, 500))
+    def test_nearest_matches_sorted_scan(self, location, k):
+        '''
+            test the k nearest sites are the first k of every site sorted by distance
+        '''
+
+        sites = random_sites(400)
+        for i, site in enumerate(sites.values()):
+            site['status'] = 'I' if i % 3 == 0 else 'A'
+        grid = spatial.SiteGrid(sites, cell_size=2.0)
+
+        for statuses in (['A', 'I'], ['A']):
+            expected = sorted((distance.distance(location, (float(site['latitude']), float(site['longitude']))).miles, site_id)
+                              for site_id, site in sites.items() if site['status'] in statuses)
+            nearest = grid.nearest(location, k, statuses)
+            assert [site_id for site_id, miles in nearest] == [site_id for miles, site_id in expected[:k]]
+            assert [miles for site_id, miles in nearest] == pytest.approx([miles for miles, site_id in expected[:k]])
+
+    def test_nearest_pruned(self, monkeypatch):
+        '''
+            test a nearest site search stops widening once it has found k sites
+        '''
+
+        grid = spatial.SiteGrid(random_sites(400), cell_size=2.0)
+        searched = []
+        candidates = grid.candidates
+        monkeypatch.setattr(grid, 'candidates', lambda location, radius: searched.append(radius) or candidates(location, radius))
+
+        grid.nearest((0, 0), 1)
+        assert max(searched) < spatial.max_search_radius
+
+
+@pytest.mark.data
+class TestSiteSearch:
+    '''
+        Unit tests pertaining to the site search index found in common/site_search.py
+    '''
+
+    @pytest.mark.parametrize('bbox', (None, (40, -110, 45, -100), (-90, -180, 90, 180), (10, 170, 80, -170), (0, 0, 0, 0)))
+    @pytest.mark.parametrize('filters', ({}, {'state': 'wy'}, {'status': 'I'}, {'state': 'AK', 'status': 'A'}))
+    def test_matches_linear_scan(self, bbox, filters):
+        '''
+            test the search index returns the same sites as checking every site
+        '''
+
+        sites = random_sites(400)
+        for i, site in enumerate(sites.values()):
+            site.update(state=('WY', 'AK', 'AB')[i % 3], status='I' if i % 4 == 0 else 'A')
+        sites['S000'].update(latitude='', longitude='')
+
+        def inside(site):
+            if bbox is None:
+                return True
+            try:
+                lat, lon = float(site['latitude']), float(site['longitude'])
+            except ValueError:
+                return False
+            in_lon = bbox[1] <= lon <= bbox[3] if bbox[1] <= bbox[3] else lon >= bbox[1] or lon <= bbox[3]
+            return bbox[0] <= lat <= bbox[2] and in_lon
+
+        expected = sorted(site_id for site_id, site in sites.items()
+                          if inside(site) and all(site[key] == value.upper() for key, value in filters.items()))
+        assert site_search.SiteSearchIndex(sites).search(bbox, **filters) == expected
+
+    def test_index_built_once_per_version(self):
+        '''
+            test the index is reused until the catalog version changes
+        '''
+
+        sites = random_sites(10)
+        index = site_search.get_search_index(sites, 'a')
+        assert site_search.get_search_index(sites, 'a') is index
+        assert site_search.get_search_index(sites, 'b') is not index
+
+    @pytest.mark.parametrize('bbox', ('(40,-110,45)', '(40,-110,45,test)', '(45,-110,40,-100)', '(40,-181,45,-100)', '(-91,-110,45,-100)', ''))
+    def test_invalid_bbox(self, bbox):
+        '''
+            test invalid bbox
+        '''
+
+        assert pytest.raises(ValidationError, validate_bbox, bbox)
+
+
 @pytest.mark.endpoint
 class Test_NTN_Get_By_ID_Endpoint:
     '''
@@ -171,6 +1585,148 @@ class Test_NTN_Get_By_ID_Endpoint:
         }
         assert json.loads(response.text) == expected_response
 
+    def test_ntn_get_by_id_ndjson(self, host):
+        '''
+            test streaming samples as newline delimited json
+        '''
+
+        url = self.ntn_samples_formattable_url.format(host=host, version='v1.0', site_id="AB32", start_date=1472688000, end_date=1475193600)
+        response = requests.get(url + '&format=ndjson', stream=True)
+        assert response.status_code == 200
+        assert response.headers['Content-Type'] == 'application/x-ndjson'
+        samples = [json.loads(line) for line in response.iter_lines() if line]
+        assert [sample['labno'] for sample in samples] == ['TQ0742SW', 'TQ1132SW']
+        assert all(sample['siteID'] == 'AB32' for sample in samples)
+
+    def test_ntn_get_by_id_csv(self, host):
+        '''
+            test returning the matching rows of NTN-All-w.csv as csv
+        '''
+
+        url = self.ntn_samples_formattable_url.format(host=host, version='v1.0', site_id="AB32", start_date=1472688000, end_date=1475193600)
+        response = requests.get(url + '&format=csv')
+        assert response.status_code == 200
+        assert response.headers['Content-Type'].startswith('text/csv')
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        assert sorted(row['labno'] for row in rows) == ['TQ0742SW', 'TQ1132SW']
+        assert rows[0]['Br'] == '-9'
+
+    def test_ntn_get_by_id_fields(self, host):
+        '''
+            test returning only the requested columns of each sample
+        '''
+
+        url = self.ntn_samples_formattable_url.format(host=host, version='v1.0', site_id="AB32", start_date=1472688000, end_date=1475193600)
+        response = requests.get(url + '&fields=Ca,NO3')
+        assert response.status_code == 200
+        samples = json.loads(response.text)['data']['AB32']
+        assert all(sorted(sample) == ['Ca', 'NO3'] for sample in samples.values())
+
+    @pytest.mark.parametrize('params', ('&fields=bogus', '&fields=', '&fields=siteID', '&fields=Ca&format=csv'))
+    def test_ntn_get_by_id_invalid_fields(self, host, params):
+        '''
+            test invalid fields, and fields with format=csv
+        '''
+
+        url = self.ntn_samples_formattable_url.format(host=host, version='v1.0', site_id="AB32", start_date=1472688000, end_date=1475193600)
+        response = requests.get(url + params)
+        assert response.status_code == 400
+        assert set(json.loads(response.text)['errors']) & {'01x016', '01x017'}
+
+    def test_ntn_get_by_id_site_ids(self, host):
+        '''
+            test samples for several sites in one call
+        '''
+
+        url = self.ntn_samples_base_url.format(host=host, version='v1.0')
+        response = requests.get(url, params={'site_ids': 'AB32,wy02', 'start_date': 1472688000, 'end_date': 1475193600})
+        assert response.status_code == 200
+        response_json = json.loads(response.text)
+        assert sorted(response_json['data']) == ['AB32', 'WY02']
+        assert sorted(response_json['data']['AB32']) == ['TQ0742SW', 'TQ1132SW']
+
+    def test_ntn_get_by_id_state(self, host):
+        '''
+            test samples for every site in a state
+        '''
+
+        url = self.ntn_samples_base_url.format(host=host, version='v1.0')
+        response = requests.get(url, params={'state': 'ab', 'start_date': 1472688000, 'end_date': 1475193600})
+        assert response.status_code == 200
+        assert 'AB32' in json.loads(response.text)['data']
+
+    @pytest.mark.parametrize('site_ids', ('', 'AB32,123', ','.join(['AB32'] * 101)))
+    def test_ntn_get_by_id_invalid_site_ids(self, host, site_ids):
+        '''
+            test invalid site_ids
+        '''
+
+        url = self.ntn_samples_base_url.format(host=host, version='v1.0')
+        response = requests.get(url, params={'site_ids': site_ids, 'start_date': 1472688000, 'end_date': 1475193600})
+        assert response.status_code == 400
+        assert '01x009' in json.loads(response.text)['errors']
+
+    def test_ntn_get_by_id_location(self, host):
+        '''
+            test samples for every site within a radius are returned grouped by site
+        '''
+
+        url = self.ntn_samples_base_url.format(host=host, version='v1.0')
+        params = {'location': '(42.4944,-108.8320)', 'radius': 20, 'start_date': 1472688000, 'end_date': 1475193600}
+        response = requests.get(url, params=params)
+        assert response.status_code == 200
+        assert set(json.loads(response.text)['data']) <= {'WY02', 'WY97'}
+
+    @pytest.mark.parametrize('params,error', (({'location': '(42.4944,-108.8320)'}, '01x002'), ({'radius': 20}, '01x006')))
+    def test_ntn_get_by_id_location_without_radius(self, host, params, error):
+        '''
+            test location and radius are only accepted together
+        '''
+
+        url = self.ntn_samples_base_url.format(host=host, version='v1.0')
+        params.update({'start_date': 1472688000, 'end_date': 1475193600})
+        response = requests.get(url, params=params)
+        assert response.status_code == 400
+        assert error in json.loads(response.text)['errors']
+
+    @pytest.mark.parametrize('params', ({'site_id': 'AB32', 'state': 'AB'}, {'site_id': 'AB32', 'site_ids': 'AB32'},
+                                        {'site_id': 'AB32', 'location': '(42.4944,-108.8320)', 'radius': 20}))
+    def test_ntn_get_by_id_multiple_selections(self, host, params):
+        '''
+            test more than one of site_id, site_ids, state and location
+        '''
+
+        url = self.ntn_samples_base_url.format(host=host, version='v1.0')
+        params.update({'start_date': 1472688000, 'end_date': 1475193600})
+        response = requests.get(url, params=params)
+        assert response.status_code == 400
+        assert '01x011' in json.loads(response.text)['errors']
+
+    @pytest.mark.parametrize('format', ('xml', ''))
+    def test_ntn_get_by_id_invalid_format(self, host, format):
+        '''
+            test invalid format
+        '''
+
+        url = self.ntn_samples_formattable_url.format(host=host, version='v1.0', site_id="AB32", start_date=1472688000, end_date=1475193600)
+        response = requests.get(url + '&format=' + format)
+        assert response.status_code == 400
+        response_json = json.loads(response.text)
+        assert '01x008' in response_json['errors']
+
+    def test_ntn_get_by_id_not_modified(self, host):
+        '''
+            test a repeated call with the returned ETag gets a 304
+        '''
+
+        url = self.ntn_samples_formattable_url.format(host=host, version='v1.0', site_id="ab32", start_date=1472688000, end_date=1475193600)
+        response = requests.get(url)
+        assert response.status_code == 200
+        assert 'max-age' in response.headers['Cache-Control']
+
+        response = requests.get(url, headers={'If-None-Match': response.headers['ETag']})
+        assert response.status_code == 304
+
     def test_ntn_get_by_id_invalid_version(self, host):
         '''
             test invalid version
@@ -447,3 +2003,192 @@ class Test_NTN_Site_Info_By_Radius_Endpoint:
             assert '01x006' in response_json['errors']
         elif param == 'radius':
             assert '01x002' in response_json['errors']
+
+
+@pytest.mark.endpoint
+class Test_NTN_Site_Nearest_Endpoint:
+    ntn_site_nearest_formattable_url = '{host}/{version}/ntn/site/nearest/?location={location}&k={k}'
+
+    def test_ntn_site_nearest_200(self, host):
+        '''
+            test a good call returns the nearest sites closest first
+        '''
+
+        response = requests.get(self.ntn_site_nearest_formattable_url.format(host=host, version='v1.0', location='(42.4944,-108.8320)', k=2))
+        assert response.status_code == 200
+        data = json.loads(response.text)['data']
+        assert [site['site_id'] for site in data] == ['WY97', 'WY02']
+        assert data[0]['distance'] == 0
+        assert data[0]['site']['siteName'] == 'South Pass City'
+
+    def test_ntn_site_nearest_active_only(self, host):
+        '''
+            test inactive sites are left out when include_inactive is False
+        '''
+
+        url = self.ntn_site_nearest_formattable_url.format(host=host, version='v1.0', location='(42.4944,-108.8320)', k=20)
+        response = requests.get(url + '&include_inactive=False')
+        assert response.status_code == 200
+        assert all(site['site']['status'] == 'A' for site in json.loads(response.text)['data'])
+
+    @pytest.mark.parametrize('k', ('test', '0', '101'))
+    def test_ntn_site_nearest_invalid_k(self, host, k):
+        '''
+            test invalid k
+        '''
+
+        response = requests.get(self.ntn_site_nearest_formattable_url.format(host=host, version='v1.0', location='(42.4944,-108.8320)', k=k))
+        assert response.status_code == 400
+        response_json = json.loads(response.text)
+        assert '01x002' in response_json['errors']
+
+
+@pytest.mark.endpoint
+class Test_NTN_Site_Search_Endpoint:
+    ntn_site_search_base_url = '{host}/{version}/ntn/site/search/'
+
+    def test_ntn_site_search_200(self, host):
+        '''
+            test a good call returns the sites inside the box matching every filter
+        '''
+
+        url = self.ntn_site_search_base_url.format(host=host, version='v1.0')
+        response = requests.get(url, params={'bbox': '(42,-109.5,43,-108)', 'state': 'WY', 'status': 'A', 'fields': 'state,status'})
+        assert response.status_code == 200
+        data = json.loads(response.text)['data']
+        assert {'WY02', 'WY97'} <= set(data)
+        assert all(site == {'state': 'WY', 'status': 'A'} for site in data.values())
+
+    @pytest.mark.parametrize('param,value,error', (('bbox', '(42,-109.5,43)', '01x018'), ('state', 'WYO', '01x010'),
+                                                   ('status', 'X', '01x019')))
+    def test_ntn_site_search_invalid_param(self, host, param, value, error):
+        '''
+            test invalid query string parameters
+        '''
+
+        response = requests.get(self.ntn_site_search_base_url.format(host=host, version='v1.0'), params={param: value})
+        assert response.status_code == 400
+        assert error in json.loads(response.text)['errors']
+
+
+@pytest.mark.endpoint
+class Test_NTN_Samples_Aggregate_Endpoint:
+    '''
+        tests pertaining to the ntn/samples/aggregate/ endpoint
+    '''
+
+    ntn_samples_aggregate_base_url = '{host}/{version}/ntn/samples/aggregate/'
+    params = {'site_id': 'AK01', 'start_date': 1420070400, 'end_date': 1475193600}
+
+    def test_ntn_samples_aggregate_200(self, host):
+        '''
+            test a good call returns annual rollups of the selected analytes
+        '''
+
+        url = self.ntn_samples_aggregate_base_url.format(host=host, version='v1.0')
+        response = requests.get(url, params=dict(self.params, site_id='ak01', period='annual', analytes='SO4,ph'))
+        assert response.status_code == 200
+        response_json = json.loads(response.text)
+        assert response_json['errors'] == {}
+
+        periods = response_json['data']['AK01']
+        assert periods and set(periods) <= {'2015', '2016'}
+        for result in periods.values():
+            assert 'ppt' in result and set(result) <= {'ppt', 'SO4', 'ph'}
+            for analyte in set(result) - {'ppt'}:
+                assert set(result[analyte]) == {'count', 'mean', 'weighted_mean'}
+                assert result[analyte]['count'] > 0
+
+    def test_ntn_samples_aggregate_monthly(self, host):
+        '''
+            test rollups are monthly, within the date window, by default
+        '''
+
+        response = requests.get(self.ntn_samples_aggregate_base_url.format(host=host, version='v1.0'), params=self.params)
+        assert response.status_code == 200
+        periods = json.loads(response.text)['data']['AK01']
+        assert periods and all(len(key) == 6 and '201501' <= key <= '201609' for key in periods)
+
+    def test_ntn_samples_aggregate_site_id_not_found(self, host):
+        '''
+            test site_id not found
+        '''
+
+        response = requests.get(self.ntn_samples_aggregate_base_url.format(host=host, version='v1.0'),
+                                params=dict(self.params, site_id='9999'))
+        assert response.status_code == 200
+        assert json.loads(response.text) == {'data': {}, 'errors': {}}
+
+    def test_ntn_samples_aggregate_invalid_version(self, host):
+        '''
+            test invalid version
+        '''
+
+        response = requests.get(self.ntn_samples_aggregate_base_url.format(host=host, version='v1.1'), params=self.params)
+        assert response.status_code == 400
+        assert '01x001' in json.loads(response.text)['errors']
+
+    @pytest.mark.parametrize('param,value,error', (('period', 'weekly', '01x012'), ('analytes', 'XX', '01x013'),
+                                                   ('analytes', 'SO4,XX', '01x013'), ('site_id', '123', '01x004'),
+                                                   ('start_date', '-1', '01x002'), ('end_date', 'test', '01x002')))
+    def test_ntn_samples_aggregate_invalid_param(self, host, param, value, error):
+        '''
+            test invalid query string parameters
+        '''
+
+        response = requests.get(self.ntn_samples_aggregate_base_url.format(host=host, version='v1.0'),
+                                params=dict(self.params, **{param: value}))
+        assert response.status_code == 400
+        assert error in json.loads(response.text)['errors']
+
+    @pytest.mark.parametrize('param,error', (('start_date', '01x002'), ('end_date', '01x002'), ('site_id', '01x004')))
+    def test_ntn_samples_aggregate_missing_param(self, host, param, error):
+        '''
+            test missing query string parameters
+        '''
+
+        params = dict(self.params)
+        params.pop(param)
+        response = requests.get(self.ntn_samples_aggregate_base_url.format(host=host, version='v1.0'), params=params)
+        assert response.status_code == 400
+        assert error in json.loads(response.text)['errors']
+
+    def test_ntn_samples_aggregate_invalid_date_window(self, host):
+        '''
+            test a start_date after the end_date
+        '''
+
+        response = requests.get(self.ntn_samples_aggregate_base_url.format(host=host, version='v1.0'),
+                                params=dict(self.params, start_date=1475193600, end_date=1420070400))
+        assert response.status_code == 400
+
+
+@pytest.mark.endpoint
+class Test_NTN_Samples_Statistics_Endpoint:
+    ntn_samples_statistics_base_url = '{host}/{version}/ntn/samples/statistics/'
+
+    def test_ntn_samples_statistics_200(self, host):
+        '''
+            test a good call returns statistics for the site and analyte
+        '''
+
+        url = self.ntn_samples_statistics_base_url.format(host=host, version='v1.0')
+        response = requests.get(url, params={'site_id': 'AK01', 'analyte': 'SO4', 'start_date': 1420070400,
+                                             'end_date': 1475193600, 'percentiles': '10,90'})
+        assert response.status_code == 200
+        statistics = json.loads(response.text)['data']['AK01']['SO4']
+        assert set(statistics) == {'summary', 'percentiles', 'seasonal', 'trend', 'monthly'}
+        assert set(statistics['percentiles']) == {'10', '90'}
+
+    @pytest.mark.parametrize('param,value,error', (('analyte', 'XX', '01x020'), ('window', '0', '01x002'),
+                                                   ('percentiles', '101', '01x021'), ('percentiles', 'test', '01x021')))
+    def test_ntn_samples_statistics_invalid_param(self, host, param, value, error):
+        '''
+            test invalid query string parameters
+        '''
+
+        params = {'site_id': 'AK01', 'analyte': 'SO4', 'start_date': 1420070400, 'end_date': 1475193600}
+        params[param] = value
+        response = requests.get(self.ntn_samples_statistics_base_url.format(host=host, version='v1.0'), params=params)
+        assert response.status_code == 400
+        assert error in json.loads(response.text)['errors']